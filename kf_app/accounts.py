@@ -0,0 +1,84 @@
+"""Учётные записи и сессии.
+
+Логин и хэш пароля хранит django.contrib.auth, профиль зрителя - kf_app.User,
+связанный с учётной записью через User.account. В сессии лежат
+is_authenticated, username, email и user_id профиля: шаблоны и views читают
+их оттуда, не обращаясь к таблицам пользователей.
+"""
+from django.contrib import auth
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import User
+
+
+class RegistrationError(Exception):
+    pass
+
+
+def session_user_id(request):
+    """id пользователя kf_app.User для текущей сессии или None.
+
+    Сессии без user_id (выданные до его появления) сбрасываются: email в
+    сессии не проверен, искать по нему профиль нельзя - зритель входит заново.
+    """
+    if not request.session.get('is_authenticated'):
+        return None
+    user_id = request.session.get('user_id')
+    if user_id is None:
+        request.session.flush()
+    return user_id
+
+
+async def asession_user_id(request):
+    """session_user_id для async views."""
+    if not await request.session.aget('is_authenticated'):
+        return None
+    user_id = await request.session.aget('user_id')
+    if user_id is None:
+        await request.session.aflush()
+    return user_id
+
+
+def register(username, email, password):
+    """Создаёт учётную запись и профиль; возвращает учётную запись."""
+    Account = auth.get_user_model()
+    if not username or not email or not password:
+        raise RegistrationError('Заполните все поля')
+    if Account.objects.filter(username=username).exists():
+        raise RegistrationError('Имя пользователя уже занято')
+    if User.objects.filter(email=email, account__isnull=False).exists():
+        raise RegistrationError('Пользователь с такой почтой уже зарегистрирован')
+    if User.objects.filter(email=email).exists():
+        # Профиль, заведённый ранее (например, в админке), сам к учётной записи не привязывается:
+        # владение почтой не подтверждено, а профиль хранит подписки и историю.
+        # Привязка - вручную в админке (поле User.account)
+        raise RegistrationError('Профиль с такой почтой уже есть: обратитесь в поддержку для привязки')
+
+    account = Account(username=username, email=email)
+    try:
+        validate_password(password, account)
+    except ValidationError as exc:
+        raise RegistrationError(' '.join(exc.messages))
+
+    try:
+        with transaction.atomic():
+            account.set_password(password)
+            account.save()
+            User.objects.create(account=account, email=email, first_name=username)
+    except IntegrityError:
+        # Параллельная регистрация с тем же именем или почтой
+        raise RegistrationError('Имя пользователя или почта уже заняты')
+    return account
+
+
+def login(request, account):
+    """Входит в систему (с новым ключом сессии) и кладёт данные профиля в сессию."""
+    auth.login(request, account)
+    profile = User.objects.filter(account=account).values_list('pk', 'email').first()
+    request.session['is_authenticated'] = True
+    request.session['username'] = account.get_username()
+    request.session['email'] = profile[1] if profile else account.email
+    if profile:
+        request.session['user_id'] = profile[0]
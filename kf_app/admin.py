@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import *
 
 admin.site.register(User)
-admin.site.register(MediaContent)
+
 admin.site.register(Favorite)
 admin.site.register(ViewHistory)
 admin.site.register(Subscription)
@@ -12,5 +12,15 @@ admin.site.register(ContentParticipation)
 admin.site.register(Genre)
 admin.site.register(Season)
 admin.site.register(Episode)
+admin.site.register(VideoIndex)
+admin.site.register(FacetCount)
+admin.site.register(Rating)
+admin.site.register(Recommendation)
+admin.site.register(MediaBlob)
+admin.site.register(StoredFile)
 
 
+@admin.register(MediaContent)
+class MediaContentAdmin(admin.ModelAdmin):
+    # Рейтинг считается из rating_prior и голосов (см. kf_app.ratings): правится rating_prior
+    readonly_fields = ('rating', 'rating_sum', 'rating_count')
@@ -0,0 +1,301 @@
+"""JSON API каталога только для чтения.
+
+- fields=a,b,c выбирает поля ответа; в SELECT попадают только нужные столбцы.
+- ETag и Last-Modified считаются по updated_at (для списка - MAX(updated_at)
+  и числу строк) одним лёгким запросом до чтения каталога, поэтому повторный
+  запрос клиента с If-None-Match получает 304 без основных запросов.
+- Списки отдаются потоком: строки читаются итератором и кодируются по одной.
+- Кодировщик - orjson, если он установлен, иначе стандартный json.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition, require_safe
+
+from . import fragments
+from .facets import apply_filters, selected_filters
+from .models import ContentParticipation, Episode, MediaContent, Person
+from .navigation import neighbours
+from .pagination import after_cursor, make_cursor
+from .series_tree import get_tree
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CONTENT_TYPE = 'application/json'
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+MEDIA_FIELDS = (
+    'id', 'title', 'description', 'release_date', 'country', 'rating', 'rating_count',
+    'age_restriction', 'duration', 'content_type', 'poster', 'image',
+)
+MEDIA_LIST_DEFAULT = ('id', 'title', 'release_date', 'rating', 'content_type', 'poster')
+# Поля детальной карточки, которые требуют отдельных запросов
+MEDIA_RELATED = ('genres', 'people')
+EPISODE_FIELDS = ('id', 'season_number', 'episode_number', 'title', 'description', 'duration', 'release_date', 'has_video')
+PERSON_FIELDS = ('id', 'first_name', 'last_name', 'biography', 'photo')
+FILE_FIELDS = ('poster', 'image', 'photo')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), content_type=CONTENT_TYPE, status=status)
+
+
+def api_view(view):
+    """GET/HEAD, ошибки в JSON и обязательная перепроверка кэша клиентом."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            response = view(request, *args, **kwargs)
+        except ApiError as exc:
+            return json_response({'error': str(exc)}, status=exc.status)
+        except Http404 as exc:
+            return json_response({'error': str(exc) or 'Не найдено'}, status=404)
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+    return require_safe(wrapper)
+
+
+def parse_fields(request, allowed, default):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ApiError(f"Неизвестные поля: {', '.join(unknown)}")
+    return fields
+
+
+def file_url(name):
+    return default_storage.url(name) if name else None
+
+
+def clean_row(row, fields):
+    for name in FILE_FIELDS:
+        if name in row:
+            row[name] = file_url(row[name])
+    return {name: row[name] for name in fields}
+
+
+# Версии содержимого для условных запросов
+
+def conditional(state_func):
+    """condition() по state_func(request, **kwargs) -> (updated_at, маркер) или None.
+
+    Состояние читается из базы (updated_at / MAX(updated_at)), поэтому все
+    воркеры отдают одинаковые ETag и Last-Modified. Маркер (число строк или
+    версия фрагментов) ловит удаление: MAX(updated_at) от него не меняется.
+    """
+    def get_state(request, kwargs):
+        # Обе функции condition() вызываются для одного запроса - читаем состояние один раз
+        if not hasattr(request, '_api_state'):
+            request._api_state = state_func(request, **kwargs)
+        return request._api_state
+
+    def etag(request, *args, **kwargs):
+        state = get_state(request, kwargs)
+        if state is None:
+            return None
+        updated_at, marker = state
+        # Полный адрес - это тип, фильтры, курсор и поля ответа
+        source = f'{request.get_full_path()}|{updated_at.isoformat()}|{marker}'
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        state = get_state(request, kwargs)
+        return state[0] if state else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def catalog_state(request, **kwargs):
+    queryset = MediaContent.objects.all()
+    if request.GET.get('type') in dict(MediaContent.CONTENT_TYPES):
+        queryset = queryset.filter(content_type=request.GET['type'])
+    updated_at = queryset.aggregate(last=Max('updated_at'))['last']
+    if updated_at is None:
+        return None
+    # Без COUNT по всему каталогу: удаление тайтла поднимает версию 'home' (сигнал media_changed_fragments)
+    return updated_at, fragments.get_versions([('home', 0)])[0]
+
+
+def media_state(request, pk):
+    # Сезоны, эпизоды, участники и жанры поднимают updated_at тайтла
+    updated_at = MediaContent.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return (updated_at, 1) if updated_at else None
+
+
+def episode_state(request, episode_id):
+    row = (
+        Episode.objects.filter(pk=episode_id)
+        .values_list('updated_at', 'season__media_content__updated_at').first()
+    )
+    if row is None:
+        return None
+    # Соседние эпизоды (previous/next) меняют updated_at сериала
+    return max(row), 1
+
+
+def person_state(request, pk):
+    # Фильмография: добавление участия поднимает updated_at тайтла, удаление - меняет число
+    state = Person.objects.filter(pk=pk).aggregate(
+        person=Max('updated_at'),
+        media=Max('contentparticipation__media_content__updated_at'),
+        count=Count('contentparticipation'),
+    )
+    if state['person'] is None:
+        return None
+    return max(filter(None, (state['person'], state['media']))), state['count']
+
+
+# Эндпоинты
+
+@api_view
+@conditional(catalog_state)
+def catalog(request):
+    """Список тайтлов: ?type=MOVIE|SERIES, фильтры каталога, after=<курсор>, limit, fields."""
+    fields = parse_fields(request, MEDIA_FIELDS, MEDIA_LIST_DEFAULT)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise ApiError("limit должен быть числом")
+
+    queryset = MediaContent.objects.all()
+    content_type = request.GET.get('type')
+    if content_type:
+        if content_type not in dict(MediaContent.CONTENT_TYPES):
+            raise ApiError("type: MOVIE или SERIES")
+        queryset = queryset.filter(content_type=content_type)
+    queryset = after_cursor(apply_filters(queryset, selected_filters(request.GET)), request.GET.get('after'))
+
+    # release_date и id нужны для курсора, даже если клиент их не просил
+    columns = list(dict.fromkeys(fields + ['id', 'release_date']))
+    rows = queryset.values(*columns)[:limit + 1]
+
+    def stream():
+        yield b'{"results":['
+        last = None
+        for index, row in enumerate(rows.iterator(chunk_size=limit + 1)):
+            if index == limit:
+                yield b'],"next":' + dumps(make_cursor(*last)) + b'}'
+                return
+            last = (row['release_date'], row['id'])
+            yield (b',' if index else b'') + dumps(clean_row(row, fields))
+        yield b'],"next":null}'
+
+    return StreamingHttpResponse(stream(), content_type=CONTENT_TYPE)
+
+
+@api_view
+@conditional(media_state)
+def media_detail(request, pk):
+    fields = parse_fields(request, MEDIA_FIELDS + MEDIA_RELATED, MEDIA_FIELDS + MEDIA_RELATED)
+    columns = [name for name in fields if name not in MEDIA_RELATED]
+    row = MediaContent.objects.filter(pk=pk).values(*(columns or ['id'])).first()
+    if row is None:
+        raise Http404("Тайтл не найден")
+    data = clean_row(row, columns)
+    if 'genres' in fields:
+        data['genres'] = list(
+            MediaContent.genres.through.objects.filter(mediacontent_id=pk)
+            .order_by('genre__name').values_list('genre__name', flat=True)
+        )
+    if 'people' in fields:
+        data['people'] = [
+            {'id': person_id, 'name': f'{first_name} {last_name}', 'role': role, 'role_name': role_name}
+            for person_id, first_name, last_name, role, role_name in
+            ContentParticipation.objects.filter(media_content_id=pk)
+            .values_list('person_id', 'person__first_name', 'person__last_name', 'role', 'role_name')
+        ]
+    return json_response(data)
+
+
+@api_view
+@conditional(media_state)
+def series_tree(request, pk):
+    if not MediaContent.objects.filter(pk=pk, content_type='SERIES').exists():
+        raise Http404("Сериал не найден")
+    fields = parse_fields(request, EPISODE_FIELDS, EPISODE_FIELDS)
+    tree = get_tree(pk)
+    seasons = [
+        {
+            'id': season['id'],
+            'season_number': season['season_number'],
+            'description': season['description'],
+            'episodes': [
+                {name: dict(episode, season_number=season['season_number'])[name] for name in fields}
+                for episode in season['episodes']
+            ],
+        }
+        for season in tree['seasons']
+    ]
+    return json_response({'id': pk, 'total_episodes': tree['total_episodes'], 'seasons': seasons})
+
+
+@api_view
+@conditional(episode_state)
+def episode_detail(request, episode_id):
+    fields = parse_fields(request, EPISODE_FIELDS + ('series', 'previous', 'next'), EPISODE_FIELDS + ('series', 'previous', 'next'))
+    episode = Episode.objects.filter(pk=episode_id).select_related('season').first()
+    if episode is None:
+        raise Http404("Эпизод не найден")
+    previous_episode, next_episode = neighbours(episode)
+    values = {
+        'id': episode.pk,
+        'season_number': episode.season.season_number,
+        'episode_number': episode.episode_number,
+        'title': episode.title,
+        'description': episode.description,
+        'duration': episode.duration,
+        'release_date': episode.release_date,
+        'has_video': bool(episode.video_file),
+        'series': episode.season.media_content_id,
+        'previous': previous_episode,
+        'next': next_episode,
+    }
+    return json_response({name: values[name] for name in fields})
+
+
+@api_view
+@conditional(person_state)
+def person_detail(request, pk):
+    fields = parse_fields(request, PERSON_FIELDS + ('filmography',), PERSON_FIELDS + ('filmography',))
+    columns = [name for name in fields if name != 'filmography']
+    row = Person.objects.filter(pk=pk).values(*(columns or ['id'])).first()
+    if row is None:
+        raise Http404("Персона не найдена")
+    data = clean_row(row, columns)
+    if 'filmography' in fields:
+        data['filmography'] = [
+            {'id': media_id, 'title': title, 'content_type': content_type, 'release_date': release_date,
+             'role': role, 'role_name': role_name}
+            for media_id, title, content_type, release_date, role, role_name in
+            ContentParticipation.objects.filter(person_id=pk)
+            .order_by('-media_content__release_date')
+            .values_list('media_content_id', 'media_content__title', 'media_content__content_type',
+                         'media_content__release_date', 'role', 'role_name')
+        ]
+    return json_response(data)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class KfAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kf_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
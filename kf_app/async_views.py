@@ -0,0 +1,156 @@
+"""Async-версии страниц каталога и раздачи видео для запуска под ASGI.
+
+Основные запросы идут через async ORM (aget, afirst, async for). Кэш,
+персональные данные и шаблон - синхронный код, он собран в одну функцию на
+страницу и выполняется через sync_to_async одним переходом в поток.
+Видео отдаётся aserve_file: медленный зритель не держит поток, а только
+задачу в цикле событий.
+
+urls.py подключает эти views вместо kf_app.views при KF_ASYNC_VIEWS=1
+(kf_project/asgi.py включает его по умолчанию).
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.shortcuts import aget_object_or_404, render
+from django.utils.http import urlencode
+from django.views.decorators.http import require_safe
+
+from . import entitlements, favorites, progress, ratings, recommendations, video
+from .accounts import asession_user_id
+from .conditional import episode_state, list_state, media_state, page_condition
+from .facets import apply_filters, facet_groups, selected_filters
+from .models import ContentParticipation, Episode, MediaContent
+from .navigation import neighbours
+from .pagination import akeyset_page
+from .series_tree import get_tree
+from .streaming import aserve_file
+
+arender = sync_to_async(render)
+
+
+async def catalog_page(request, content_type):
+    filters = selected_filters(request.GET)
+    items, next_cursor = await akeyset_page(
+        apply_filters(MediaContent.objects.filter(content_type=content_type), filters), request.GET.get('after')
+    )
+    user_id = await asession_user_id(request)
+    context = {
+        'next_cursor': next_cursor,
+        'filter_query': urlencode(filters),
+        'favorite_ids': await sync_to_async(favorites.favorite_ids)(user_id),
+    }
+    return items, filters, context
+
+
+@page_condition(list_state('MOVIE'))
+async def movies_list(request):
+    movies, filters, context = await catalog_page(request, 'MOVIE')
+    context.update(movies=movies, facets=await sync_to_async(facet_groups)('MOVIE', filters))
+    return await arender(request, 'kf_app/movies.html', context)
+
+
+@page_condition(list_state('MOVIE'))
+async def movies_page(request):
+    movies, filters, context = await catalog_page(request, 'MOVIE')
+    context.update(items=movies, detail_url='kf_app:movie_detail')
+    return await arender(request, 'kf_app/partials/media_cards.html', context)
+
+
+@page_condition(list_state('SERIES'))
+async def series_list(request):
+    series, filters, context = await catalog_page(request, 'SERIES')
+    context.update(series=series, facets=await sync_to_async(facet_groups)('SERIES', filters))
+    return await arender(request, 'kf_app/series.html', context)
+
+
+@page_condition(list_state('SERIES'))
+async def series_page(request):
+    series, filters, context = await catalog_page(request, 'SERIES')
+    context.update(items=series, detail_url='kf_app:series_detail')
+    return await arender(request, 'kf_app/partials/media_cards.html', context)
+
+
+def participants(media):
+    # Ленивый queryset: вычисляется в шаблоне, только если фрагмент «В ролях» не взят из кэша
+    return ContentParticipation.objects.filter(media_content=media).select_related('person')
+
+
+@sync_to_async
+def media_extras(user_id, media_id):
+    """Персональная часть карточки тайтла: читается из кэша или отдельными запросами."""
+    return {
+        'user_vote': ratings.user_vote(user_id, media_id),
+        'rating_scale': ratings.SCALE,
+        'is_favorite': media_id in favorites.favorite_ids(user_id),
+        'similar': recommendations.similar(media_id),
+    }
+
+
+@page_condition(media_state('MOVIE'))
+async def movie_detail(request, pk):
+    movie = await aget_object_or_404(MediaContent, pk=pk, content_type='MOVIE')
+    user_id = await asession_user_id(request)
+
+    context = await media_extras(user_id, movie.pk)
+    context.update({
+        'media': movie,
+        'participants': participants(movie),
+        'resume_seconds': await sync_to_async(progress.resume_position)(user_id, media_content_id=movie.pk) if user_id else 0,
+        'can_watch': await sync_to_async(entitlements.can_watch)(user_id),
+    })
+    return await arender(request, 'kf_app/movie_detail.html', context)
+
+
+@page_condition(media_state('SERIES'))
+async def series_detail(request, pk):
+    series = await aget_object_or_404(MediaContent, pk=pk, content_type='SERIES')
+    user_id = await asession_user_id(request)
+    tree = await sync_to_async(get_tree)(series.pk)
+
+    context = await media_extras(user_id, series.pk)
+    context.update({
+        'media': series,
+        'participants': participants(series),
+        'seasons': tree['seasons'],
+        'total_episodes': tree['total_episodes'],
+    })
+    return await arender(request, 'kf_app/series_detail.html', context)
+
+
+@page_condition(episode_state)
+async def episode_detail(request, episode_id):
+    episode = await aget_object_or_404(Episode.objects.select_related('season__media_content'), pk=episode_id)
+    previous_episode, next_episode = await sync_to_async(neighbours)(episode)
+    user_id = await asession_user_id(request)
+
+    context = {
+        'episode': episode,
+        'season': episode.season,
+        'series': episode.season.media_content,
+        'previous_episode': previous_episode,
+        'next_episode': next_episode,
+        'resume_seconds': await sync_to_async(progress.resume_position)(user_id, episode_id=episode.pk) if user_id else 0,
+        'can_watch': await sync_to_async(entitlements.can_watch)(user_id),
+    }
+    return await arender(request, 'kf_app/episode_detail.html', context)
+
+
+async def stream(request, item):
+    if not item.video_file:
+        raise Http404("Видео недоступно")
+    if not await sync_to_async(entitlements.can_watch)(await asession_user_id(request)):
+        raise PermissionDenied("Нужна активная подписка")
+    seconds = progress.parse_position(request.GET.get('t'))
+    seek = await sync_to_async(video.seek_offset)(item, seconds) if seconds is not None else None
+    return await aserve_file(request, item.video_file.path, seek=seek)
+
+
+@require_safe
+async def movie_stream(request, pk):
+    return await stream(request, await aget_object_or_404(MediaContent, pk=pk, content_type='MOVIE'))
+
+
+@require_safe
+async def episode_stream(request, episode_id):
+    return await stream(request, await aget_object_or_404(Episode, pk=episode_id))
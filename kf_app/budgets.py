@@ -0,0 +1,69 @@
+"""Бюджеты страниц: сколько SQL-запросов и миллисекунд допускается на ответ.
+
+Бюджет запросов проверяется и в тестах (kf_app.tests), и командой
+bench_views на большом каталоге (seed_catalog): число запросов не должно
+расти с размером каталога, история пользователя - тоже. Запросы считаются
+с пустым кэшем, поэтому в бюджет входят построение дерева сериала,
+навигации и фильтров. Бюджет времени (p95) проверяет только bench_views.
+"""
+from django.urls import reverse
+
+from .models import Episode, Genre, MediaContent
+
+# url name -> (запросов на ответ, p95 в мс)
+VIEW_BUDGETS = {
+    'index': (4, 50),
+    'movies_list': (6, 100),
+    'movies_page': (3, 60),
+    'series_list': (6, 100),
+    'movie_detail': (8, 80),
+    'series_detail': (8, 100),
+    'episode_detail': (5, 80),
+    'search': (4, 100),
+    'profile': (6, 150),
+    'api_catalog': (3, 60),
+    'api_series_tree': (4, 60),
+}
+
+
+def random_pk(queryset, rng):
+    """Случайная строка по диапазону id: без выгрузки всех id большой таблицы."""
+    bounds = queryset.order_by('pk').values_list('pk', flat=True)
+    first, last = bounds.first(), bounds.last()
+    if first is None:
+        return None
+    return bounds.filter(pk__gte=rng.randint(first, last)).first()
+
+
+def targets(rng):
+    """url name -> функция, возвращающая адрес очередного запроса к странице."""
+    movies = MediaContent.objects.filter(content_type='MOVIE')
+    series = MediaContent.objects.filter(content_type='SERIES')
+    genre_ids = list(Genre.objects.values_list('pk', flat=True))
+    countries = list(movies.values_list('country', flat=True).distinct()[:20])
+
+    def catalog_filter():
+        choice = rng.random()
+        if choice < 0.4 or not genre_ids:
+            return ''
+        if choice < 0.7:
+            return f'?genre={rng.choice(genre_ids)}'
+        return f'?country={rng.choice(countries)}' if countries else ''
+
+    def after(queryset):
+        item = queryset.filter(pk=random_pk(queryset, rng)).values_list('release_date', 'pk').first()
+        return f'?after={item[0].isoformat()}.{item[1]}' if item else ''
+
+    return {
+        'index': lambda: reverse('kf_app:index'),
+        'movies_list': lambda: reverse('kf_app:movies_list') + catalog_filter(),
+        'movies_page': lambda: reverse('kf_app:movies_page') + after(movies),
+        'series_list': lambda: reverse('kf_app:series_list') + catalog_filter(),
+        'movie_detail': lambda: reverse('kf_app:movie_detail', args=[random_pk(movies, rng)]),
+        'series_detail': lambda: reverse('kf_app:series_detail', args=[random_pk(series, rng)]),
+        'episode_detail': lambda: reverse('kf_app:episode_detail', args=[random_pk(Episode.objects.all(), rng)]),
+        'search': lambda: reverse('kf_app:search') + '?q=' + rng.choice(['тень', 'город море', 'ночь', 'звезда']),
+        'profile': lambda: reverse('kf_app:profile'),
+        'api_catalog': lambda: reverse('kf_app:api_catalog') + '?type=MOVIE&' + after(movies).lstrip('?'),
+        'api_series_tree': lambda: reverse('kf_app:api_series_tree', args=[random_pk(series, rng)]),
+    }
@@ -0,0 +1,448 @@
+"""Потоковый импорт каталога из JSONL или CSV.
+
+JSONL - один тайтл на строку:
+
+    {"id": "kp-301", "type": "MOVIE", "title": "...", "description": "...",
+     "release_date": "1999-03-31", "country": "США", "age_restriction": 16,
+     "duration": 136, "genres": ["Фантастика"],
+     "people": [{"first_name": "Киану", "last_name": "Ривз", "role": "ACTOR", "role_name": "Нео"}],
+     "seasons": [{"season_number": 1, "description": "",
+                  "episodes": [{"episode_number": 1, "title": "...", "duration": 50}]}]}
+
+CSV - заголовок с колонками id, type, title, description, release_date,
+country, age_restriction, duration, genres ("Драма|Комедия"), people
+("Имя Фамилия/ROLE/роль|..."), season, season_description, episode,
+episode_title, episode_description, episode_duration, episode_release_date.
+Строка с пустым title добавляет только эпизод к тайтлу id, объявленному
+выше или при прошлом импорте.
+
+Ключи: тайтл - MediaContent.external_id, жанр - имя, персона - имя и
+фамилия, сезон - номер в тайтле, эпизод - номер в сезоне. Пачка записей
+сравнивается с базой и пишется bulk_create(update_conflicts=True) в одной
+транзакции: неизменённые строки не трогаются, поэтому повторный импорт
+того же файла ничего не пишет. Жанры и участники тайтла заменяются, если
+ключ есть в записи; сезоны и эпизоды только добавляются и обновляются -
+удаление эпизода удалило бы историю просмотров.
+
+bulk_create не вызывает сигналы, поэтому поиск, кэш фрагментов, дерево
+сериала, навигация и updated_at обновляются здесь же, а счётчики фильтров
+пересчитываются в конце импорта.
+"""
+import csv
+import datetime
+import json
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import facets, fragments, search, series_tree
+from .models import ContentParticipation, Episode, Genre, MediaContent, Person, Season
+
+MEDIA_FIELDS = ('content_type', 'title', 'description', 'release_date', 'country', 'age_restriction', 'duration')
+EPISODE_FIELDS = ('title', 'description', 'duration', 'release_date')
+ROLES = dict(ContentParticipation.ROLE_CHOICES)
+
+
+class FeedError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"строка {line}: {message}")
+        self.line = line
+
+
+# Разбор записей
+
+def parse_date(value, line, name):
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise FeedError(line, f"{name}: ожидается дата ГГГГ-ММ-ДД, получено {value!r}")
+
+
+def parse_int(value, line, name):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise FeedError(line, f"{name}: ожидается целое число, получено {value!r}")
+
+
+def parse_episode(data, line):
+    number = parse_int(data.get('episode_number'), line, 'episode_number')
+    if number is None:
+        raise FeedError(line, "у эпизода нет episode_number")
+    return {
+        'episode_number': number,
+        'title': data.get('title') or f'Эпизод {number}',
+        'description': data.get('description') or '',
+        'duration': parse_int(data.get('duration'), line, 'duration'),
+        'release_date': parse_date(data.get('release_date'), line, 'release_date'),
+    }
+
+
+def parse_season(data, line):
+    number = parse_int(data.get('season_number'), line, 'season_number')
+    if number is None:
+        raise FeedError(line, "у сезона нет season_number")
+    return {
+        'season_number': number,
+        'description': data.get('description') or '',
+        'episodes': [parse_episode(episode, line) for episode in data.get('episodes') or []],
+    }
+
+
+def parse_person(data, line):
+    role = (data.get('role') or 'ACTOR').upper()
+    if role not in ROLES:
+        raise FeedError(line, f"неизвестная роль {role!r}")
+    first_name, last_name = (data.get('first_name') or '').strip(), (data.get('last_name') or '').strip()
+    if not first_name and not last_name:
+        raise FeedError(line, "у участника нет имени")
+    return first_name, last_name, role, data.get('role_name') or None
+
+
+def parse_title(data, line):
+    """Запись фида -> нормализованный тайтл; без title - только сезоны и эпизоды."""
+    external_id = str(data.get('id') or '').strip()
+    if not external_id:
+        raise FeedError(line, "нет id")
+    record = {'id': external_id, 'line': line}
+    if data.get('title'):
+        content_type = (data.get('type') or 'MOVIE').upper()
+        if content_type not in dict(MediaContent.CONTENT_TYPES):
+            raise FeedError(line, f"type: MOVIE или SERIES, получено {content_type!r}")
+        release_date = parse_date(data.get('release_date'), line, 'release_date')
+        if release_date is None:
+            raise FeedError(line, "нет release_date")
+        record['fields'] = {
+            'content_type': content_type,
+            'title': data['title'],
+            'description': data.get('description') or '',
+            'release_date': release_date,
+            'country': data.get('country') or '',
+            'age_restriction': parse_int(data.get('age_restriction'), line, 'age_restriction') or 0,
+            'duration': parse_int(data.get('duration'), line, 'duration'),
+        }
+    if 'genres' in data:
+        record['genres'] = list(dict.fromkeys(name.strip() for name in data['genres'] or [] if name.strip()))
+    if 'people' in data:
+        record['people'] = list(dict.fromkeys(parse_person(person, line) for person in data['people'] or []))
+    record['seasons'] = [parse_season(season, line) for season in data.get('seasons') or []]
+    return record
+
+
+def read_jsonl(lines):
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            data = json.loads(text)
+        except ValueError as exc:
+            raise FeedError(line, f"некорректный JSON: {exc}")
+        if not isinstance(data, dict):
+            raise FeedError(line, "ожидается объект")
+        yield parse_title(data, line)
+
+
+def split_people(value):
+    people = []
+    for item in filter(None, (part.strip() for part in value.split('|'))):
+        name, _, rest = item.partition('/')
+        role, _, role_name = rest.partition('/')
+        first_name, _, last_name = name.strip().partition(' ')
+        people.append({'first_name': first_name, 'last_name': last_name, 'role': role or 'ACTOR', 'role_name': role_name})
+    return people
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        line = reader.line_num
+        row = {key: (value or '').strip() for key, value in row.items() if key}
+        data = {name: row.get(name) for name in (
+            'id', 'type', 'title', 'description', 'release_date', 'country', 'age_restriction', 'duration',
+        )}
+        if row.get('title'):
+            if 'genres' in row:
+                data['genres'] = row['genres'].split('|')
+            if 'people' in row:
+                data['people'] = split_people(row['people'])
+        if row.get('season'):
+            season = {'season_number': row['season'], 'description': row.get('season_description')}
+            if row.get('episode'):
+                season['episodes'] = [{
+                    'episode_number': row['episode'],
+                    'title': row.get('episode_title'),
+                    'description': row.get('episode_description'),
+                    'duration': row.get('episode_duration'),
+                    'release_date': row.get('episode_release_date'),
+                }]
+            data['seasons'] = [season]
+        yield parse_title(data, line)
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def merge(records):
+    """Сливает записи одного id внутри пачки (в CSV каждый эпизод - отдельная строка)."""
+    merged = {}
+    for record in records:
+        current = merged.get(record['id'])
+        if current is None:
+            merged[record['id']] = dict(record, seasons=[])
+            current = merged[record['id']]
+        else:
+            for key in ('fields', 'genres', 'people'):
+                if key in record:
+                    current[key] = record[key]
+        seasons = {season['season_number']: season for season in current['seasons']}
+        for season in record['seasons']:
+            if season['season_number'] in seasons:
+                target = seasons[season['season_number']]
+                target['description'] = season['description'] or target['description']
+                target['episodes'] = target['episodes'] + season['episodes']
+            else:
+                current['seasons'].append(dict(season))
+                seasons[season['season_number']] = current['seasons'][-1]
+    return list(merged.values())
+
+
+# Запись в базу
+
+class CatalogImporter:
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        # Словари дедупликации: имя жанра и (имя, фамилия) персоны -> id
+        self.genres = dict(Genre.objects.values_list('name', 'pk'))
+        self.people = {}
+        for pk, first_name, last_name in Person.objects.order_by('pk').values_list('pk', 'first_name', 'last_name').iterator():
+            self.people.setdefault((first_name, last_name), pk)
+        self.counts = dict.fromkeys((
+            'records', 'created', 'updated', 'unchanged', 'genres', 'people',
+            'links', 'seasons', 'episodes',
+        ), 0)
+        self.facets_dirty = False
+
+    def run(self, records):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        if self.facets_dirty:
+            facets.rebuild()
+            fragments.bump('home', 0)
+        return self.counts
+
+    def import_batch(self, records):
+        self.counts['records'] += len(records)
+        records = merge(records)
+        with transaction.atomic():
+            self.ensure_genres(records)
+            self.ensure_people(records)
+            ids, written = self.upsert_titles(records)
+            touched = set(self.sync_genres(records, ids))
+            touched |= self.sync_people(records, ids)
+            series_changed, season_ids = self.upsert_episodes(records, ids)
+            touched |= series_changed
+            # У записанных тайтлов updated_at уже новый, остальным - как сигнал touch_media
+            stale = touched - written
+            if stale:
+                MediaContent.objects.filter(pk__in=stale).update(updated_at=timezone.now())
+        changed = written | touched
+        if changed:
+            search.index_documents(changed)
+            fragments.bump('media', *changed)
+            fragments.bump('season', *season_ids)
+        for series_id in series_changed:
+            series_tree.invalidate(series_id)
+
+    def ensure_genres(self, records):
+        names = {name for record in records for name in record.get('genres', ()) if name not in self.genres}
+        if names:
+            Genre.objects.bulk_create([Genre(name=name) for name in sorted(names)], ignore_conflicts=True)
+            self.genres.update(Genre.objects.filter(name__in=names).values_list('name', 'pk'))
+            self.counts['genres'] += len(names)
+
+    def ensure_people(self, records):
+        keys = {
+            (first_name, last_name) for record in records
+            for first_name, last_name, _, _ in record.get('people', ())
+            if (first_name, last_name) not in self.people
+        }
+        if keys:
+            created = Person.objects.bulk_create(
+                [Person(first_name=first_name, last_name=last_name) for first_name, last_name in sorted(keys)],
+                batch_size=self.batch_size,
+            )
+            for person in created:
+                self.people[(person.first_name, person.last_name)] = person.pk
+            self.counts['people'] += len(created)
+
+    def upsert_titles(self, records):
+        """Возвращает (external_id -> pk для всех тайтлов пачки, pk записанных тайтлов)."""
+        keys = [record['id'] for record in records]
+        existing = {
+            row['external_id']: row for row in
+            MediaContent.objects.filter(external_id__in=keys).values('pk', 'external_id', *MEDIA_FIELDS)
+        }
+        now = timezone.now()
+        rows = []
+        for record in records:
+            if 'fields' not in record:
+                if record['id'] not in existing:
+                    raise FeedError(record['line'], f"тайтл {record['id']} не найден: нет title")
+                continue
+            old = existing.get(record['id'])
+            if old is not None and all(old[name] == value for name, value in record['fields'].items()):
+                self.counts['unchanged'] += 1
+                continue
+            self.counts['updated' if old else 'created'] += 1
+            rows.append(MediaContent(external_id=record['id'], updated_at=now, **record['fields']))
+        if rows:
+            MediaContent.objects.bulk_create(
+                rows, batch_size=self.batch_size, update_conflicts=True, unique_fields=['external_id'],
+                update_fields=list(MEDIA_FIELDS) + ['updated_at'],
+            )
+            self.facets_dirty = True
+        ids = dict(MediaContent.objects.filter(external_id__in=keys).values_list('external_id', 'pk'))
+        return ids, {ids[row.external_id] for row in rows}
+
+    def sync_genres(self, records, ids):
+        through = MediaContent.genres.through
+        wanted = {ids[record['id']]: {self.genres[name] for name in record['genres']}
+                  for record in records if 'genres' in record}
+        if not wanted:
+            return set()
+        current = {}
+        for pk, media_id, genre_id in through.objects.filter(mediacontent_id__in=wanted).values_list('pk', 'mediacontent_id', 'genre_id'):
+            current.setdefault(media_id, {})[genre_id] = pk
+        add, remove, touched = [], [], set()
+        for media_id, genre_ids in wanted.items():
+            links = current.get(media_id, {})
+            add += [through(mediacontent_id=media_id, genre_id=genre_id) for genre_id in genre_ids - links.keys()]
+            remove += [pk for genre_id, pk in links.items() if genre_id not in genre_ids]
+            if genre_ids != links.keys():
+                touched.add(media_id)
+        if remove:
+            through.objects.filter(pk__in=remove).delete()
+        if add:
+            through.objects.bulk_create(add, batch_size=self.batch_size, ignore_conflicts=True)
+        if touched:
+            self.facets_dirty = True
+            self.counts['links'] += len(add) + len(remove)
+        return touched
+
+    def sync_people(self, records, ids):
+        wanted = {}
+        for record in records:
+            if 'people' in record:
+                wanted[ids[record['id']]] = {
+                    (self.people[(first_name, last_name)], role): role_name
+                    for first_name, last_name, role, role_name in record['people']
+                }
+        if not wanted:
+            return set()
+        current = {}
+        for pk, media_id, person_id, role, role_name in (
+            ContentParticipation.objects.filter(media_content_id__in=wanted)
+            .values_list('pk', 'media_content_id', 'person_id', 'role', 'role_name')
+        ):
+            current.setdefault(media_id, {})[(person_id, role)] = (pk, role_name)
+        rows, remove, touched, people = [], [], set(), set()
+        for media_id, cast in wanted.items():
+            links = current.get(media_id, {})
+            for (person_id, role), role_name in cast.items():
+                if (person_id, role) not in links or links[(person_id, role)][1] != role_name:
+                    rows.append(ContentParticipation(media_content_id=media_id, person_id=person_id, role=role, role_name=role_name))
+                    touched.add(media_id)
+                    people.add(person_id)
+            for key, (pk, _) in links.items():
+                if key not in cast:
+                    remove.append(pk)
+                    touched.add(media_id)
+                    people.add(key[0])
+        if remove:
+            ContentParticipation.objects.filter(pk__in=remove).delete()
+        if rows:
+            ContentParticipation.objects.bulk_create(
+                rows, batch_size=self.batch_size, update_conflicts=True,
+                unique_fields=['media_content', 'person', 'role'], update_fields=['role_name'],
+            )
+        if people:
+            fragments.bump('person', *people)
+        self.counts['links'] += len(rows) + len(remove)
+        return touched
+
+    def upsert_episodes(self, records, ids):
+        """Возвращает (id сериалов с изменёнными сезонами/эпизодами, id изменённых сезонов)."""
+        plan = [(ids[record['id']], season) for record in records for season in record['seasons']]
+        if not plan:
+            return set(), set()
+        media_ids = {media_id for media_id, _ in plan}
+        seasons = {
+            (media_id, number): (pk, description) for pk, media_id, number, description in
+            Season.objects.filter(media_content_id__in=media_ids)
+            .values_list('pk', 'media_content_id', 'season_number', 'description')
+        }
+        now = timezone.now()
+        changed_series, changed_seasons = set(), set()
+        rows = []
+        for media_id, season in plan:
+            old = seasons.get((media_id, season['season_number']))
+            if old is None or (season['description'] and season['description'] != old[1]):
+                description = season['description'] or (old[1] if old else '')
+                rows.append(Season(media_content_id=media_id, season_number=season['season_number'],
+                                   description=description, updated_at=now))
+                changed_series.add(media_id)
+        if rows:
+            Season.objects.bulk_create(
+                rows, batch_size=self.batch_size, update_conflicts=True,
+                unique_fields=['media_content', 'season_number'], update_fields=['description', 'updated_at'],
+            )
+            self.counts['seasons'] += len(rows)
+            seasons = {
+                (media_id, number): (pk, description) for pk, media_id, number, description in
+                Season.objects.filter(media_content_id__in=media_ids)
+                .values_list('pk', 'media_content_id', 'season_number', 'description')
+            }
+            changed_seasons |= {seasons[(row.media_content_id, row.season_number)][0] for row in rows}
+
+        season_ids = {seasons[(media_id, season['season_number'])][0]: media_id for media_id, season in plan}
+        existing = {
+            (row['season_id'], row['episode_number']): row for row in
+            Episode.objects.filter(season_id__in=season_ids).values('season_id', 'episode_number', *EPISODE_FIELDS)
+        }
+        rows = {}
+        for media_id, season in plan:
+            season_id = seasons[(media_id, season['season_number'])][0]
+            for episode in season['episodes']:
+                key = (season_id, episode['episode_number'])
+                old = existing.get(key)
+                values = {name: episode[name] for name in EPISODE_FIELDS}
+                if old is not None and all(old[name] == value for name, value in values.items()):
+                    continue
+                rows[key] = Episode(season_id=season_id, episode_number=episode['episode_number'], updated_at=now, **values)
+                changed_series.add(media_id)
+                changed_seasons.add(season_id)
+        if rows:
+            Episode.objects.bulk_create(
+                list(rows.values()), batch_size=self.batch_size, update_conflicts=True,
+                unique_fields=['season', 'episode_number'], update_fields=list(EPISODE_FIELDS) + ['updated_at'],
+            )
+            self.counts['episodes'] += len(rows)
+        return changed_series, changed_seasons
+
+
+def import_feed(lines, feed_format='jsonl', batch_size=1000):
+    """Импортирует фид из итератора строк; возвращает (счётчики, секунды)."""
+    started = time.perf_counter()
+    counts = CatalogImporter(batch_size=batch_size).run(READERS[feed_format](lines))
+    return counts, time.perf_counter() - started
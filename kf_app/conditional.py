@@ -0,0 +1,115 @@
+"""Условные ответы (304) для HTML-страниц каталога.
+
+Перед основными запросами страницы одним лёгким запросом читается
+updated_at (для списков - MAX по индексу (content_type, updated_at)), по нему
+строятся Last-Modified и ETag. ETag дополнительно включает версии кэша
+фрагментов: удаление тайтла не меняет MAX(updated_at), но меняет home:0.
+
+Страница вошедшего пользователя персональна (шапка, избранное, оценка),
+поэтому для него условная обработка не выполняется, а ответ получает
+Vary: Cookie (сессия читается всегда).
+
+Для async views состояние читается заранее через sync_to_async: condition()
+вызывает etag_func и last_modified_func синхронно прямо в цикле событий.
+Поэтому и версии фрагментов (они в базе) читаются вместе с состоянием.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db.models import Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from . import fragments
+from .models import Episode, MediaContent
+
+
+def page_condition(state_func):
+    """condition() по state_func(request, **kwargs) -> (updated_at, deps) или None."""
+    def get_state(request, kwargs):
+        if not hasattr(request, '_page_state'):
+            if request.session.get('is_authenticated'):
+                request._page_state = None
+            else:
+                state = state_func(request, **kwargs)
+                if state is not None:
+                    updated_at, deps = state
+                    state = updated_at, deps, fragments.get_versions(deps)
+                request._page_state = state
+        return request._page_state
+
+    def etag(request, *args, **kwargs):
+        state = get_state(request, kwargs)
+        if state is None:
+            return None
+        updated_at, deps, versions = state
+        source = '|'.join([request.get_full_path(), updated_at.isoformat()] + [
+            f'{scope}{pk}v{version}' for (scope, pk), version in zip(deps, versions)
+        ])
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        state = get_state(request, kwargs)
+        return state[0] if state else None
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                await sync_to_async(get_state)(request, kwargs)
+                response = await conditional_view(request, *args, **kwargs)
+                if getattr(request, '_page_state', None) is not None:
+                    patch_cache_control(response, no_cache=True)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if getattr(request, '_page_state', None) is not None:
+                # Кэш (браузер, CDN) может хранить страницу, но обязан её перепроверить
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+
+    return decorator
+
+
+def list_state(content_type):
+    def state(request, **kwargs):
+        updated_at = (
+            MediaContent.objects.filter(content_type=content_type)
+            .aggregate(last=Max('updated_at'))['last']
+        )
+        if updated_at is None:
+            return None
+        return updated_at, [('home', 0)]
+    return state
+
+
+def media_state(content_type):
+    def state(request, pk):
+        updated_at = (
+            MediaContent.objects.filter(pk=pk, content_type=content_type)
+            .values_list('updated_at', flat=True).first()
+        )
+        if updated_at is None:
+            return None
+        # Блок «Похожее» меняется при пересчёте рекомендаций
+        return updated_at, [('media', pk), ('recommendations', 0)]
+    return state
+
+
+def episode_state(request, episode_id):
+    row = (
+        Episode.objects.filter(pk=episode_id)
+        .values_list('updated_at', 'season__media_content__updated_at', 'season__media_content_id').first()
+    )
+    if row is None:
+        return None
+    episode_updated, series_updated, series_id = row
+    # Соседние эпизоды меняют навигацию, а их изменения поднимаются до сериала
+    return max(episode_updated, series_updated), [('media', series_id)]
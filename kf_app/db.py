@@ -0,0 +1,26 @@
+"""Настройка соединений SQLite.
+
+PRAGMA из DATABASES[alias]['PRAGMAS'] выполняются для каждого нового
+соединения (сигнал connection_created, см. kf_app.signals). В профиле
+production (KF_PROFILE=production) это WAL, synchronous=NORMAL, mmap и
+busy_timeout: чтение каталога не ждёт записи в ViewHistory/Favorite,
+а параллельные писатели ждут блокировку вместо "database is locked".
+"""
+
+
+def configure_connection(connection):
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def current_pragmas(connection, names=('journal_mode', 'synchronous', 'mmap_size', 'busy_timeout')):
+    values = {}
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'PRAGMA {name}')
+            values[name] = cursor.fetchone()[0]
+    return values
@@ -0,0 +1,110 @@
+"""Право на просмотр по подпискам пользователя.
+
+Окна действующих подписок пользователя (пары дат начала и окончания)
+кешируются одним ключом ent:<id>, так что страница видео и каждый
+Range-запрос плеера проверяют доступ без обращения к базе. Ключ удаляется
+сигналами при изменении UserSubscription, а командой expire_subscriptions -
+для всех затронутых пользователей разом.
+
+Удаление видно только процессам с тем же кэшем: с кэшем в памяти воркера
+ни команда, ни соседний воркер его ключ не сбросят. Поэтому ключ живёт не
+дольше, чем до ближайшей смены ответа (начала или окончания окна), а
+ответ "подписок нет" - EMPTY_TIMEOUT: продление командой или покупка в
+другом воркере становятся видны без общего кэша.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UserSubscription
+
+# Страховка на случай изменений в обход сигналов (update() вне этого модуля)
+CACHE_TIMEOUT = 3600
+EMPTY_TIMEOUT = 60
+
+
+def cache_key(user_id):
+    return f'ent:{user_id}'
+
+
+def invalidate(*user_ids):
+    keys = [cache_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def windows(user_id):
+    """Периоды активных и ещё не истёкших подписок: ((начало, конец), ...)."""
+    if user_id is None:
+        return ()
+    result = cache.get(cache_key(user_id))
+    if result is None:
+        result = tuple(
+            UserSubscription.objects.filter(user_id=user_id, status='ACTIVE', end_date__gte=timezone.localdate())
+            .order_by('start_date').values_list('start_date', 'end_date')
+        )
+        cache.set(cache_key(user_id), result, timeout(result))
+    return result
+
+
+def timeout(result, now=None):
+    """Срок жизни ключа: не дольше, чем до смены ответа has_access."""
+    if not result:
+        return EMPTY_TIMEOUT
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    boundaries = [end + datetime.timedelta(days=1) for _, end in result]
+    boundaries += [start for start, _ in result if start > today]
+    change = timezone.make_aware(datetime.datetime.combine(min(boundaries), datetime.time.min))
+    return max(1, min(CACHE_TIMEOUT, int((change - now).total_seconds())))
+
+
+def has_access(user_id, day=None):
+    day = day or timezone.localdate()
+    return any(start <= day <= end for start, end in windows(user_id))
+
+
+def can_watch(user_id):
+    if not getattr(settings, 'PLAYBACK_REQUIRES_SUBSCRIPTION', True):
+        return True
+    return has_access(user_id)
+
+
+def renewed_end(end_date, days, today):
+    """Окончание после продления на целое число периодов, чтобы покрыть сегодняшний день."""
+    periods = (today - end_date).days // days + 1
+    return end_date + datetime.timedelta(days=days * periods)
+
+
+def expire_due(today=None, dry_run=False):
+    """Закрывает истёкшие подписки и продлевает подписки с автопродлением.
+
+    Работает пакетными UPDATE по индексу (status, end_date): продление - по
+    одному запросу на пару (длительность тарифа, дата окончания), истечение -
+    одним запросом. Оплата продления здесь не проводится.
+    Возвращает (продлено, истекло).
+    """
+    today = today or timezone.localdate()
+    due = UserSubscription.objects.filter(status='ACTIVE', end_date__lt=today)
+    renewable = due.filter(auto_renewal=True, subscription__duration__gt=0)
+    groups = list(
+        renewable.values_list('subscription__duration', 'end_date').distinct().order_by()
+    )
+    if dry_run:
+        return renewable.count(), due.count() - renewable.count()
+    users = set(due.values_list('user_id', flat=True).distinct().order_by())
+
+    renewed = 0
+    with transaction.atomic():
+        for days, end_date in groups:
+            new_end = renewed_end(end_date, days, today)
+            renewed += renewable.filter(subscription__duration=days, end_date=end_date).update(
+                start_date=new_end - datetime.timedelta(days=days - 1),
+                end_date=new_end,
+            )
+        expired = due.update(status='EXPIRED')
+        invalidate(*users)
+    return renewed, expired
@@ -0,0 +1,198 @@
+"""Фильтры каталога и счётчики их значений.
+
+Счётчики хранятся в FacetCount и меняются на +1/-1 при сохранении,
+удалении и смене жанров MediaContent, поэтому страница списка читает
+готовые числа вместо GROUP BY по всему каталогу. Счётчики показывают
+общее количество тайтлов данного типа с этим значением и не зависят от
+остальных выбранных фильтров.
+"""
+import datetime
+from collections import Counter
+
+from django.db.models import Count, F, Q
+from django.db.models.functions import ExtractYear
+from django.utils.http import urlencode
+
+from .models import FacetCount, Genre, MediaContent
+
+# Полосы рейтинга: значение фильтра -> (нижняя граница, верхняя граница, подпись)
+RATING_BANDS = {
+    '9': (9, None, '9+'),
+    '8': (8, 9, '8–9'),
+    '7': (7, 8, '7–8'),
+    '6': (6, 7, '6–7'),
+    '0': (0, 6, 'ниже 6'),
+}
+FACET_PARAMS = ('genre', 'country', 'year', 'age', 'rating')
+# Границы числовых фильтров: INTEGER SQLite и PositiveIntegerField
+MAX_ID = 2 ** 63 - 1
+MAX_AGE = 2 ** 31 - 1
+
+
+def rating_band(rating):
+    for key, (low, high, _) in RATING_BANDS.items():
+        if rating >= low and (high is None or rating < high):
+            return key
+    return '0'
+
+
+def scalar_keys(content_type, country, release_date, age_restriction, rating):
+    return {
+        (content_type, 'country', country),
+        (content_type, 'year', str(release_date.year)),
+        (content_type, 'age', str(age_restriction)),
+        (content_type, 'rating', rating_band(rating or 0)),
+    }
+
+
+def media_keys(media):
+    return scalar_keys(media.content_type, media.country, media.release_date, media.age_restriction, media.rating)
+
+
+def genre_keys(content_type, genre_ids):
+    return {(content_type, 'genre', str(pk)) for pk in genre_ids}
+
+
+def apply_deltas(deltas):
+    """Применяет изменения счётчиков {ключ: +-n}.
+
+    Один INSERT OR IGNORE для новых ключей и по одному UPDATE на каждую
+    величину изменения - независимо от числа затронутых значений.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    FacetCount.objects.bulk_create(
+        [FacetCount(content_type=ct, facet=facet, value=value) for ct, facet, value in deltas],
+        ignore_conflicts=True,
+    )
+    by_delta = {}
+    for key, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(key)
+    for delta, keys in by_delta.items():
+        condition = Q()
+        for ct, facet, value in keys:
+            condition |= Q(content_type=ct, facet=facet, value=value)
+        FacetCount.objects.filter(condition).update(count=F('count') + delta)
+
+
+def apply_changes(before, after):
+    deltas = Counter()
+    for key in before - after:
+        deltas[key] -= 1
+    for key in after - before:
+        deltas[key] += 1
+    apply_deltas(deltas)
+
+
+def compute_counts():
+    """Счётчики с нуля (GROUP BY по каталогу) - для перестроения."""
+    counts = Counter()
+    rows = (
+        MediaContent.objects.annotate(year=ExtractYear('release_date'))
+        .values('content_type', 'country', 'year', 'age_restriction', 'rating')
+        .annotate(total=Count('id'))
+    )
+    for row in rows:
+        ct = row['content_type']
+        counts[(ct, 'country', row['country'])] += row['total']
+        counts[(ct, 'year', str(row['year']))] += row['total']
+        counts[(ct, 'age', str(row['age_restriction']))] += row['total']
+        counts[(ct, 'rating', rating_band(row['rating'] or 0))] += row['total']
+    genres = (
+        MediaContent.genres.through.objects
+        .values('mediacontent__content_type', 'genre_id')
+        .annotate(total=Count('id'))
+    )
+    for row in genres:
+        counts[(row['mediacontent__content_type'], 'genre', str(row['genre_id']))] += row['total']
+    return counts
+
+
+def rebuild():
+    counts = compute_counts()
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create(
+        [FacetCount(content_type=ct, facet=facet, value=value, count=total)
+         for (ct, facet, value), total in counts.items() if total],
+        batch_size=1000,
+    )
+    return len(counts)
+
+
+def selected_filters(params):
+    return {name: params.get(name) for name in FACET_PARAMS if params.get(name)}
+
+
+def bounded_int(value, low, high):
+    """Целое из параметра запроса или None, если это не число или оно вне low..high."""
+    if value and value.isascii() and value.isdigit() and len(value) <= len(str(high)):
+        number = int(value)
+        if low <= number <= high:
+            return number
+    return None
+
+
+def apply_filters(queryset, filters):
+    # Значения вне допустимого диапазона игнорируются, как и нечисловые
+    genre = bounded_int(filters.get('genre'), 1, MAX_ID)
+    if genre is not None:
+        queryset = queryset.filter(genres=genre)
+    if 'country' in filters:
+        queryset = queryset.filter(country=filters['country'])
+    year = bounded_int(filters.get('year'), datetime.MINYEAR, datetime.MAXYEAR)
+    if year is not None:
+        queryset = queryset.filter(release_date__gte=datetime.date(year, 1, 1), release_date__lte=datetime.date(year, 12, 31))
+    age = bounded_int(filters.get('age'), 0, MAX_AGE)
+    if age is not None:
+        queryset = queryset.filter(age_restriction=age)
+    if filters.get('rating') in RATING_BANDS:
+        low, high, _ = RATING_BANDS[filters['rating']]
+        queryset = queryset.filter(rating__gte=low)
+        if high is not None:
+            queryset = queryset.filter(rating__lt=high)
+    return queryset
+
+
+def facet_groups(content_type, filters):
+    """Группы фильтров для шаблона: значения со счётчиками и ссылками."""
+    rows = FacetCount.objects.filter(content_type=content_type, count__gt=0).values_list('facet', 'value', 'count')
+    by_facet = {}
+    for facet, value, count in rows:
+        by_facet.setdefault(facet, []).append((value, count))
+
+    genre_names = dict(Genre.objects.values_list('pk', 'name')) if 'genre' in by_facet else {}
+    labels = {
+        'genre': lambda value: genre_names.get(int(value), value),
+        'rating': lambda value: RATING_BANDS[value][2],
+        'age': lambda value: f'{value}+',
+    }
+    order = {
+        'genre': lambda item: item['label'],
+        'country': lambda item: item['label'],
+        'year': lambda item: -int(item['value']),
+        'age': lambda item: int(item['value']),
+        'rating': lambda item: -int(item['value']),
+    }
+
+    groups = []
+    for facet, title in FacetCount.FACETS:
+        items = []
+        for value, count in by_facet.get(facet, []):
+            active = filters.get(facet) == value
+            params = dict(filters)
+            if active:
+                params.pop(facet)
+            else:
+                params[facet] = value
+            items.append({
+                'value': value,
+                'label': labels.get(facet, str)(value),
+                'count': count,
+                'active': active,
+                'query': urlencode(params),
+            })
+        if items:
+            items.sort(key=order[facet])
+            groups.append({'facet': facet, 'title': title, 'items': items})
+    return groups
@@ -0,0 +1,58 @@
+"""Избранное пользователя.
+
+Множество id избранных тайтлов хранится в кеше одним ключом fav:<id>,
+так что сетка карточек любой длины узнаёт отметки «в избранном» за одно
+обращение к кешу. Запись не правит множество в кеше, а удаляет ключ после
+коммита: следующее чтение соберёт его заново одним запросом, и два
+параллельных запроса не затрут изменения друг друга. Повторное добавление
+гасит ограничение unique_user_media_favorite (INSERT ... ON CONFLICT DO NOTHING).
+
+Удаление видно только процессам с тем же кэшем: с кэшем в памяти воркера
+соседний воркер продолжит отдавать своё множество. Поэтому ключ живёт
+CACHE_TIMEOUT секунд - отметка, поставленная в другом воркере, появится не
+позже этого срока и без общего кэша.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Favorite
+
+CACHE_TIMEOUT = 60
+
+
+def cache_key(user_id):
+    return f'fav:{user_id}'
+
+
+def invalidate(user_id):
+    transaction.on_commit(lambda: cache.delete(cache_key(user_id)))
+
+
+def favorite_ids(user_id):
+    if user_id is None:
+        return frozenset()
+    ids = cache.get(cache_key(user_id))
+    if ids is None:
+        ids = frozenset(Favorite.objects.filter(user_id=user_id).values_list('media_content_id', flat=True))
+        cache.set(cache_key(user_id), ids, CACHE_TIMEOUT)
+    return ids
+
+
+def add(user_id, media_id):
+    Favorite.objects.bulk_create([Favorite(user_id=user_id, media_content_id=media_id)], ignore_conflicts=True)
+    invalidate(user_id)
+    return True
+
+
+def remove(user_id, media_id):
+    Favorite.objects.filter(user_id=user_id, media_content_id=media_id).delete()
+    invalidate(user_id)
+    return False
+
+
+def toggle(user_id, media_id):
+    """Переключает отметку и возвращает новое состояние."""
+    if Favorite.objects.filter(user_id=user_id, media_content_id=media_id).exists():
+        return remove(user_id, media_id)
+    return add(user_id, media_id)
+
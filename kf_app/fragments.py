@@ -0,0 +1,107 @@
+"""Кэш HTML-фрагментов с версионными ключами.
+
+Ключ фрагмента включает версии объектов, от которых он зависит
+(media:<id>, person:<id>, home:0). Версии хранятся в базе (FragmentVersion),
+поэтому все воркеры видят одну и ту же версию, а bump() в транзакции правки
+откатывается вместе с ней. Сигналы увеличивают версию при изменении объекта,
+и старые фрагменты просто перестают запрашиваться - без TTL и без поиска
+ключей для удаления.
+"""
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import FragmentVersion
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def read_rows(deps):
+    """(scope, pk) -> (версия, дата изменения) для уже менявшихся объектов из deps."""
+    condition = Q()
+    for scope, pk in deps:
+        condition |= Q(scope=scope, object_id=pk)
+    if not condition:
+        return {}
+    rows = FragmentVersion.objects.filter(condition).values_list('scope', 'object_id', 'version', 'changed_at')
+    return {(scope, pk): (version, changed_at) for scope, pk, version, changed_at in rows}
+
+
+def get_versions(deps, known=None):
+    """Версии объектов deps одним запросом; known - уже прочитанные за этот запрос."""
+    deps = [(scope, int(pk)) for scope, pk in deps]
+    known = {} if known is None else known
+    missing = {dep for dep in deps if dep not in known}
+    if missing:
+        rows = read_rows(missing)
+        # Объект, который ещё не менялся, имеет версию 0
+        known.update({dep: rows.get(dep, (0, None))[0] for dep in missing})
+    return [known[dep] for dep in deps]
+
+
+def get_state(deps):
+    """(версии, время последнего изменения или None) объектов deps одним запросом."""
+    deps = [(scope, int(pk)) for scope, pk in deps]
+    rows = read_rows(set(deps))
+    versions = [rows.get(dep, (0, None))[0] for dep in deps]
+    return versions, max((changed_at for _, changed_at in rows.values()), default=None)
+
+
+def bump(scope, *pks):
+    pks = {int(pk) for pk in pks if pk is not None}
+    if not pks:
+        return
+    now = timezone.now()
+    # Версия не меньше времени изменения в мс: после отката транзакции или
+    # восстановления базы новая версия не совпадёт с уже использованной в кэше
+    stamp = int(now.timestamp() * 1000)
+    with transaction.atomic():
+        existing = FragmentVersion.objects.filter(scope=scope, object_id__in=pks)
+        existing.update(version=Greatest(F('version') + 1, Value(stamp)), changed_at=now)
+        missing = pks - set(existing.values_list('object_id', flat=True))
+        FragmentVersion.objects.bulk_create(
+            [FragmentVersion(scope=scope, object_id=pk, version=stamp, changed_at=now) for pk in missing],
+            ignore_conflicts=True,
+        )
+
+
+def record(name, outcome):
+    with _stats_lock:
+        _stats[(name, outcome)] += 1
+
+
+def cached(name, deps, render, known=None):
+    deps = [(scope, pk) for scope, pk in deps]
+    versions = get_versions(deps, known)
+    key = 'frag:' + name + ':' + ':'.join(
+        f'{scope}{pk}v{version}' for (scope, pk), version in zip(deps, versions)
+    )
+    html = cache.get(key)
+    if html is None:
+        record(name, 'miss')
+        html = render()
+        cache.set(key, html, None)
+    else:
+        record(name, 'hit')
+    return html
+
+
+def stats():
+    """Счётчики попаданий/промахов текущего процесса по именам фрагментов."""
+    with _stats_lock:
+        items = dict(_stats)
+    result = {}
+    for (name, outcome), count in items.items():
+        result.setdefault(name, {'hit': 0, 'miss': 0})[outcome] = count
+    total_hits = sum(item['hit'] for item in result.values())
+    total = total_hits + sum(item['miss'] for item in result.values())
+    return {
+        'fragments': result,
+        'hit_ratio': round(total_hits / total, 4) if total else None,
+    }
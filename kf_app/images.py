@@ -0,0 +1,141 @@
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from . import fragments
+from .models import ContentParticipation, MediaContent, Person
+
+logger = logging.getLogger(__name__)
+
+# Ширины производных изображений (px) и форматы, в которых они хранятся
+WIDTHS = (150, 300, 600, 900)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Ширина для браузеров без srcset
+FALLBACK_WIDTH = 300
+DERIVATIVES_DIR = 'derivatives'
+HASH_CHUNK = 1024 * 1024
+
+
+def source_digest(field):
+    digest = hashlib.sha256()
+    with field.storage.open(field.name, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_name(digest, width, ext):
+    # Имя зависит только от содержимого исходника: новый файл - новые производные
+    return f'{DERIVATIVES_DIR}/{digest[:2]}/{digest[:32]}_{width}.{ext}'
+
+
+def build(field):
+    """Создаёт недостающие производные и возвращает их описание.
+
+    {'name': ..., 'digest': ..., 'widths': [...]} - имя исходника и ширины,
+    для которых есть файлы.
+    """
+    digest = source_digest(field)
+    with field.storage.open(field.name, 'rb') as fh:
+        image = Image.open(fh)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    widths = [width for width in WIDTHS if width < image.width] or [image.width]
+    for width in widths:
+        resized = None
+        for ext, (fmt, _, options) in FORMATS.items():
+            name = derivative_name(digest, width, ext)
+            if default_storage.exists(name):
+                continue
+            if resized is None:
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.LANCZOS)
+            out = resized.convert('RGB') if fmt == 'JPEG' else resized
+            buffer = io.BytesIO()
+            out.save(buffer, fmt, **options)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+    return {'name': field.name, 'digest': digest, 'widths': widths}
+
+
+def image_fields(instance):
+    return [field.name for field in instance._meta.fields if isinstance(field, models.ImageField)]
+
+
+def stale_fields(instance):
+    """Поля-изображения, у которых файл сменился после построения производных."""
+    return [
+        name for name in image_fields(instance)
+        if getattr(instance, name) and (instance.derivatives.get(name) or {}).get('name') != getattr(instance, name).name
+    ]
+
+
+def update(instance, force=False):
+    """Строит производные для сменившихся изображений записи и сохраняет описание в instance.derivatives.
+
+    Вызывается после загрузки (см. kf_app.signals) и командой
+    build_image_derivatives; возвращает число построенных изображений.
+    """
+    names = image_fields(instance) if force else stale_fields(instance)
+    derivatives = dict(instance.derivatives)
+    built = 0
+    for name in names:
+        field = getattr(instance, name)
+        if not field:
+            derivatives.pop(name, None)
+            continue
+        try:
+            derivatives[name] = build(field)
+            built += 1
+        except (OSError, UnidentifiedImageError) as exc:
+            # Запоминаем и неудачу: страница отдаёт исходник, а сохранения не пытаются снова
+            logger.warning("Не удалось построить производные для %s: %s", field.name, exc)
+            derivatives[name] = {'name': field.name, 'digest': None, 'widths': []}
+    if derivatives != instance.derivatives:
+        # update() без сигналов: иначе сохранение записи снова запустило бы построение
+        now = timezone.now()
+        type(instance).objects.filter(pk=instance.pk).update(derivatives=derivatives, updated_at=now)
+        instance.derivatives = derivatives
+        if isinstance(instance, Person):
+            # Фото выводится в блоке «В ролях» тайтлов с этой персоной
+            media_ids = list(ContentParticipation.objects.filter(person=instance).values_list('media_content_id', flat=True))
+            MediaContent.objects.filter(pk__in=media_ids).update(updated_at=now)
+            fragments.bump('person', instance.pk)
+            fragments.bump('media', *media_ids)
+        else:
+            # Постер есть и в «Новинках» главной страницы
+            fragments.bump('media', instance.pk)
+            fragments.bump('home', 0)
+    return built
+
+
+def get_manifest(field):
+    """Описание производных поля из записи или None: тогда шаблон отдаёт исходный файл.
+
+    При рендеринге ничего не хэшируется и не декодируется - производные
+    строятся только при загрузке и командой.
+    """
+    if not field:
+        return None
+    manifest = field.instance.derivatives.get(field.field.name)
+    if manifest and manifest['name'] == field.name and manifest['widths']:
+        return manifest
+    return None
+
+
+def srcset(manifest, ext):
+    return ', '.join(
+        f"{default_storage.url(derivative_name(manifest['digest'], width, ext))} {width}w"
+        for width in manifest['widths']
+    )
+
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from kf_app.models import Episode, MediaContent
+
+from .bench_sqlite import percentile
+
+
+def stream_url():
+    movie = MediaContent.objects.filter(content_type='MOVIE').exclude(video_file='').exclude(video_file=None).first()
+    if movie and os.path.exists(movie.video_file.path):
+        return reverse('kf_app:movie_stream', args=[movie.pk])
+    for episode in Episode.objects.exclude(video_file='').exclude(video_file=None):
+        if os.path.exists(episode.video_file.path):
+            return reverse('kf_app:episode_stream', args=[episode.pk])
+    raise CommandError("Нет тайтла или эпизода с видеофайлом")
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает раздачу видео через WSGI (пул потоков) и ASGI (async views) "
+        "при множестве одновременных медленных зрителей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help="Одновременных зрителей")
+        parser.add_argument('--workers', type=int, default=8, help="Потоков WSGI-сервера")
+        parser.add_argument('--bytes', type=int, default=2 * 1024 * 1024, help="Сколько байт скачивает зритель (Range)")
+        parser.add_argument('--chunk-delay', type=float, default=0.02,
+                            help="Сколько секунд медленный клиент принимает одну порцию")
+        parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='both')
+        # Прогон внутри дочернего процесса: urls.py выбирает views по KF_ASYNC_VIEWS при импорте
+        parser.add_argument('--child', action='store_true', help="Внутренний флаг")
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.run(options)
+        modes = ['wsgi', 'asgi'] if options['mode'] == 'both' else [options['mode']]
+        for mode in modes:
+            env = dict(
+                os.environ, KF_ASYNC_VIEWS='1' if mode == 'asgi' else '0',
+                KF_PLAYBACK_REQUIRES_SUBSCRIPTION='0',
+            )
+            command = [
+                sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_delivery', '--child',
+                '--mode', mode, '--clients', str(options['clients']), '--workers', str(options['workers']),
+                '--bytes', str(options['bytes']), '--chunk-delay', str(options['chunk_delay']),
+            ]
+            result = subprocess.run(command, env=env)
+            if result.returncode:
+                raise CommandError(f"Прогон {mode} завершился с кодом {result.returncode}")
+
+    def run(self, options):
+        url = stream_url()
+        byte_range = f"bytes=0-{options['bytes'] - 1}"
+        mode = options['mode']
+        if mode == 'wsgi':
+            title = f"WSGI, {options['workers']} потоков"
+            started = time.perf_counter()
+            results = self.run_wsgi(url, byte_range, options)
+        else:
+            title = "ASGI, async views"
+            started = time.perf_counter()
+            results = asyncio.run(self.run_asgi(url, byte_range, options))
+        elapsed = time.perf_counter() - started
+
+        ttfb = [result['ttfb'] for result in results if result['ttfb'] is not None]
+        durations = [result['duration'] for result in results]
+        total = sum(result['bytes'] for result in results)
+        failed = sum(1 for result in results if result['status'] != 206)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{title}: {len(results)} зрителей, {url}"))
+        self.stdout.write(
+            f"  Всего {elapsed:.2f} с, {total / elapsed / 1024 / 1024:.1f} МиБ/с, "
+            f"пиковое число потоков {max(result['threads'] for result in results)}"
+        )
+        self.stdout.write(
+            f"  Первый байт: p50 {percentile(ttfb, 0.5) * 1000:.0f} мс, p99 {percentile(ttfb, 0.99) * 1000:.0f} мс"
+        )
+        self.stdout.write(
+            f"  Загрузка: p50 {percentile(durations, 0.5) * 1000:.0f} мс, "
+            f"p99 {percentile(durations, 0.99) * 1000:.0f} мс, ошибок {failed}"
+        )
+
+    def run_wsgi(self, url, byte_range, options):
+        from django.core.handlers.wsgi import WSGIHandler
+
+        handler = WSGIHandler()
+        delay = options['chunk_delay']
+
+        def client(queued):
+            environ = {'PATH_INFO': url, 'HTTP_HOST': 'localhost', 'HTTP_RANGE': byte_range}
+            setup_testing_defaults(environ)
+            status = []
+            result = {'ttfb': None, 'bytes': 0, 'threads': threading.active_count()}
+            body = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+            try:
+                # Медленный клиент: поток сервера ждёт, пока тот примет порцию
+                for chunk in body:
+                    if result['ttfb'] is None:
+                        result['ttfb'] = time.perf_counter() - queued
+                    result['bytes'] += len(chunk)
+                    time.sleep(delay)
+            finally:
+                body.close()
+            result.update(status=status[0], duration=time.perf_counter() - queued)
+            return result
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            queued = time.perf_counter()
+            futures = [pool.submit(client, queued) for _ in range(options['clients'])]
+            return [future.result() for future in futures]
+
+    async def run_asgi(self, url, byte_range, options):
+        from django.core.handlers.asgi import ASGIHandler
+
+        handler = ASGIHandler()
+        delay = options['chunk_delay']
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': url, 'raw_path': url.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'range', byte_range.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+
+        async def client(queued):
+            result = {'ttfb': None, 'bytes': 0, 'status': None, 'threads': threading.active_count()}
+            disconnected = asyncio.Event()
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    result['status'] = message['status']
+                    return
+                body = message.get('body', b'')
+                if body:
+                    if result['ttfb'] is None:
+                        result['ttfb'] = time.perf_counter() - queued
+                    result['bytes'] += len(body)
+                    # Сервер не возвращается из send(), пока клиент не принял данные
+                    await asyncio.sleep(delay)
+                result['threads'] = max(result['threads'], threading.active_count())
+
+            await handler(dict(scope), receive, send)
+            disconnected.set()
+            result['duration'] = time.perf_counter() - queued
+            return result
+
+        queued = time.perf_counter()
+        return await asyncio.gather(*(client(queued) for _ in range(options['clients'])))
@@ -0,0 +1,146 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from kf_app import db
+from kf_app.models import FacetCount, Favorite, MediaContent, User, ViewHistory
+from kf_app.pagination import keyset_page
+
+# Режимы сравнения: настройки SQLite по умолчанию и профиль production
+PROFILES = {
+    'before': {'OPTIONS': {}, 'PRAGMAS': {'journal_mode': 'DELETE', 'synchronous': 'FULL'}},
+    'after': {'OPTIONS': {'transaction_mode': 'IMMEDIATE'}, 'PRAGMAS': settings.SQLITE_PRODUCTION_PRAGMAS},
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест SQLite: параллельные чтения каталога и запись просмотров/избранного"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help="Потоков чтения")
+        parser.add_argument('--writers', type=int, default=2, help="Потоков записи")
+        parser.add_argument('--seconds', type=float, default=10, help="Длительность каждого прогона")
+        parser.add_argument('--profile', choices=['before', 'after', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        source = settings.DATABASES['default']['NAME']
+        if 'sqlite' not in settings.DATABASES['default']['ENGINE']:
+            raise CommandError("Тест рассчитан на SQLite")
+        workdir = tempfile.mkdtemp(prefix='kf-bench-')
+        try:
+            names = ['before', 'after'] if options['profile'] == 'both' else [options['profile']]
+            for name in names:
+                # Каждый прогон - на свежей копии базы: journal_mode=WAL сохраняется в файле
+                path = os.path.join(workdir, f'{name}.sqlite3')
+                with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+                    src.backup(dst)
+                alias = f'bench_{name}'
+                connections.settings[alias] = dict(
+                    connections.settings['default'], NAME=path, CONN_MAX_AGE=0, **PROFILES[name],
+                )
+                try:
+                    self.run(alias, name, options)
+                finally:
+                    connections[alias].close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def run(self, alias, name, options):
+        media_ids = list(MediaContent.objects.using(alias).values_list('pk', flat=True))
+        if not media_ids:
+            raise CommandError("Каталог пуст: нечего читать")
+        user_ids = list(User.objects.using(alias).values_list('pk', flat=True)[:max(options['writers'], 1) * 10])
+        if not user_ids:
+            User.objects.using(alias).bulk_create(
+                [User(email=f'bench{i}@example.com', first_name='Bench') for i in range(10)]
+            )
+            user_ids = list(User.objects.using(alias).values_list('pk', flat=True))
+        pragmas = db.current_pragmas(connections[alias])
+
+        stop = threading.Event()
+        results = {'read': [], 'write': []}
+        errors = {'read': 0, 'write': 0}
+        lock = threading.Lock()
+
+        def read_once(rng):
+            choice = rng.random()
+            if choice < 0.5:
+                keyset_page(MediaContent.objects.using(alias).filter(content_type='MOVIE'), None)
+            elif choice < 0.8:
+                item = MediaContent.objects.using(alias).get(pk=rng.choice(media_ids))
+                list(item.contentparticipation_set.using(alias).select_related('person'))
+            else:
+                list(FacetCount.objects.using(alias).filter(content_type='MOVIE', count__gt=0))
+
+        def write_once(rng):
+            user_id, media_id = rng.choice(user_ids), rng.choice(media_ids)
+            if rng.random() < 0.8:
+                ViewHistory.objects.using(alias).bulk_create(
+                    [ViewHistory(user_id=user_id, media_content_id=media_id, viewed_seconds=rng.randint(1, 7200))],
+                    update_conflicts=True, unique_fields=['user', 'media_content'],
+                    update_fields=['viewed_seconds', 'viewed_at'],
+                )
+            elif rng.random() < 0.5:
+                Favorite.objects.using(alias).bulk_create(
+                    [Favorite(user_id=user_id, media_content_id=media_id)], ignore_conflicts=True,
+                )
+            else:
+                Favorite.objects.using(alias).filter(user_id=user_id, media_content_id=media_id).delete()
+
+        def worker(kind, operation, seed):
+            rng = random.Random(seed)
+            latencies = []
+            failed = 0
+            try:
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    try:
+                        operation(rng)
+                    except OperationalError:
+                        failed += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connections[alias].close()
+                with lock:
+                    results[kind].extend(latencies)
+                    errors[kind] += failed
+
+        threads = [
+            threading.Thread(target=worker, args=('read', read_once, i)) for i in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=('write', write_once, 1000 + i)) for i in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{name}: " + ', '.join(f'{key}={value}' for key, value in pragmas.items())
+        ))
+        for kind, title in (('read', 'Чтение'), ('write', 'Запись')):
+            latencies = results[kind]
+            self.stdout.write(
+                f"  {title}: {len(latencies) / options['seconds']:.0f} оп/с, "
+                f"p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+                f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, "
+                f"ошибок {errors[kind]}"
+            )
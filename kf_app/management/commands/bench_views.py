@@ -0,0 +1,93 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from kf_app.budgets import VIEW_BUDGETS, targets
+from kf_app.models import User, ViewHistory
+
+from .bench_sqlite import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет страницы каталога: перцентили времени ответа и число SQL-запросов; "
+        "завершается ошибкой, если превышен бюджет из kf_app.budgets"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Запросов на страницу")
+        parser.add_argument('--view', action='append', choices=sorted(VIEW_BUDGETS), help="Только эти страницы")
+        parser.add_argument('--anonymous', action='store_true', help="Без входа (по умолчанию - зритель с историей)")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--no-budget', action='store_true', help="Только отчёт, без проверки бюджета")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        client = Client(SERVER_NAME='localhost')
+        session = None
+        if not options['anonymous']:
+            session = self.login(client)
+        names = options['view'] or list(VIEW_BUDGETS)
+        if options['anonymous'] and 'profile' in names:
+            names.remove('profile')
+        urls = targets(rng)
+        failures = []
+        try:
+            # Первый запрос процесса загружает urls, шаблоны и т. п. - в замеры не входит
+            client.get(urls['index']())
+            cache.clear()
+            for name in names:
+                latencies, queries = self.measure(client, urls[name], options['requests'])
+                max_queries, max_p95 = VIEW_BUDGETS[name]
+                p95 = percentile(latencies, 0.95) * 1000
+                line = (
+                    f"{name:16} p50 {percentile(latencies, 0.5) * 1000:7.1f} мс  "
+                    f"p95 {p95:7.1f} мс  p99 {percentile(latencies, 0.99) * 1000:7.1f} мс  "
+                    f"запросов {max(queries):3} (бюджет {max_queries}, {max_p95} мс)"
+                )
+                if max(queries) > max_queries or p95 > max_p95:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+        finally:
+            if session is not None:
+                session.delete()
+        if failures and not options['no_budget']:
+            raise CommandError(f"Превышен бюджет: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("Все страницы в бюджете" if not failures else "Готово"))
+
+    def login(self, client):
+        # Зритель с историей просмотров: персональные блоки выполняют все свои запросы
+        user_id = (
+            ViewHistory.objects.order_by('-viewed_at').values_list('user_id', flat=True).first()
+        )
+        user = User.objects.filter(pk=user_id).first() if user_id else User.objects.first()
+        if user is None:
+            raise CommandError("Нет пользователей: запустите seed_catalog")
+        session = client.session
+        session.update({
+            'is_authenticated': True, 'username': user.first_name, 'email': user.email, 'user_id': user.pk,
+        })
+        session.save()
+        return session
+
+    def measure(self, client, url_func, count):
+        latencies, queries = [], []
+        for _ in range(count):
+            url = url_func()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f"{url}: статус {response.status_code}")
+            queries.append(len(captured.captured_queries))
+        return latencies, queries
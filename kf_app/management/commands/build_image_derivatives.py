@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from kf_app import images
+from kf_app.models import MediaContent, Person
+
+
+class Command(BaseCommand):
+    help = "Строит уменьшенные WebP/JPEG-копии постеров, изображений и фотографий"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Перестроить и уже описанные изображения")
+
+    def handle(self, *args, **options):
+        built = 0
+        for model in (MediaContent, Person):
+            fields = images.image_fields(model)
+            for instance in model.objects.only(*fields, 'derivatives').iterator():
+                built += images.update(instance, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Обработано изображений: {built}"))
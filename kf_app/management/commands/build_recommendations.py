@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from kf_app import recommendations
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рекомендации «Похожее» (нужны numpy и scipy)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K, help="Соседей на тайтл")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            import numpy  # noqa: F401
+            import scipy  # noqa: F401
+        except ImportError as exc:
+            raise CommandError(f"Для расчёта рекомендаций нужны numpy и scipy: {exc}")
+        total = recommendations.rebuild(options['top_k'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Сохранено рекомендаций: {total}"))
@@ -0,0 +1,49 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from kf_app.media_storage import file_digest, media_storage, upload_dirs
+
+
+class Command(BaseCommand):
+    help = (
+        "Переводит файлы загрузок в MEDIA_ROOT на блобы хранилища: одинаковые файлы "
+        "становятся жёсткими ссылками на одну копию, имена и записи не меняются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, сколько места освободится")
+
+    def handle(self, *args, **options):
+        files = linked = 0
+        freed = 0
+        seen = set()
+        for name in self.names():
+            files += 1
+            if media_storage.is_linked(name):
+                linked += 1
+                continue
+            if options['dry_run']:
+                digest = file_digest(media_storage.path(name))
+                stat = os.stat(media_storage.path(name))
+                if (digest in seen or os.path.exists(media_storage.blob_path(digest))) and stat.st_nlink == 1:
+                    freed += stat.st_size
+                seen.add(digest)
+            else:
+                _, saved = media_storage.adopt(name)
+                freed += saved
+        verb = "Освободится" if options['dry_run'] else "Освобождено"
+        self.stdout.write(self.style.SUCCESS(
+            f"Файлов: {files}, уже в хранилище: {linked}. {verb} {freed / 2 ** 20:.1f} МБ"
+        ))
+
+    def names(self):
+        for directory in upload_dirs():
+            root = media_storage.path(directory)
+            for current, _, filenames in os.walk(root):
+                for filename in sorted(filenames):
+                    # Недописанные файлы faststart и самого хранилища
+                    if filename.endswith(('.tmp', '.faststart')):
+                        continue
+                    path = os.path.join(current, filename)
+                    yield os.path.relpath(path, media_storage.location).replace(os.sep, '/')
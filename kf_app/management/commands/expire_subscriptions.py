@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from kf_app import entitlements
+
+
+class Command(BaseCommand):
+    help = "Закрывает истёкшие подписки и продлевает подписки с автопродлением"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, ничего не менять")
+
+    def handle(self, *args, **options):
+        renewed, expired = entitlements.expire_due(dry_run=options['dry_run'])
+        prefix = "Будет " if options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}продлено: {renewed}, истекло: {expired}"))
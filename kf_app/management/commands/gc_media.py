@@ -0,0 +1,76 @@
+import datetime
+import os
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+from django.utils import timezone
+
+from kf_app.media_storage import BLOBS_DIR, media_storage, referenced_names
+from kf_app.models import MediaBlob, StoredFile
+
+
+class Command(BaseCommand):
+    help = "Удаляет медиафайлы, на которые не ссылается ни одна запись, и блобы без имён"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=60,
+            help="Не трогать файлы моложе стольких минут: загрузка могла ещё не сохраниться в записи",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что будет удалено")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - datetime.timedelta(minutes=options['grace'])
+
+        referenced = referenced_names()
+        stale, live_blobs = [], set()
+        for name, blob_id, saved_at in StoredFile.objects.values_list('name', 'blob_id', 'saved_at').iterator():
+            if name not in referenced and saved_at < cutoff:
+                stale.append(name)
+            else:
+                live_blobs.add(blob_id)
+
+        repaired = 0
+        if not dry_run:
+            for name in stale:
+                media_storage.delete(name)
+            # Счётчики чинятся по фактическим именам (после сбоя между файлом и базой)
+            for blob in MediaBlob.objects.annotate(names=Count('files')).exclude(refcount=F('names')):
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=blob.names)
+                repaired += 1
+
+        blobs = freed = 0
+        candidates = MediaBlob.objects.filter(created_at__lt=cutoff)
+        if dry_run:
+            # Блоб освобождается и тогда, когда удаляются все его имена
+            orphans = [blob for blob in candidates.iterator() if blob.pk not in live_blobs]
+        else:
+            orphans = candidates.filter(refcount=0).iterator()
+        for blob in orphans:
+            if dry_run or media_storage.delete_blob(blob):
+                blobs += 1
+                freed += blob.size
+        freed += self.remove_strays(cutoff, dry_run)
+
+        verb = "Будет удалено" if dry_run else "Удалено"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} имён: {len(stale)}, блобов: {blobs}, освобождено {freed / 2 ** 20:.1f} МБ"
+            + (f"; исправлено счётчиков: {repaired}" if repaired else "")
+        ))
+
+    def remove_strays(self, cutoff, dry_run):
+        """Файлы в blobs/ без записи в базе: недописанные загрузки и блобы после сбоя."""
+        known = set(MediaBlob.objects.values_list('digest', flat=True))
+        deadline = cutoff.timestamp()
+        freed = 0
+        for current, _, filenames in os.walk(media_storage.path(BLOBS_DIR)):
+            for filename in filenames:
+                path = os.path.join(current, filename)
+                stat = os.stat(path)
+                if filename in known or stat.st_mtime >= deadline:
+                    continue
+                freed += stat.st_size if stat.st_nlink == 1 else 0
+                if not dry_run:
+                    os.unlink(path)
+        return freed
@@ -0,0 +1,46 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kf_app.catalog_import import READERS, FeedError, import_feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует каталог (тайтлы, жанры, участники, сезоны, эпизоды) из JSONL или CSV потоком; "
+        "повторный импорт обновляет записи по внешним ключам"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл фида или - для stdin")
+        parser.add_argument('--format', choices=sorted(READERS), help="По умолчанию - по расширению файла")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Записей фида на транзакцию")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if feed_format == 'json':
+            feed_format = 'jsonl'
+        if feed_format not in READERS:
+            raise CommandError("Укажите --format jsonl или csv")
+        try:
+            if path == '-':
+                counts, seconds = import_feed(sys.stdin, feed_format, options['batch_size'])
+            else:
+                with open(path, encoding='utf-8', newline='') as lines:
+                    counts, seconds = import_feed(lines, feed_format, options['batch_size'])
+        except FileNotFoundError:
+            raise CommandError(f"Файл не найден: {path}")
+        except FeedError as exc:
+            raise CommandError(f"Ошибка в фиде, {exc}. Пачки до ошибки сохранены, повторный импорт безопасен")
+
+        self.stdout.write(
+            f"Тайтлов: новых {counts['created']}, обновлено {counts['updated']}, без изменений {counts['unchanged']}; "
+            f"новых жанров {counts['genres']}, персон {counts['people']}; изменено связей {counts['links']}, "
+            f"сезонов {counts['seasons']}, эпизодов {counts['episodes']}"
+        )
+        rate = counts['records'] / seconds if seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Записей фида: {counts['records']} за {seconds:.1f} с ({rate:.0f} записей/с)"
+        ))
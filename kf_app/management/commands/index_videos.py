@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from kf_app.video import process_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Обрабатывает видеофайлы, не обработанные после загрузки (faststart, длительность, "
+        "битрейт, ключевые кадры); запускается по cron"
+    )
+
+    def handle(self, *args, **options):
+        processed = process_all()
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано видео: {processed}"))
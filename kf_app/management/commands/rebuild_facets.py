@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from kf_app import facets
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики фильтров каталога с нуля"
+
+    def handle(self, *args, **options):
+        total = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Значений фильтров: {total}"))
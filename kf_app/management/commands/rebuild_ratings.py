@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from kf_app import ratings
+
+
+class Command(BaseCommand):
+    help = "Проверяет и пересчитывает агрегаты пользовательских оценок"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Только проверить расхождения, ничего не менять")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drift = ratings.find_drift()
+        for pk, stored, actual in drift[:20]:
+            self.stdout.write(f"MediaContent {pk}: сохранено {stored}, по оценкам {actual}")
+        if options['check']:
+            if drift:
+                raise CommandError(f"Расхождений: {len(drift)}")
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+        fixed = ratings.rebuild(drift, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Исправлено тайтлов: {fixed}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from kf_app import search
+
+
+class Command(BaseCommand):
+    help = "Полностью перестраивает полнотекстовый индекс каталога (FTS5)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано записей: {total}"))
@@ -0,0 +1,251 @@
+import datetime
+import random
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from kf_app import facets, fragments, search
+from kf_app.models import (
+    ContentParticipation, Episode, Favorite, Genre, MediaContent, Person, Season, User, ViewHistory,
+)
+
+# Объёмы при --scale 1: 100 тыс. тайтлов, около 1 млн эпизодов и 50 млн просмотров
+TITLES = 100_000
+SERIES_SHARE = 0.2
+PEOPLE = 50_000
+USERS = 1_000_000
+VIEWS_PER_USER = 50
+FAVORITES_PER_USER = 5
+
+GENRES = [
+    'Драма', 'Комедия', 'Боевик', 'Триллер', 'Ужасы', 'Фантастика', 'Фэнтези', 'Детектив',
+    'Мелодрама', 'Приключения', 'Криминал', 'Военный', 'Исторический', 'Биография',
+    'Документальный', 'Мультфильм', 'Семейный', 'Мюзикл', 'Вестерн', 'Спорт',
+]
+COUNTRIES = ['Россия', 'США', 'Великобритания', 'Франция', 'Германия', 'Япония', 'Южная Корея', 'Италия', 'Испания', 'Индия']
+AGES = [0, 6, 12, 16, 18]
+FIRST_NAMES = ['Иван', 'Анна', 'Сергей', 'Мария', 'Алексей', 'Ольга', 'Дмитрий', 'Елена', 'Павел', 'Наталья', 'Андрей', 'Татьяна']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков']
+TITLE_WORDS = [
+    'тень', 'город', 'дорога', 'море', 'ночь', 'звезда', 'огонь', 'зима', 'лето', 'тайна',
+    'граница', 'остров', 'небо', 'ветер', 'песня', 'сердце', 'память', 'путь', 'дом', 'свет',
+]
+ROLES = ['ACTOR', 'ACTOR', 'ACTOR', 'ACTOR', 'WRITER', 'PRODUCER', 'COMPOSER']
+
+
+def skewed(rng, items):
+    """Популярное выбирается чаще: первые элементы списка - хиты."""
+    return items[int(len(items) * rng.random() ** 3)]
+
+
+def next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+@contextmanager
+def explicit_timestamps(model, *names):
+    """Позволяет задать auto_now/auto_now_add поля вручную (история просмотров за год)."""
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет базу синтетическим каталогом для нагрузочных тестов: тайтлы, жанры, "
+        "персоны, сезоны, эпизоды, пользователи, избранное и история просмотров"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help="Доля полного объёма (100 тыс. тайтлов, ~1 млн эпизодов, 50 млн просмотров)")
+        parser.add_argument('--titles', type=int, help="Число тайтлов (по умолчанию по --scale)")
+        parser.add_argument('--users', type=int, help="Число пользователей (по умолчанию по --scale)")
+        parser.add_argument('--views-per-user', type=int, default=VIEWS_PER_USER)
+        parser.add_argument('--favorites-per-user', type=int, default=FAVORITES_PER_USER)
+        parser.add_argument('--seed', type=int, default=42, help="Зерно генератора: одинаковые данные при повторе")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        titles = options['titles'] if options['titles'] is not None else max(int(TITLES * scale), 2)
+        users = options['users'] if options['users'] is not None else max(int(USERS * scale), 1)
+        people = max(int(PEOPLE * titles / TITLES), 10)
+        if titles < 2 or users < 1:
+            raise CommandError("Нужно хотя бы 2 тайтла и 1 пользователь")
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+
+        genre_ids = self.seed_genres()
+        person_ids = self.seed_people(people)
+        movie_ids, series_ids = self.seed_media(titles, genre_ids, person_ids)
+        episode_ids = self.seed_episodes(series_ids)
+        user_ids = self.seed_users(users)
+        self.seed_favorites(user_ids, movie_ids + series_ids, options['favorites_per_user'])
+        self.seed_views(user_ids, movie_ids, episode_ids, options['views_per_user'])
+
+        # bulk_create не вызывает сигналы: производные данные пересчитываются целиком
+        facets.rebuild()
+        search.rebuild()
+        fragments.bump('home', 0)
+        if self.verbosity:
+            self.stdout.write(self.style.SUCCESS(
+                f"Тайтлов: {titles}, эпизодов: {len(episode_ids)}, пользователей: {users}"
+            ))
+
+    def insert(self, model, rows, label):
+        """bulk_create пачками по batch_size, по одной транзакции на пачку."""
+        total = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            total += len(batch)
+        if self.verbosity:
+            self.stdout.write(f"  {label}: {total}")
+        return total
+
+    def seed_genres(self):
+        Genre.objects.bulk_create([Genre(name=name) for name in GENRES], ignore_conflicts=True)
+        return list(Genre.objects.filter(name__in=GENRES).values_list('pk', flat=True))
+
+    def seed_people(self, count):
+        start = next_pk(Person)
+        rng = self.rng
+        self.insert(Person, (
+            Person(pk=pk, first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES))
+            for pk in range(start, start + count)
+        ), "Персоны")
+        return list(range(start, start + count))
+
+    def seed_media(self, count, genre_ids, person_ids):
+        rng = self.rng
+        start = next_pk(MediaContent)
+        ids = list(range(start, start + count))
+        series_ids = set(rng.sample(ids, max(int(count * SERIES_SHARE), 1)))
+        first_day = datetime.date(1960, 1, 1).toordinal()
+        last_day = datetime.date(2025, 12, 31).toordinal()
+
+        def media():
+            for pk in ids:
+                is_series = pk in series_ids
+                words = rng.sample(TITLE_WORDS, 2)
+                yield MediaContent(
+                    pk=pk,
+                    title=f'{words[0].capitalize()} и {words[1]} {pk}',
+                    description=f"{'Сериал' if is_series else 'Фильм'} о том, как {words[0]} меняет {words[1]}.",
+                    release_date=datetime.date.fromordinal(rng.randint(first_day, last_day)),
+                    country=rng.choice(COUNTRIES),
+                    age_restriction=rng.choice(AGES),
+                    duration=rng.randint(40, 60) if is_series else rng.randint(80, 180),
+                    content_type='SERIES' if is_series else 'MOVIE',
+                )
+
+        def genres():
+            for pk in ids:
+                for genre_id in rng.sample(genre_ids, rng.randint(1, 3)):
+                    yield MediaContent.genres.through(mediacontent_id=pk, genre_id=genre_id)
+
+        def participations():
+            for pk in ids:
+                yield ContentParticipation(media_content_id=pk, person_id=rng.choice(person_ids), role='DIRECTOR')
+                seen = set()
+                for _ in range(rng.randint(3, 8)):
+                    person_id, role = skewed(rng, person_ids), rng.choice(ROLES)
+                    if (person_id, role) not in seen:
+                        seen.add((person_id, role))
+                        yield ContentParticipation(media_content_id=pk, person_id=person_id, role=role)
+
+        self.insert(MediaContent, media(), "Тайтлы")
+        self.insert(MediaContent.genres.through, genres(), "Жанры тайтлов")
+        self.insert(ContentParticipation, participations(), "Участие в контенте")
+        return [pk for pk in ids if pk not in series_ids], sorted(series_ids)
+
+    def seed_episodes(self, series_ids):
+        rng = self.rng
+        season_start = next_pk(Season)
+        episode_start = next_pk(Episode)
+        # Сезоны считаются заранее: эпизодам нужны их id
+        plan = []
+        for series_id in series_ids:
+            for number in range(1, min(1 + int(rng.expovariate(1 / 4)), 15) + 1):
+                plan.append((season_start + len(plan), series_id, number, rng.randint(6, 16)))
+
+        self.insert(Season, (
+            Season(pk=pk, media_content_id=series_id, season_number=number)
+            for pk, series_id, number, _ in plan
+        ), "Сезоны")
+
+        def episodes():
+            pk = episode_start
+            for season_id, _, _, count in plan:
+                for number in range(1, count + 1):
+                    yield Episode(
+                        pk=pk, season_id=season_id, episode_number=number, title=f'Эпизод {number}',
+                        duration=rng.randint(40, 60),
+                    )
+                    pk += 1
+
+        total = self.insert(Episode, episodes(), "Эпизоды")
+        return list(range(episode_start, episode_start + total))
+
+    def seed_users(self, count):
+        start = next_pk(User)
+        rng = self.rng
+        self.insert(User, (
+            User(pk=pk, email=f'seed{pk}@example.com', first_name=rng.choice(FIRST_NAMES))
+            for pk in range(start, start + count)
+        ), "Пользователи")
+        return range(start, start + count)
+
+    def seed_favorites(self, user_ids, media_ids, per_user):
+        rng = self.rng
+        now = timezone.now()
+
+        def favorites():
+            for user_id in user_ids:
+                for media_id in {skewed(rng, media_ids) for _ in range(rng.randint(0, per_user * 2))}:
+                    yield Favorite(
+                        user_id=user_id, media_content_id=media_id,
+                        added_at=now - datetime.timedelta(seconds=rng.randint(0, 365 * 86400)),
+                    )
+
+        with explicit_timestamps(Favorite, 'added_at'):
+            self.insert(Favorite, favorites(), "Избранное")
+
+    def seed_views(self, user_ids, movie_ids, episode_ids, per_user):
+        rng = self.rng
+        now = timezone.now()
+
+        def views():
+            for user_id in user_ids:
+                movies, episodes = set(), set()
+                for _ in range(rng.randint(0, per_user * 2)):
+                    if episode_ids and (not movie_ids or rng.random() < 0.6):
+                        episodes.add(skewed(rng, episode_ids))
+                    else:
+                        movies.add(skewed(rng, movie_ids))
+                for field, ids in (('media_content_id', movies), ('episode_id', episodes)):
+                    for pk in ids:
+                        yield ViewHistory(
+                            user_id=user_id, viewed_seconds=rng.randint(60, 7200),
+                            viewed_at=now - datetime.timedelta(seconds=rng.randint(0, 365 * 86400)),
+                            **{field: pk},
+                        )
+
+        with explicit_timestamps(ViewHistory, 'viewed_at'):
+            self.insert(ViewHistory, views(), "Просмотры")
@@ -0,0 +1,226 @@
+"""Хранилище загрузок с адресацией по содержимому.
+
+Постеры, изображения, фото персон и видео (поля с storage=content_storage)
+при сохранении потоково хэшируются (SHA-256) и записываются один раз в
+blobs/ab/cd/<sha256>. Имя в каталоге upload_to - жёсткая ссылка на блоб:
+отдача файлов, faststart и производные изображений работают с обычным
+путём, а одинаковые загрузки занимают место на диске один раз. Каждая
+загрузка получает своё имя (ссылку), даже при том же содержимом: иначе
+FieldFile.delete() у одной записи удалил бы файл, на который ссылаются
+другие.
+
+Учёт - в базе: StoredFile (имя -> блоб) и MediaBlob.refcount (число имён).
+Имена, на которые не ссылается ни одна запись, и блобы без имён удаляет
+команда gc_media; dedupe_media переводит на блобы уже лежащие в
+MEDIA_ROOT файлы.
+
+Файл по имени нельзя менять на месте - изменятся все имена того же блоба.
+Переписывать можно только подменой (os.replace) с последующим adopt(),
+как это делает faststart (см. kf_app.video). Если ФС не умеет жёсткие
+ссылки, имена становятся копиями: всё работает, но место не экономится.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+BLOBS_DIR = 'blobs'
+HASH_CHUNK = 1024 * 1024
+
+
+def blob_name(digest):
+    return f'{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link(source, target):
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def same_file(first, second):
+    try:
+        return os.path.samefile(first, second)
+    except OSError:
+        return False
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def blob_path(self, digest):
+        return self.path(blob_name(digest))
+
+    def write_temp(self, content):
+        """Содержимое во временный файл внутри MEDIA_ROOT: (путь, digest, размер)."""
+        directory = self.path(f'{BLOBS_DIR}/tmp')
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            if hasattr(content, 'temporary_file_path'):
+                # Большая загрузка уже лежит на диске: переносим и хэшируем, без копирования
+                os.close(fd)
+                file_move_safe(content.temporary_file_path(), tmp_path, allow_overwrite=True)
+                return tmp_path, file_digest(tmp_path), os.path.getsize(tmp_path)
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    size += len(chunk)
+                    fh.write(chunk)
+            return tmp_path, digest.hexdigest(), size
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def place_blob(self, path, digest):
+        """Делает файл path блобом digest, если такого содержимого ещё нет."""
+        target = self.blob_path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            link(path, target)
+        except FileExistsError:
+            pass
+        return target
+
+    def _save(self, name, content):
+        tmp_path, digest, size = self.write_temp(content)
+        try:
+            blob = self.place_blob(tmp_path, digest)
+        finally:
+            os.unlink(tmp_path)
+
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        while True:
+            try:
+                link(blob, full_path)
+            except FileExistsError:
+                name = self.get_available_name(name)
+                full_path = self.path(name)
+            else:
+                break
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        self.register(name, digest, size)
+        return name
+
+    def register(self, name, digest, size):
+        from .models import MediaBlob, StoredFile
+
+        with transaction.atomic():
+            blob, _ = MediaBlob.objects.get_or_create(digest=digest, defaults={'size': size})
+            stored = StoredFile.objects.filter(name=name).first()
+            if stored is None:
+                StoredFile.objects.create(name=name, blob=blob)
+            elif stored.blob_id != blob.pk:
+                MediaBlob.objects.filter(pk=stored.blob_id).update(refcount=F('refcount') - 1)
+                stored.blob = blob
+                stored.saved_at = timezone.now()
+                stored.save(update_fields=['blob', 'saved_at'])
+            else:
+                return
+            MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+
+    def delete(self, name):
+        from .models import MediaBlob, StoredFile
+
+        super().delete(name)
+        with transaction.atomic():
+            stored = StoredFile.objects.filter(name=name).first()
+            if stored is not None:
+                stored.delete()
+                MediaBlob.objects.filter(pk=stored.blob_id).update(refcount=F('refcount') - 1)
+
+    def is_linked(self, name):
+        """Имя учтено и указывает на свой блоб - adopt() не нужен."""
+        from .models import StoredFile
+
+        stored = StoredFile.objects.filter(name=name).select_related('blob').first()
+        return stored is not None and same_file(self.path(name), self.blob_path(stored.blob.digest))
+
+    def adopt(self, name):
+        """Переводит файл name на блоб его текущего содержимого.
+
+        Возвращает (digest, байт освобождено): если такой блоб уже был,
+        файл заменяется ссылкой на него.
+        """
+        path = self.path(name)
+        digest = file_digest(path)
+        stat = os.stat(path)
+        blob = self.blob_path(digest)
+        freed = 0
+        if not os.path.exists(blob):
+            self.place_blob(path, digest)
+        elif not same_file(path, blob):
+            tmp_path = f'{path}.{digest[:12]}.tmp'
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            link(blob, tmp_path)
+            os.replace(tmp_path, path)
+            if stat.st_nlink == 1:
+                freed = stat.st_size
+        self.register(name, digest, stat.st_size)
+        return digest, freed
+
+    def delete_blob(self, blob):
+        """Удаляет блоб без имён; возвращает True, если он удалён."""
+        from .models import MediaBlob
+
+        with transaction.atomic():
+            deleted, _ = MediaBlob.objects.filter(pk=blob.pk, refcount=0, files__isnull=True).delete()
+            if deleted:
+                path = self.blob_path(blob.digest)
+                if os.path.exists(path):
+                    os.unlink(path)
+        return bool(deleted)
+
+
+media_storage = ContentAddressedStorage()
+
+
+def content_storage():
+    return media_storage
+
+
+def file_fields():
+    """(модель, поле) для всех файловых полей, хранящихся в media_storage."""
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, models.FileField) and field.storage is media_storage
+    ]
+
+
+def referenced_names():
+    names = set()
+    for model, field in file_fields():
+        names.update(
+            model.objects.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+            .values_list(field.name, flat=True)
+        )
+    return names
+
+
+def upload_dirs():
+    return sorted({field.upload_to.rstrip('/') for _, field in file_fields() if isinstance(field.upload_to, str)})
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0005_mediacontent_video_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='episode',
+            name='duration',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Длительность (мин)'),
+        ),
+        migrations.CreateModel(
+            name='VideoIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Файл')),
+                ('file_size', models.PositiveBigIntegerField(verbose_name='Размер (байт)')),
+                ('duration', models.FloatField(verbose_name='Длительность (сек)')),
+                ('bitrate', models.PositiveIntegerField(verbose_name='Битрейт (бит/с)')),
+                ('faststart', models.BooleanField(default=False, verbose_name='moov в начале файла')),
+                ('keyframes', models.JSONField(default=list, help_text='Пары [секунда, смещение в байтах]', verbose_name='Ключевые кадры')),
+                ('indexed_at', models.DateTimeField(auto_now=True, verbose_name='Дата индексации')),
+                ('episode', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='video_index', to='kf_app.episode', verbose_name='Эпизод')),
+                ('media_content', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='video_index', to='kf_app.mediacontent', verbose_name='Медиаконтент')),
+            ],
+            options={
+                'verbose_name': 'Индекс видео',
+                'verbose_name_plural': 'Индексы видео',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0006_video_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediacontent',
+            index=models.Index(fields=['content_type', '-release_date', '-id'], name='media_type_release_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:04
+
+from django.db import migrations
+
+
+def folded(expr):
+    # Как kf_app.search.normalize: регистр сворачивает unicode61, а ё/е - нет
+    return f"replace(replace({expr}, 'Ё', 'Е'), 'ё', 'е')"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0007_mediacontent_release_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE VIRTUAL TABLE kf_app_search USING fts5(
+                    title, description, genres, people,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3'
+                )
+                """,
+                f"""
+                INSERT INTO kf_app_search (rowid, title, description, genres, people)
+                SELECT m.id, {folded('m.title')}, {folded('m.description')},
+                    (SELECT {folded("group_concat(g.name, ' ')")}
+                     FROM kf_app_mediacontent_genres mg
+                     JOIN kf_app_genre g ON g.id = mg.genre_id
+                     WHERE mg.mediacontent_id = m.id),
+                    (SELECT {folded("group_concat(p.first_name || ' ' || p.last_name, ' ')")}
+                     FROM kf_app_contentparticipation cp
+                     JOIN kf_app_person p ON p.id = cp.person_id
+                     WHERE cp.media_content_id = m.id)
+                FROM kf_app_mediacontent m
+                """,
+            ],
+            reverse_sql='DROP TABLE kf_app_search',
+        ),
+    ]
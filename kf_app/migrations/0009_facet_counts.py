@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+# Полосы рейтинга на момент миграции: (значение фильтра, нижняя граница)
+RATING_BANDS = (('9', 9), ('8', 8), ('7', 7), ('6', 6))
+
+
+def rating_band(rating):
+    for key, low in RATING_BANDS:
+        if rating >= low:
+            return key
+    return '0'
+
+
+def populate_counts(apps, schema_editor):
+    MediaContent = apps.get_model('kf_app', 'MediaContent')
+    FacetCount = apps.get_model('kf_app', 'FacetCount')
+    counts = Counter()
+    rows = (
+        MediaContent.objects.annotate(year=ExtractYear('release_date'))
+        .values('content_type', 'country', 'year', 'age_restriction', 'rating')
+        .annotate(total=Count('id'))
+    )
+    for row in rows:
+        ct = row['content_type']
+        counts[(ct, 'country', row['country'])] += row['total']
+        counts[(ct, 'year', str(row['year']))] += row['total']
+        counts[(ct, 'age', str(row['age_restriction']))] += row['total']
+        counts[(ct, 'rating', rating_band(row['rating'] or 0))] += row['total']
+    genres = (
+        MediaContent.genres.through.objects
+        .values('mediacontent__content_type', 'genre_id')
+        .annotate(total=Count('id'))
+    )
+    for row in genres:
+        counts[(row['mediacontent__content_type'], 'genre', str(row['genre_id']))] += row['total']
+    FacetCount.objects.bulk_create(
+        [FacetCount(content_type=ct, facet=facet, value=value, count=total)
+         for (ct, facet, value), total in counts.items() if total],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_type', models.CharField(choices=[('MOVIE', 'Фильм'), ('SERIES', 'Сериал')], max_length=10, verbose_name='Тип')),
+                ('facet', models.CharField(choices=[('genre', 'Жанр'), ('country', 'Страна'), ('year', 'Год выхода'), ('age', 'Возрастное ограничение'), ('rating', 'Рейтинг')], max_length=10, verbose_name='Фильтр')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фильтра',
+                'verbose_name_plural': 'Счётчики фильтров',
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'facet', 'value'), name='unique_facet_value')],
+            },
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+def drop_duplicate_views(apps, schema_editor):
+    # Перед уникальными ограничениями оставляем только последнюю запись на пару
+    ViewHistory = apps.get_model('kf_app', 'ViewHistory')
+    seen = set()
+    duplicates = []
+    rows = ViewHistory.objects.order_by('-viewed_at', '-id').values_list('id', 'user_id', 'media_content_id', 'episode_id')
+    for pk, user_id, media_content_id, episode_id in rows.iterator():
+        key = (user_id, media_content_id, episode_id)
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    ViewHistory.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0009_facet_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_views, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='viewhistory',
+            constraint=models.UniqueConstraint(fields=('user', 'media_content'), name='unique_user_media_view'),
+        ),
+        migrations.AddConstraint(
+            model_name='viewhistory',
+            constraint=models.UniqueConstraint(fields=('user', 'episode'), name='unique_user_episode_view'),
+        ),
+    ]
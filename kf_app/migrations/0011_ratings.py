@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:10
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0010_viewhistory_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediacontent',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='mediacontent',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(10)], verbose_name='Оценка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата оценки')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+                ('media_content', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='kf_app.mediacontent', verbose_name='Медиаконтент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='kf_app.user', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Оценка',
+                'verbose_name_plural': 'Оценки',
+                'constraints': [models.UniqueConstraint(fields=('user', 'media_content'), name='unique_user_media_rating')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0011_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Позиция')),
+                ('media_content', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='kf_app.mediacontent', verbose_name='Медиаконтент')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='kf_app.mediacontent', verbose_name='Рекомендация')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация',
+                'verbose_name_plural': 'Рекомендации',
+                'ordering': ['media_content', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('media_content', 'rank'), name='unique_recommendation_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:48
+
+import django.db.models.deletion
+import django.utils.timezone
+import kf_app.media_storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0017_mediacontent_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (байт)')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Число имён')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Блоб медиафайла',
+                'verbose_name_plural': 'Блобы медиафайлов',
+            },
+        ),
+        migrations.AlterField(
+            model_name='episode',
+            name='video_file',
+            field=models.FileField(blank=True, help_text='Загрузите видеофайл для этого эпизода', null=True, storage=kf_app.media_storage.content_storage, upload_to='episode_videos/', verbose_name='Видеофайл эпизода'),
+        ),
+        migrations.AlterField(
+            model_name='mediacontent',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=kf_app.media_storage.content_storage, upload_to='media_content_images/', verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='mediacontent',
+            name='poster',
+            field=models.ImageField(blank=True, null=True, storage=kf_app.media_storage.content_storage, upload_to='media_content_posters/', verbose_name='Постер'),
+        ),
+        migrations.AlterField(
+            model_name='mediacontent',
+            name='video_file',
+            field=models.FileField(blank=True, help_text='Загрузите видеофайл (для фильмов)', null=True, storage=kf_app.media_storage.content_storage, upload_to='media_content_videos/', verbose_name='Видеофайл'),
+        ),
+        migrations.AlterField(
+            model_name='person',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=kf_app.media_storage.content_storage, upload_to='persons/', verbose_name='Фотография'),
+        ),
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('saved_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата сохранения')),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='files', to='kf_app.mediablob', verbose_name='Блоб')),
+            ],
+            options={
+                'verbose_name': 'Медиафайл',
+                'verbose_name_plural': 'Медиафайлы',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+COLUMNS = ('title', 'description', 'genres', 'people')
+
+
+class Migration(migrations.Migration):
+    # Индекс, заполненный 0008 до исправления, хранил ё: "елки" не находило "Ёлки"
+
+    dependencies = [
+        ('kf_app', '0018_media_blobs'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='UPDATE kf_app_search SET ' + ', '.join(
+                f"{column} = replace(replace({column}, 'Ё', 'Е'), 'ё', 'е')" for column in COLUMNS
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
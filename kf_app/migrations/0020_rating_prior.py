@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+def seed_prior(apps, schema_editor):
+    # Рейтинг тайтла без голосов - это оценка редакции: она становится априорной.
+    # У тайтлов с голосами рейтинг уже смешан с общим средним, исходное значение не восстановить
+    MediaContent = apps.get_model('kf_app', 'MediaContent')
+    MediaContent.objects.filter(rating_count=0, rating__gt=0).update(rating_prior=models.F('rating'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0019_search_fold_yo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediacontent',
+            name='rating_prior',
+            field=models.FloatField(blank=True, help_text='Исходная оценка тайтла, к которой тянется рейтинг при малом числе голосов; пусто - общее среднее', null=True, verbose_name='Редакционный рейтинг'),
+        ),
+        migrations.RunPython(seed_prior, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+def drop_indexes(apps, schema_editor):
+    # Индексы без таблицы ключевых кадров устарели: index_videos построит их заново
+    apps.get_model('kf_app', 'VideoIndex').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kf_app', '0023_fragment_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoindex',
+            name='keyframes',
+            field=models.JSONField(default=list, help_text='Пары [секунда, смещение в байтах]', verbose_name='Ключевые кадры'),
+        ),
+        migrations.RunPython(drop_indexes, migrations.RunPython.noop),
+    ]
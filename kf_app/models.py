@@ -1,10 +1,18 @@
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
+
+from . import mp4
+from .media_storage import content_storage
 
 class User(models.Model):
+    # Учётная запись для входа (логин и хэш пароля хранит django.contrib.auth)
+    account = models.OneToOneField(settings.AUTH_USER_MODEL, verbose_name="Учётная запись", on_delete=models.CASCADE, null=True, blank=True, related_name='profile')
     email = models.EmailField("Почта", max_length=255, unique=True)
     first_name = models.CharField("Имя", max_length=100)
-    last_name = models.CharField("Фамилия", max_length=100)
-    birth_date = models.DateField("Дата рождения")
+    last_name = models.CharField("Фамилия", max_length=100, blank=True)
+    birth_date = models.DateField("Дата рождения", null=True, blank=True)
     favorites = models.ManyToManyField('MediaContent', through='Favorite', verbose_name="Избранное")
 
     class Meta:
@@ -25,26 +33,47 @@ class MediaContent(models.Model):
     description = models.TextField("Описание")
     release_date = models.DateField("Дата выхода")
     country = models.CharField("Страна производства", max_length=100)
-    rating = models.FloatField("Рейтинг", default=0.0) 
+    # Отображаемый рейтинг вычисляется из rating_prior и оценок (см. kf_app.ratings), вручную не правится
+    rating = models.FloatField("Рейтинг", default=0.0)
+    rating_prior = models.FloatField(
+        "Редакционный рейтинг", null=True, blank=True,
+        help_text="Исходная оценка тайтла, к которой тянется рейтинг при малом числе голосов; пусто - общее среднее",
+    )
+    # Агрегаты пользовательских оценок, обновляются при каждом голосе (см. kf_app.ratings)
+    rating_sum = models.PositiveIntegerField("Сумма оценок", default=0, editable=False)
+    rating_count = models.PositiveIntegerField("Количество оценок", default=0, editable=False)
     age_restriction = models.PositiveIntegerField("Возрастное ограничение")
     duration = models.PositiveIntegerField("Длительность (мин)", null=True, blank=True) 
     content_type = models.CharField("Тип", max_length=10, choices=CONTENT_TYPES)
     genres = models.ManyToManyField('Genre', verbose_name="Жанры")
-    image = models.ImageField("Изображение", upload_to="media_content_images/", null=True, blank=True)
-    poster = models.ImageField("Постер", upload_to="media_content_posters/", null=True, blank=True)
+    image = models.ImageField("Изображение", upload_to="media_content_images/", storage=content_storage, null=True, blank=True)
+    poster = models.ImageField("Постер", upload_to="media_content_posters/", storage=content_storage, null=True, blank=True)
     
     # Добавляем видео для фильмов
     video_file = models.FileField(
         "Видеофайл", 
         upload_to="media_content_videos/", 
+        storage=content_storage,
         null=True, 
         blank=True,
         help_text="Загрузите видеофайл (для фильмов)"
     )
+    # Меняется и при изменении сезонов, эпизодов, участников и жанров (см. kf_app.signals)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
+    # Уменьшенные копии poster/image: поле -> {name, digest, widths} (см. kf_app.images)
+    derivatives = models.JSONField("Производные изображений", default=dict, blank=True, editable=False)
+    # Ключ тайтла в каталоге поставщика: повторный импорт обновляет, а не дублирует (см. kf_app.catalog_import)
+    external_id = models.CharField("Внешний идентификатор", max_length=64, unique=True, null=True, blank=True)
 
     class Meta:
         verbose_name = "Медиаконтент"
         verbose_name_plural = "Медиаконтент"
+        indexes = [
+            # Списки фильмов/сериалов и постраничная навигация по (release_date, id)
+            models.Index(fields=['content_type', '-release_date', '-id'], name='media_type_release_idx'),
+            # Last-Modified списков: MAX(updated_at) по типу без прохода по таблице
+            models.Index(fields=['content_type', 'updated_at'], name='media_type_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -63,6 +92,10 @@ class Favorite(models.Model):
                 name='unique_user_media_favorite'
             )
         ]
+        indexes = [
+            # Избранное пользователя в порядке добавления
+            models.Index(fields=['user', '-added_at'], name='favorite_user_added_idx'),
+        ]
 
     def __str__(self):  
         return f"{self.user} - {self.media_content}"
@@ -77,6 +110,21 @@ class ViewHistory(models.Model):
     class Meta:
         verbose_name = "История просмотров"
         verbose_name_plural = "История просмотров"
+        constraints = [
+            # Одна запись на пару пользователь/контент: прогресс обновляется upsert'ом
+            models.UniqueConstraint(
+                fields=['user', 'media_content'],
+                name='unique_user_media_view'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'episode'],
+                name='unique_user_episode_view'
+            ),
+        ]
+        indexes = [
+            # «Продолжить просмотр» и история пользователя по дате
+            models.Index(fields=['user', '-viewed_at'], name='view_user_viewed_idx'),
+        ]
 
     def clean(self):
         from django.core.exceptions import ValidationError
@@ -128,6 +176,12 @@ class UserSubscription(models.Model):
     class Meta:
         verbose_name = "Подписка пользователя"
         verbose_name_plural = "Подписки пользователей"
+        indexes = [
+            # Выборка истекающих подписок командой expire_subscriptions
+            models.Index(fields=['status', 'end_date'], name='usersub_status_end_idx'),
+            # Действующие подписки пользователя (kf_app.entitlements)
+            models.Index(fields=['user', 'status', 'end_date'], name='usersub_user_status_end_idx'),
+        ]
 
     def __str__(self):  
         return f"{self.user} - {self.subscription} ({self.status})"
@@ -136,7 +190,10 @@ class Person(models.Model):
     first_name = models.CharField("Имя", max_length=100)
     last_name = models.CharField("Фамилия", max_length=100)
     biography = models.TextField("Биография", blank=True)
-    photo = models.ImageField("Фотография", upload_to="persons/", null=True, blank=True)
+    photo = models.ImageField("Фотография", upload_to="persons/", storage=content_storage, null=True, blank=True)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
+    # Уменьшенные копии photo (см. kf_app.images)
+    derivatives = models.JSONField("Производные изображений", default=dict, blank=True, editable=False)
     media_content = models.ManyToManyField(MediaContent, through='ContentParticipation', verbose_name="Участие в контенте") 
 
     class Meta:
@@ -185,6 +242,7 @@ class Season(models.Model):
     media_content = models.ForeignKey(MediaContent, verbose_name="Медиаконтент", on_delete=models.CASCADE, limit_choices_to={'content_type': 'SERIES'}) # Ограничение выбора только для сериалов
     season_number = models.PositiveIntegerField("Номер сезона")
     description = models.TextField("Описание", blank=True)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
 
     class Meta:
         verbose_name = "Сезон"
@@ -205,17 +263,19 @@ class Episode(models.Model):
     episode_number = models.PositiveIntegerField("Номер эпизода")
     title = models.CharField("Название", max_length=255)
     description = models.TextField("Описание", blank=True)
-    duration = models.PositiveIntegerField("Длительность (мин)")
+    duration = models.PositiveIntegerField("Длительность (мин)", null=True, blank=True)
     release_date = models.DateField("Дата выхода эпизода", null=True, blank=True)
     
     # Добавляем поле для видео эпизода
     video_file = models.FileField(
         "Видеофайл эпизода", 
         upload_to="episode_videos/", 
+        storage=content_storage,
         null=True, 
         blank=True,
         help_text="Загрузите видеофайл для этого эпизода"
     )
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
 
     class Meta:
         verbose_name = "Эпизод"
@@ -229,24 +289,159 @@ class Episode(models.Model):
         ordering = ['episode_number'] 
 
     def get_previous_episode(self):
-        try:
-            return Episode.objects.filter(
-                season=self.season,
-                episode_number__lt=self.episode_number
-            ).order_by('-episode_number').first()
-        except Episode.DoesNotExist:
-            return None
+        # Соседи по сквозной нумерации сериала берутся из кэшированного дерева (kf_app.navigation)
+        from .navigation import neighbours
+        entry = neighbours(self)[0]
+        return Episode.objects.filter(pk=entry['id']).first() if entry else None
 
     def get_next_episode(self):
-        try:
-            return Episode.objects.filter(
-                season=self.season,
-                episode_number__gt=self.episode_number
-            ).order_by('episode_number').first()
-        except Episode.DoesNotExist:
-            return None
+        from .navigation import neighbours
+        entry = neighbours(self)[1]
+        return Episode.objects.filter(pk=entry['id']).first() if entry else None
 
     def __str__(self):
         return f"{self.season} - Эпизод {self.episode_number}: {self.title}"
-    
-    
\ No newline at end of file
+
+
+class VideoIndex(models.Model):
+    # Результат разбора видеофайла после загрузки (см. kf_app.video)
+    media_content = models.OneToOneField(MediaContent, verbose_name="Медиаконтент", on_delete=models.CASCADE, null=True, blank=True, related_name='video_index')
+    episode = models.OneToOneField(Episode, verbose_name="Эпизод", on_delete=models.CASCADE, null=True, blank=True, related_name='video_index')
+    file_name = models.CharField("Файл", max_length=255)
+    file_size = models.PositiveBigIntegerField("Размер (байт)")
+    duration = models.FloatField("Длительность (сек)")
+    bitrate = models.PositiveIntegerField("Битрейт (бит/с)")
+    faststart = models.BooleanField("moov в начале файла", default=False)
+    keyframes = models.JSONField("Ключевые кадры", default=list, help_text="Пары [секунда, смещение в байтах]")
+    indexed_at = models.DateTimeField("Дата индексации", auto_now=True)
+
+    class Meta:
+        verbose_name = "Индекс видео"
+        verbose_name_plural = "Индексы видео"
+
+    def keyframe_at(self, seconds):
+        return mp4.keyframe_at(self.keyframes, seconds)
+
+    def __str__(self):
+        return self.file_name
+
+
+class FacetCount(models.Model):
+    # Счётчики значений фильтров каталога, поддерживаются сигналами (см. kf_app.facets)
+    FACETS = [
+        ('genre', 'Жанр'),
+        ('country', 'Страна'),
+        ('year', 'Год выхода'),
+        ('age', 'Возрастное ограничение'),
+        ('rating', 'Рейтинг'),
+    ]
+
+    content_type = models.CharField("Тип", max_length=10, choices=MediaContent.CONTENT_TYPES)
+    facet = models.CharField("Фильтр", max_length=10, choices=FACETS)
+    value = models.CharField("Значение", max_length=100)
+    count = models.IntegerField("Количество", default=0)
+
+    class Meta:
+        verbose_name = "Счётчик фильтра"
+        verbose_name_plural = "Счётчики фильтров"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_type', 'facet', 'value'],
+                name='unique_facet_value'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.content_type} {self.facet}={self.value}: {self.count}"
+
+
+class Rating(models.Model):
+    user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.CASCADE, related_name='ratings')
+    media_content = models.ForeignKey(MediaContent, verbose_name="Медиаконтент", on_delete=models.CASCADE, related_name='ratings')
+    score = models.PositiveSmallIntegerField("Оценка", validators=[MinValueValidator(1), MaxValueValidator(10)])
+    created_at = models.DateTimeField("Дата оценки", auto_now_add=True)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
+
+    class Meta:
+        verbose_name = "Оценка"
+        verbose_name_plural = "Оценки"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'media_content'],
+                name='unique_user_media_rating'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.media_content}: {self.score}"
+
+
+
+class Recommendation(models.Model):
+    # Ближайшие соседи тайтла, рассчитываются командой build_recommendations (см. kf_app.recommendations)
+    media_content = models.ForeignKey(MediaContent, verbose_name="Медиаконтент", on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(MediaContent, verbose_name="Рекомендация", on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField("Сходство")
+    rank = models.PositiveSmallIntegerField("Позиция")
+
+    class Meta:
+        verbose_name = "Рекомендация"
+        verbose_name_plural = "Рекомендации"
+        ordering = ['media_content', 'rank']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['media_content', 'rank'],
+                name='unique_recommendation_rank'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.media_content} -> {self.recommended} ({self.score:.3f})"
+
+
+class MediaBlob(models.Model):
+    # Содержимое загруженного файла, хранится один раз под своим SHA-256 (см. kf_app.media_storage)
+    digest = models.CharField("SHA-256", max_length=64, unique=True)
+    size = models.PositiveBigIntegerField("Размер (байт)")
+    refcount = models.PositiveIntegerField("Число имён", default=0)
+    created_at = models.DateTimeField("Дата создания", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Блоб медиафайла"
+        verbose_name_plural = "Блобы медиафайлов"
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.refcount})"
+
+
+class StoredFile(models.Model):
+    # Имя файла в MEDIA_ROOT - жёсткая ссылка на блоб; удаляются командой gc_media
+    name = models.CharField("Имя файла", max_length=255, unique=True)
+    blob = models.ForeignKey(MediaBlob, verbose_name="Блоб", on_delete=models.PROTECT, related_name='files')
+    # Обновляется и при смене блоба (adopt): gc_media не трогает свежие имена
+    saved_at = models.DateTimeField("Дата сохранения", default=timezone.now)
+
+    class Meta:
+        verbose_name = "Медиафайл"
+        verbose_name_plural = "Медиафайлы"
+
+    def __str__(self):
+        return self.name
+
+
+class FragmentVersion(models.Model):
+    # Версия объекта для ключей кэша HTML-фрагментов (см. kf_app.fragments): общая для всех воркеров
+    scope = models.CharField("Область", max_length=32)
+    object_id = models.PositiveIntegerField("ID объекта")
+    version = models.PositiveBigIntegerField("Версия", default=0)
+    changed_at = models.DateTimeField("Дата изменения", default=timezone.now)
+
+    class Meta:
+        verbose_name = "Версия фрагментов"
+        verbose_name_plural = "Версии фрагментов"
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'object_id'], name='unique_fragment_version')
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.object_id} v{self.version}"
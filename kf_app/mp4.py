@@ -0,0 +1,359 @@
+"""Разбор структуры MP4 (ISO BMFF) без внешних зависимостей.
+
+Файл никогда не читается целиком: в память попадают только заголовки
+боксов и moov, который даже для многочасового фильма занимает единицы
+мегабайт.
+"""
+import os
+import shutil
+import struct
+import tempfile
+from bisect import bisect_right
+
+# Боксы-контейнеры, внутрь которых нужно заходить при разборе
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'moof', b'traf', b'edts'}
+
+COPY_CHUNK = 1024 * 1024
+
+
+class Mp4Error(Exception):
+    pass
+
+
+class Box:
+    def __init__(self, kind, offset, size, header_size):
+        self.kind = kind
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def data_offset(self):
+        return self.offset + self.header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    def __repr__(self):
+        return f'<Box {self.kind.decode("latin-1")} @{self.offset} {self.size}>'
+
+
+def iter_boxes(fh, start, end):
+    pos = start
+    while pos + 8 <= end:
+        fh.seek(pos)
+        header = fh.read(8)
+        if len(header) < 8:
+            break
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', fh.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise Mp4Error(f'Повреждённый бокс {kind!r} по смещению {pos}')
+        yield Box(kind, pos, size, header_size)
+        pos += size
+
+
+def top_level_boxes(fh):
+    fh.seek(0, os.SEEK_END)
+    return list(iter_boxes(fh, 0, fh.tell()))
+
+
+def parse_tree(data, offset=0, end=None):
+    """Разбирает уже прочитанный в память бокс (moov/moof) в дерево."""
+    end = len(data) if end is None else end
+    nodes = []
+    pos = offset
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise Mp4Error(f'Повреждённый бокс {kind!r} внутри moov')
+        children = parse_tree(data, pos + header_size, pos + size) if kind in CONTAINERS else []
+        nodes.append((kind, pos + header_size, pos + size, children))
+        pos += size
+    return nodes
+
+
+def find(nodes, *path):
+    for kind, start, end, children in nodes:
+        if kind == path[0]:
+            if len(path) == 1:
+                return kind, start, end, children
+            found = find(children, *path[1:])
+            if found:
+                return found
+    return None
+
+
+def find_all(nodes, kind):
+    return [node for node in nodes if node[0] == kind]
+
+
+def full_box(data, start):
+    version = data[start]
+    flags = int.from_bytes(data[start + 1:start + 4], 'big')
+    return version, flags, start + 4
+
+
+def read_timing(data, node):
+    # mvhd и mdhd: timescale и duration, 64-битные поля в версии 1
+    version, _, pos = full_box(data, node[1])
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, pos + 16)
+    else:
+        timescale, duration = struct.unpack_from('>II', data, pos + 8)
+    return timescale, duration
+
+
+def read_table(data, node, fmt):
+    _, _, pos = full_box(data, node[1])
+    count = struct.unpack_from('>I', data, pos)[0]
+    item = struct.calcsize('>' + fmt)
+    return [struct.unpack_from('>' + fmt, data, pos + 4 + i * item) for i in range(count)]
+
+
+def video_track(moov, data):
+    for trak in find_all(moov[3], b'trak'):
+        hdlr = find(trak[3], b'mdia', b'hdlr')
+        if hdlr and data[hdlr[1] + 8:hdlr[1] + 12] == b'vide':
+            tkhd = find(trak[3], b'tkhd')
+            version, _, pos = full_box(data, tkhd[1])
+            track_id = struct.unpack_from('>I', data, pos + (16 if version == 1 else 8))[0]
+            return trak, track_id
+    return None, None
+
+
+def sample_keyframes(data, stbl, timescale):
+    """Таблица (секунда, смещение) ключевых кадров обычного (не фрагментированного) MP4."""
+    stts = find(stbl[3], b'stts')
+    stsc = find(stbl[3], b'stsc')
+    stsz = find(stbl[3], b'stsz')
+    chunks = find(stbl[3], b'stco') or find(stbl[3], b'co64')
+    if not (stts and stsc and stsz and chunks):
+        return []
+
+    chunk_offsets = [row[0] for row in read_table(data, chunks, 'I' if chunks[0] == b'stco' else 'Q')]
+    _, _, pos = full_box(data, stsz[1])
+    uniform_size, sample_count = struct.unpack_from('>II', data, pos)
+    if uniform_size:
+        sizes = [uniform_size] * sample_count
+    else:
+        sizes = struct.unpack_from(f'>{sample_count}I', data, pos + 8)
+
+    stss = find(stbl[3], b'stss')
+    sync = {row[0] for row in read_table(data, stss, 'I')} if stss else None
+
+    # Время каждого сэмпла из stts (count, delta)
+    times = []
+    now = 0
+    for count, delta in read_table(data, stts, 'II'):
+        for _ in range(count):
+            times.append(now)
+            now += delta
+
+    # Смещение каждого сэмпла: чанки из stsc (first_chunk, samples_per_chunk, desc)
+    stsc_rows = read_table(data, stsc, 'III')
+    keyframes = []
+    sample = 1
+    for index, (first_chunk, per_chunk, _) in enumerate(stsc_rows):
+        last_chunk = stsc_rows[index + 1][0] if index + 1 < len(stsc_rows) else len(chunk_offsets) + 1
+        for chunk in range(first_chunk, last_chunk):
+            offset = chunk_offsets[chunk - 1]
+            for _ in range(per_chunk):
+                if sample > sample_count:
+                    break
+                if (sync is None or sample in sync) and sample - 1 < len(times):
+                    keyframes.append((round(times[sample - 1] / timescale, 3), offset))
+                offset += sizes[sample - 1]
+                sample += 1
+    return keyframes
+
+
+def fragment_keyframes(fh, boxes, track_id, timescale, default_duration):
+    """Для фрагментированного MP4 точка перехода - начало каждого moof."""
+    keyframes = []
+    end_time = 0
+    for box in boxes:
+        if box.kind != b'moof':
+            continue
+        fh.seek(box.data_offset)
+        data = fh.read(box.size - box.header_size)
+        for traf in find_all(parse_tree(data), b'traf'):
+            tfhd = find(traf[3], b'tfhd')
+            _, flags, pos = full_box(data, tfhd[1])
+            if struct.unpack_from('>I', data, pos)[0] != track_id:
+                continue
+            pos += 4
+            if flags & 0x01:
+                pos += 8
+            if flags & 0x02:
+                pos += 4
+            sample_duration = default_duration
+            if flags & 0x08:
+                sample_duration = struct.unpack_from('>I', data, pos)[0]
+
+            tfdt = find(traf[3], b'tfdt')
+            start = end_time
+            if tfdt:
+                version, _, pos = full_box(data, tfdt[1])
+                start = struct.unpack_from('>Q' if version == 1 else '>I', data, pos)[0]
+
+            total = 0
+            for trun in find_all(traf[3], b'trun'):
+                _, trun_flags, pos = full_box(data, trun[1])
+                count = struct.unpack_from('>I', data, pos)[0]
+                pos += 4
+                if trun_flags & 0x01:
+                    pos += 4
+                if trun_flags & 0x04:
+                    pos += 4
+                fields = [bit for bit in (0x100, 0x200, 0x400, 0x800) if trun_flags & bit]
+                for _ in range(count):
+                    duration = sample_duration
+                    for bit in fields:
+                        if bit == 0x100:
+                            duration = struct.unpack_from('>I', data, pos)[0]
+                        pos += 4
+                    total += duration
+            keyframes.append((round(start / timescale, 3), box.offset))
+            end_time = start + total
+    return keyframes, end_time
+
+
+def probe(path):
+    """Возвращает сведения о файле: длительность, битрейт, ключевые кадры, faststart."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fh:
+        boxes = top_level_boxes(fh)
+        kinds = [box.kind for box in boxes]
+        if b'moov' not in kinds:
+            raise Mp4Error('В файле нет бокса moov')
+        moov_box = boxes[kinds.index(b'moov')]
+        fh.seek(moov_box.data_offset)
+        data = fh.read(moov_box.size - moov_box.header_size)
+        moov = (b'moov', 0, len(data), parse_tree(data))
+
+        movie_scale, movie_duration = read_timing(data, find(moov[3], b'mvhd'))
+        duration = movie_duration / movie_scale if movie_scale else 0
+        keyframes = []
+
+        trak, track_id = video_track(moov, data)
+        timescale = read_timing(data, find(trak[3], b'mdia', b'mdhd'))[0] if trak else 0
+        if timescale:
+            if b'moof' in kinds:
+                default_duration = 0
+                for trex in find_all((find(moov[3], b'mvex') or (None, 0, 0, []))[3], b'trex'):
+                    _, _, pos = full_box(data, trex[1])
+                    trex_track, _, trex_duration = struct.unpack_from('>III', data, pos)
+                    if trex_track == track_id:
+                        default_duration = trex_duration
+                keyframes, end_time = fragment_keyframes(fh, boxes, track_id, timescale, default_duration)
+                duration = duration or end_time / timescale
+            else:
+                stbl = find(trak[3], b'mdia', b'minf', b'stbl')
+                if stbl:
+                    keyframes = sample_keyframes(data, stbl, timescale)
+
+    mdat = next((box for box in boxes if box.kind == b'mdat'), None)
+    return {
+        'size': size,
+        'duration': duration,
+        'bitrate': int(size * 8 / duration) if duration else 0,
+        'keyframes': keyframes,
+        'faststart': mdat is None or moov_box.offset < mdat.offset,
+        'fragmented': b'moof' in kinds,
+    }
+
+
+def shift_chunk_offsets(data, nodes, delta, before):
+    data = bytearray(data)
+    stack = list(nodes)
+    while stack:
+        kind, start, end, children = stack.pop()
+        stack.extend(children)
+        if kind not in (b'stco', b'co64'):
+            continue
+        fmt = '>I' if kind == b'stco' else '>Q'
+        item = struct.calcsize(fmt)
+        count = struct.unpack_from('>I', data, start + 4)[0]
+        pos = start + 8
+        for _ in range(count):
+            value = struct.unpack_from(fmt, data, pos)[0]
+            if value < before:
+                value += delta
+            if kind == b'stco' and value > 0xFFFFFFFF:
+                raise Mp4Error('Смещение не помещается в stco, нужен co64')
+            struct.pack_into(fmt, data, pos, value)
+            pos += item
+    return bytes(data)
+
+
+def copy_range(src, dst, start, length):
+    src.seek(start)
+    while length > 0:
+        chunk = src.read(min(COPY_CHUNK, length))
+        if not chunk:
+            raise Mp4Error('Файл обрезан')
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def faststart(path):
+    """Переносит moov в начало файла. Возвращает True, если файл переписан.
+
+    Данные копируются потоково во временный файл рядом с исходным,
+    который затем атомарно подменяет оригинал.
+    """
+    with open(path, 'rb') as src:
+        boxes = top_level_boxes(src)
+        kinds = [box.kind for box in boxes]
+        if b'moov' not in kinds or b'mdat' not in kinds:
+            return False
+        moov_box = boxes[kinds.index(b'moov')]
+        mdat_box = boxes[kinds.index(b'mdat')]
+        if moov_box.offset < mdat_box.offset or b'moof' in kinds:
+            # Уже faststart, либо фрагментированный файл (у него moov и так в начале)
+            return False
+
+        src.seek(moov_box.offset)
+        raw = src.read(moov_box.size)
+        tree = parse_tree(raw, moov_box.header_size, len(raw))
+        # Данные между точкой вставки и старым местом moov сдвигаются на его размер
+        moved = shift_chunk_offsets(raw, tree, moov_box.size, moov_box.offset)
+
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.faststart')
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                for box in boxes:
+                    if box is moov_box:
+                        continue
+                    if box is mdat_box:
+                        dst.write(moved)
+                    copy_range(src, dst, box.offset, box.size)
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return True
+
+
+def keyframe_at(keyframes, seconds):
+    """Ближайший ключевой кадр не позже seconds: (секунда, смещение) или None."""
+    if not keyframes:
+        return None
+    index = bisect_right(keyframes, seconds, key=lambda row: row[0]) - 1
+    return tuple(keyframes[max(index, 0)])
@@ -0,0 +1,37 @@
+"""Навигация между эпизодами сериала с переходом через границу сезона.
+
+Соседи берутся из дерева сезонов и эпизодов (kf_app.series_tree): оно уже
+упорядочено по сквозной нумерации (season_number, episode_number),
+закэшировано и сбрасывается сигналами при любом изменении сезонов и
+эпизодов, поэтому своего кэша у навигации нет.
+"""
+from .series_tree import get_tree
+
+
+def build_navigation(tree):
+    entries = [
+        {'id': episode['id'], 'season_number': season['season_number'], 'episode_number': episode['episode_number']}
+        for season in tree['seasons']
+        for episode in season['episodes']
+    ]
+    navigation = {}
+    for index, entry in enumerate(entries):
+        entry['position'] = index + 1
+        navigation[entry['id']] = {
+            'position': entry['position'],
+            'previous': entries[index - 1] if index > 0 else None,
+            'next': entries[index + 1] if index + 1 < len(entries) else None,
+        }
+    return navigation
+
+
+def get_navigation(series_id):
+    return build_navigation(get_tree(series_id))
+
+
+def neighbours(episode):
+    """(предыдущий, следующий) эпизод сериала: словари с id и номерами или None."""
+    entry = get_navigation(episode.season.media_content_id).get(episode.pk)
+    if entry is None:
+        return None, None
+    return entry['previous'], entry['next']
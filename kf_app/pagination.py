@@ -0,0 +1,59 @@
+import datetime
+
+from django.db.models import Q
+
+from .facets import MAX_ID
+
+PAGE_SIZE = 24
+
+
+def encode_cursor(item):
+    return make_cursor(item.release_date, item.pk)
+
+
+def make_cursor(release_date, pk):
+    return f'{release_date.isoformat()}.{pk}'
+
+
+def decode_cursor(value):
+    """(release_date, id) из курсора или None, если он битый: тогда отдаётся первая страница."""
+    try:
+        date, pk = value.split('.')
+        date = datetime.date.fromisoformat(date)
+    except (AttributeError, ValueError):
+        return None
+    # id длиннее BIGINT не дошёл бы до базы (OverflowError в запросе)
+    if not (pk.isascii() and pk.isdigit() and len(pk) <= len(str(MAX_ID))) or int(pk) > MAX_ID:
+        return None
+    return date, int(pk)
+
+
+def after_cursor(queryset, cursor):
+    """Строки после курсора в порядке (-release_date, -id)."""
+    queryset = queryset.order_by('-release_date', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        date, pk = position
+        queryset = queryset.filter(Q(release_date__lt=date) | Q(release_date=date, id__lt=pk))
+    return queryset
+
+
+def keyset_page(queryset, cursor=None, size=PAGE_SIZE):
+    """Страница по ключу (release_date, id) без OFFSET и COUNT(*).
+
+    Возвращает (элементы, курсор следующей страницы или None). Стоимость
+    любой страницы одинакова: поиск по индексу + LIMIT size + 1.
+    """
+    return split_page(list(after_cursor(queryset, cursor)[:size + 1]), size)
+
+
+async def akeyset_page(queryset, cursor=None, size=PAGE_SIZE):
+    """keyset_page для async views."""
+    return split_page([item async for item in after_cursor(queryset, cursor)[:size + 1]], size)
+
+
+def split_page(items, size):
+    if len(items) > size:
+        items = items[:size]
+        return items, encode_cursor(items[-1])
+    return items, None
@@ -0,0 +1,208 @@
+"""Замеры производительности запросов: SQL, шаблоны, размер ответа.
+
+perf_middleware открывает на время запроса объект Timings в ContextVar:
+- query_wrapper (ставится на каждое соединение в connection_created)
+  считает запросы и время в базе - в том числе из sync_to_async async views,
+  контекст переносится в их поток;
+- шаблонный бэкенд DjangoTemplates этого модуля считает время рендеринга
+  внешнего шаблона (вложенные include входят в него).
+
+Результат уходит в заголовок Server-Timing (если PERF_SERVER_TIMING) и в скользящее окно последних
+PERF_WINDOW запросов по имени URL (kf_app:movie_detail и т. д.), откуда
+stats() считает перцентили и гистограмму для /stats/perf/. Медленные
+запросы можно выборочно профилировать cProfile (PERF_PROFILE_RATE).
+
+Потоковые ответы (API каталога, видео) замеряются до отправки заголовков:
+запросы и чтение файла при выдаче тела в замер не входят.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from django.utils.decorators import sync_and_async_middleware
+
+WINDOW = getattr(settings, 'PERF_WINDOW', 1000)
+# Доля запросов под cProfile и порог, после которого профиль сохраняется
+PROFILE_RATE = getattr(settings, 'PERF_PROFILE_RATE', 0.0)
+PROFILE_THRESHOLD_MS = getattr(settings, 'PERF_PROFILE_THRESHOLD_MS', 500)
+PROFILE_DIR = getattr(settings, 'PERF_PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+# Границы корзин гистограммы времени ответа, мс
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+METRICS = ('total_ms', 'db_ms', 'queries', 'template_ms', 'bytes')
+
+_current = ContextVar('kf_perf_timings', default=None)
+_samples = defaultdict(lambda: deque(maxlen=WINDOW))
+_lock = threading.Lock()
+
+
+class Timings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = False
+
+
+def query_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def install(connection):
+    # connection_created приходит при каждом переоткрытии соединения
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None or timings.rendering:
+            return super().render(context, request)
+        timings.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template += time.perf_counter() - started
+            timings.rendering = False
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Стандартный бэкенд шаблонов с замером времени рендеринга."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+def response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    # Потоковый ответ ещё не отправлен: известен только заявленный размер
+    length = response.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def finish(request, response, timings, started):
+    total = (time.perf_counter() - started) * 1000
+    db_ms = timings.db * 1000
+    template_ms = timings.template * 1000
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match else '<unresolved>'
+    with _lock:
+        _samples[name].append((total, db_ms, timings.queries, template_ms, response_size(response)))
+    # Заголовок раскрывает устройство сервиса, поэтому включается только явно
+    if getattr(settings, 'PERF_SERVER_TIMING', False):
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="queries={timings.queries}"',
+            f'tpl;dur={template_ms:.1f}',
+            f'app;dur={max(total - db_ms - template_ms, 0):.1f}',
+            f'total;dur={total:.1f}',
+        ])
+    return total, name
+
+
+def save_profile(profiler, name, total):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{name.replace(':', '_')}-{total:.0f}ms.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+
+
+@sync_and_async_middleware
+def perf_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            # cProfile видит только свой поток, поэтому async-запросы не профилируются
+            timings = Timings()
+            token = _current.set(timings)
+            started = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            finish(request, response, timings, started)
+            return response
+        return middleware
+
+    def middleware(request):
+        timings = Timings()
+        token = _current.set(timings)
+        profiler = cProfile.Profile() if PROFILE_RATE and random.random() < PROFILE_RATE else None
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            _current.reset(token)
+        total, name = finish(request, response, timings, started)
+        if profiler is not None and total >= PROFILE_THRESHOLD_MS:
+            save_profile(profiler, name, total)
+        return response
+    return middleware
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+
+    def pick(fraction):
+        return round(values[min(len(values) - 1, int(len(values) * fraction))], 1)
+
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': round(values[-1], 1)}
+
+
+def histogram(values):
+    counts = dict.fromkeys([f'le_{bound}' for bound in BUCKETS_MS] + ['inf'], 0)
+    for value in values:
+        for bound in BUCKETS_MS:
+            if value <= bound:
+                counts[f'le_{bound}'] += 1
+                break
+        else:
+            counts['inf'] += 1
+    return counts
+
+
+def stats():
+    """Перцентили метрик и гистограмма времени ответа по именам URL текущего процесса."""
+    with _lock:
+        snapshot = {name: list(samples) for name, samples in _samples.items()}
+    views = {}
+    for name, samples in sorted(snapshot.items()):
+        columns = list(zip(*samples))
+        views[name] = {'count': len(samples), 'histogram_ms': histogram(columns[0])}
+        for metric, values in zip(METRICS, columns):
+            views[name][metric] = percentiles([value for value in values if value is not None])
+    return {'window': WINDOW, 'views': views}
+
+
+def reset():
+    with _lock:
+        _samples.clear()
@@ -0,0 +1,196 @@
+"""Приём прогресса просмотра от плеера.
+
+Heartbeat'ы копятся в памяти процесса и схлопываются по ключу
+(пользователь, фильм/эпизод): из сотни сообщений одного зрителя в базу
+попадает только последнее. Буфер сбрасывается одной парой upsert-запросов
+(bulk_create с ON CONFLICT DO UPDATE), когда набирается FLUSH_SIZE ключей,
+по таймеру через FLUSH_INTERVAL секунд после первого несохранённого
+heartbeat'а (даже если новых не будет), перед чтением «Продолжить просмотр»
+с несохранёнными позициями пользователя и при завершении процесса. При
+аварийном завершении (SIGKILL) теряется не больше FLUSH_INTERVAL секунд.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+from .models import Episode, MediaContent, ViewHistory
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = getattr(settings, 'PROGRESS_FLUSH_SIZE', 500)
+FLUSH_INTERVAL = getattr(settings, 'PROGRESS_FLUSH_INTERVAL', 15)
+# viewed_seconds - 32-битное целое; id длиннее 18 цифр не помещается в INTEGER SQLite
+MAX_POSITION = 2 ** 31 - 1
+MAX_ID_DIGITS = 18
+
+
+def parse_position(value):
+    """Позиция плеера в целых секундах или None, если она не число или вне 0..MAX_POSITION."""
+    try:
+        position = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(position) or not 0 <= position <= MAX_POSITION:
+        return None
+    return int(position)
+
+
+def parse_id(value):
+    if value and value.isascii() and value.isdigit() and len(value) <= MAX_ID_DIGITS:
+        return int(value)
+    return None
+
+
+class ProgressBuffer:
+    def __init__(self, size=FLUSH_SIZE, interval=FLUSH_INTERVAL):
+        self.size = size
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def add(self, user_id, seconds, media_content_id=None, episode_id=None):
+        key = (user_id, media_content_id, episode_id)
+        with self._lock:
+            self._pending[key] = seconds
+            due = len(self._pending) >= self.size or time.monotonic() - self._last_flush >= self.interval
+            if not due and self._timer is None:
+                # Без новых heartbeat'ов буфер всё равно сбросится через interval
+                self._timer = threading.Timer(self.interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush(wait=True)
+        finally:
+            # Поток таймера не обслуживает запросы: соединение закрываем сами
+            connection.close()
+
+    def get(self, user_id, media_content_id=None, episode_id=None):
+        with self._lock:
+            return self._pending.get((user_id, media_content_id, episode_id))
+
+    def has_pending(self, user_id):
+        with self._lock:
+            return any(key[0] == user_id for key in self._pending)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self, wait=False):
+        # Один поток пишет, остальные продолжают копить новый буфер;
+        # wait=True - дождаться чужого сброса и сбросить то, что накопилось после
+        if not self._flush_lock.acquire(blocking=wait):
+            return 0
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not pending:
+                return 0
+            try:
+                write(pending)
+            except OperationalError:
+                # База недоступна или занята: вся пачка ждёт следующего сброса
+                logger.exception("Не удалось записать прогресс просмотра, повтор при следующем сбросе")
+                self.requeue(pending)
+                return 0
+            except Exception:
+                logger.exception("Не удалось записать прогресс просмотра пачкой, пишем по одной записи")
+                return self.write_each(pending)
+            return len(pending)
+        finally:
+            self._flush_lock.release()
+
+    def requeue(self, pending):
+        with self._lock:
+            for key, seconds in pending.items():
+                self._pending.setdefault(key, seconds)
+
+    def write_each(self, pending):
+        """Запись по одной: строка с некорректными данными отбрасывается и не блокирует остальные."""
+        written = 0
+        for key, seconds in pending.items():
+            try:
+                write({key: seconds})
+            except OperationalError:
+                logger.exception("Не удалось записать прогресс %s, повтор при следующем сбросе", key)
+                self.requeue({key: seconds})
+            except Exception:
+                logger.exception("Некорректный прогресс %s=%r отброшен", key, seconds)
+            else:
+                written += 1
+        return written
+
+
+def write(pending):
+    media_ids = {media_id for _, media_id, _ in pending if media_id}
+    episode_ids = {episode_id for _, _, episode_id in pending if episode_id}
+    # Несуществующие id отбрасываем заранее, иначе FK провалит всю пачку
+    media_ids = set(MediaContent.objects.filter(pk__in=media_ids).values_list('pk', flat=True))
+    episode_ids = set(Episode.objects.filter(pk__in=episode_ids).values_list('pk', flat=True))
+
+    media_rows = []
+    episode_rows = []
+    for (user_id, media_id, episode_id), seconds in pending.items():
+        if media_id in media_ids:
+            media_rows.append(ViewHistory(user_id=user_id, media_content_id=media_id, viewed_seconds=seconds))
+        elif episode_id in episode_ids:
+            episode_rows.append(ViewHistory(user_id=user_id, episode_id=episode_id, viewed_seconds=seconds))
+
+    with transaction.atomic():
+        if media_rows:
+            ViewHistory.objects.bulk_create(
+                media_rows, batch_size=500, update_conflicts=True,
+                unique_fields=['user', 'media_content'], update_fields=['viewed_seconds', 'viewed_at'],
+            )
+        if episode_rows:
+            ViewHistory.objects.bulk_create(
+                episode_rows, batch_size=500, update_conflicts=True,
+                unique_fields=['user', 'episode'], update_fields=['viewed_seconds', 'viewed_at'],
+            )
+
+
+buffer = ProgressBuffer()
+atexit.register(buffer.flush)
+
+
+def record(user_id, seconds, media_content_id=None, episode_id=None):
+    buffer.add(user_id, seconds, media_content_id=media_content_id, episode_id=episode_id)
+
+
+def resume_position(user_id, media_content_id=None, episode_id=None):
+    """Секунда, с которой продолжить просмотр: сначала буфер, затем запись по уникальному ключу."""
+    if user_id is None:
+        return 0
+    seconds = buffer.get(user_id, media_content_id=media_content_id, episode_id=episode_id)
+    if seconds is not None:
+        return seconds
+    lookup = {'media_content_id': media_content_id} if media_content_id else {'episode_id': episode_id}
+    seconds = ViewHistory.objects.filter(user_id=user_id, **lookup).values_list('viewed_seconds', flat=True).first()
+    return seconds or 0
+
+
+def continue_watching(user_id, limit=12):
+    if user_id is None:
+        return []
+    # Список читается из базы: несохранённые позиции пользователя сначала записываем
+    if buffer.has_pending(user_id):
+        buffer.flush(wait=True)
+    return list(
+        ViewHistory.objects.filter(user_id=user_id, viewed_seconds__gt=0)
+        .select_related('media_content', 'episode__season__media_content')
+        .order_by('-viewed_at')[:limit]
+    )
@@ -0,0 +1,118 @@
+"""Пользовательские оценки и рейтинг тайтла.
+
+MediaContent хранит сумму и количество оценок; каждый голос меняет их
+одним UPDATE с F-выражениями, и в том же запросе пересчитывается
+отображаемый рейтинг - байесовское среднее, которое тянет рейтинг
+тайтлов с малым числом голосов к редакционной оценке тайтла rating_prior
+(если её нет - к общему RATING_PRIOR_MEAN):
+
+    rating = (W * M + sum) / (W + count)
+
+Без голосов rating равен rating_prior; при сохранении тайтла (правка
+rating_prior в админке) он пересчитывается сигналом (см. kf_app.signals).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Round
+from django.utils import timezone
+
+from . import facets, fragments
+from .models import MediaContent, Rating
+
+PRIOR_MEAN = getattr(settings, 'RATING_PRIOR_MEAN', 6.5)
+PRIOR_WEIGHT = getattr(settings, 'RATING_PRIOR_WEIGHT', 10)
+SCALE = range(1, 11)
+
+
+def bayesian(total, count, prior=None):
+    prior = PRIOR_MEAN if prior is None else prior
+    return round((PRIOR_WEIGHT * prior + total) / (PRIOR_WEIGHT + count), 1)
+
+
+def apply_vote(media_id, delta_sum, delta_count):
+    before = MediaContent.objects.filter(pk=media_id).values_list('content_type', 'rating').first()
+    if before is None:
+        return
+    MediaContent.objects.filter(pk=media_id).update(
+        rating_sum=F('rating_sum') + delta_sum,
+        rating_count=F('rating_count') + delta_count,
+        rating=Round(
+            (Value(float(PRIOR_WEIGHT)) * Coalesce(F('rating_prior'), Value(PRIOR_MEAN))
+             + Cast(F('rating_sum') + delta_sum, FloatField()))
+            / (Value(float(PRIOR_WEIGHT)) + Cast(F('rating_count') + delta_count, FloatField())),
+            1,
+        ),
+        updated_at=timezone.now(),
+    )
+    rating = MediaContent.objects.filter(pk=media_id).values_list('rating', flat=True).first()
+
+    # update() обходит сигналы: счётчики фильтров и версии фрагментов правим сами
+    content_type, old_rating = before
+    facets.apply_changes(
+        {(content_type, 'rating', facets.rating_band(old_rating))},
+        {(content_type, 'rating', facets.rating_band(rating))},
+    )
+    # Главная страница рейтинг не показывает: её фрагменты от голосов не зависят
+    fragments.bump('media', media_id)
+
+
+def cast_vote(user_id, media_id, score):
+    with transaction.atomic():
+        previous = Rating.objects.filter(user_id=user_id, media_content_id=media_id).values_list('score', flat=True).first()
+        if previous is None:
+            Rating.objects.create(user_id=user_id, media_content_id=media_id, score=score)
+            apply_vote(media_id, score, 1)
+        elif previous != score:
+            Rating.objects.filter(user_id=user_id, media_content_id=media_id).update(score=score)
+            apply_vote(media_id, score - previous, 0)
+
+
+def retract_vote(user_id, media_id):
+    with transaction.atomic():
+        previous = Rating.objects.filter(user_id=user_id, media_content_id=media_id).values_list('score', flat=True).first()
+        if previous is not None:
+            Rating.objects.filter(user_id=user_id, media_content_id=media_id).delete()
+            apply_vote(media_id, -previous, -1)
+
+
+def user_vote(user_id, media_id):
+    if user_id is None:
+        return None
+    return Rating.objects.filter(user_id=user_id, media_content_id=media_id).values_list('score', flat=True).first()
+
+
+def find_drift():
+    """Тайтлы, у которых сохранённые агрегаты не совпадают с таблицей оценок."""
+    actual = {
+        row['media_content']: (row['total'], row['votes'])
+        for row in Rating.objects.values('media_content').annotate(total=Sum('score'), votes=Count('id'))
+    }
+    drift = []
+    stored = MediaContent.objects.filter(rating_count__gt=0).values_list('pk', 'rating_sum', 'rating_count')
+    seen = set()
+    for pk, total, count in stored.iterator():
+        seen.add(pk)
+        if actual.get(pk, (0, 0)) != (total, count):
+            drift.append((pk, (total, count), actual.get(pk, (0, 0))))
+    for pk, values in actual.items():
+        if pk not in seen:
+            drift.append((pk, (0, 0), values))
+    return drift
+
+
+def rebuild(drift=None, batch_size=1000):
+    """Исправляет агрегаты у расходящихся тайтлов пакетным bulk_update."""
+    drift = find_drift() if drift is None else drift
+    now = timezone.now()
+    priors = dict(MediaContent.objects.filter(pk__in=[pk for pk, _, _ in drift]).values_list('pk', 'rating_prior'))
+    items = []
+    for pk, _, (total, count) in drift:
+        item = MediaContent(pk=pk, rating_sum=total, rating_count=count, updated_at=now)
+        item.rating = bayesian(total, count, priors.get(pk))
+        items.append(item)
+    MediaContent.objects.bulk_update(items, ['rating_sum', 'rating_count', 'rating', 'updated_at'], batch_size=batch_size)
+    if items:
+        facets.rebuild()
+        fragments.bump('media', *(item.pk for item in items))
+    return len(items)
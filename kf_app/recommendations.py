@@ -0,0 +1,173 @@
+"""Рекомендации «Похожее» по сходству тайтлов.
+
+Сходство двух тайтлов - взвешенная сумма трёх косинусных мер:
+совместные просмотры и избранное одних и тех же пользователей, общие
+жанры и общие участники (режиссёр весит больше актёра). Матрица считается
+пакетно командой build_recommendations на разреженных матрицах SciPy,
+для каждого тайтла сохраняются TOP_K соседей в Recommendation - страница
+читает их одним запросом по индексу (media_content, rank).
+
+NumPy и SciPy нужны только для расчёта и импортируются внутри compute().
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from . import fragments
+from .models import ContentParticipation, Favorite, MediaContent, Recommendation, ViewHistory
+
+TOP_K = getattr(settings, 'RECOMMENDATIONS_TOP_K', 12)
+# Веса мер сходства: совместные просмотры, жанры, участники
+WEIGHTS = getattr(settings, 'RECOMMENDATIONS_WEIGHTS', {'cooccurrence': 0.6, 'genres': 0.25, 'people': 0.15})
+VIEW_WEIGHT = 1.0
+FAVORITE_WEIGHT = 2.0
+ROLE_WEIGHTS = {'DIRECTOR': 2.0, 'ACTOR': 1.0, 'WRITER': 1.0}
+# Сколько ячеек плотного блока строк матрицы держать в памяти при выборе соседей
+BLOCK_CELLS = 4_000_000
+# Сколько последних тайтлов пользователя берётся как основа персональной подборки
+USER_SEEDS = 20
+
+
+def user_items():
+    """Пары (пользователь, тайтл) с весом: просмотр фильма или любой серии, избранное."""
+    weights = {}
+    views = ViewHistory.objects.values_list('user_id', 'media_content_id', 'episode__season__media_content_id')
+    for user_id, media_id, series_id in views.iterator(chunk_size=5000):
+        weights[(user_id, media_id or series_id)] = VIEW_WEIGHT
+    for user_id, media_id in Favorite.objects.values_list('user_id', 'media_content_id').iterator(chunk_size=5000):
+        weights[(user_id, media_id)] = weights.get((user_id, media_id), 0) + FAVORITE_WEIGHT
+    return weights
+
+
+def normalize_rows(matrix):
+    import numpy as np
+    from scipy import sparse
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def feature_matrix(pairs, index, shape):
+    """Разреженная матрица тайтлы x признаки из троек (тайтл, признак, вес)."""
+    import numpy as np
+    from scipy import sparse
+
+    rows, cols, data = [], [], []
+    columns = {}
+    for media_id, feature, weight in pairs:
+        if media_id in index:
+            rows.append(index[media_id])
+            cols.append(columns.setdefault(feature, len(columns)))
+            data.append(weight)
+    matrix = sparse.coo_matrix(
+        (np.array(data, dtype=np.float32), (rows, cols)), shape=(shape, max(len(columns), 1)),
+    ).tocsr()
+    # Повторы (несколько ролей одного человека) складываются при переводе в CSR
+    return normalize_rows(matrix)
+
+
+def compute(top_k=TOP_K):
+    """Считает соседей всех тайтлов; возвращает [(тайтл, сосед, сходство, позиция)]."""
+    import numpy as np
+
+    ids = list(MediaContent.objects.order_by('pk').values_list('pk', flat=True))
+    if len(ids) < 2:
+        return []
+    index = {pk: i for i, pk in enumerate(ids)}
+    n = len(ids)
+
+    # Пользователи x тайтлы -> тайтлы x пользователи, нормированные по строкам:
+    # произведение на транспонированную даёт косинус совместных просмотров
+    interactions = user_items()
+    users = {}
+    triples = [
+        (media_id, users.setdefault(user_id, len(users)), weight)
+        for (user_id, media_id), weight in interactions.items()
+    ]
+    parts = [
+        (WEIGHTS['cooccurrence'], feature_matrix(triples, index, n)),
+        (WEIGHTS['genres'], feature_matrix(
+            ((media_id, genre_id, 1.0) for media_id, genre_id
+             in MediaContent.genres.through.objects.values_list('mediacontent_id', 'genre_id')),
+            index, n,
+        )),
+        (WEIGHTS['people'], feature_matrix(
+            ((media_id, person_id, ROLE_WEIGHTS.get(role, 0.5)) for media_id, person_id, role
+             in ContentParticipation.objects.values_list('media_content_id', 'person_id', 'role')),
+            index, n,
+        )),
+    ]
+    parts = [(weight, matrix) for weight, matrix in parts if weight and matrix.nnz]
+    if not parts:
+        return []
+
+    top_k = min(top_k, n - 1)
+    block = max(1, BLOCK_CELLS // n)
+    ids = np.array(ids)
+    result = []
+    # Матрица сходства n x n может быть почти плотной (общий жанр),
+    # поэтому она считается блоками строк и сразу сворачивается до top_k
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        scores = np.zeros((stop - start, n), dtype=np.float32)
+        for weight, matrix in parts:
+            scores += weight * (matrix[start:stop] @ matrix.T).toarray()
+        scores[np.arange(stop - start), np.arange(start, stop)] = 0
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        for row, columns in enumerate(top):
+            columns = columns[np.argsort(-scores[row, columns], kind='stable')]
+            rank = 0
+            for column in columns:
+                score = float(scores[row, column])
+                if score <= 0:
+                    break
+                rank += 1
+                result.append((int(ids[start + row]), int(ids[column]), score, rank))
+    return result
+
+
+def rebuild(top_k=TOP_K, batch_size=1000):
+    rows = compute(top_k)
+    with transaction.atomic():
+        Recommendation.objects.all().delete()
+        Recommendation.objects.bulk_create(
+            [Recommendation(media_content_id=media_id, recommended_id=other_id, score=score, rank=rank)
+             for media_id, other_id, score, rank in rows],
+            batch_size=batch_size,
+        )
+    fragments.bump('recommendations', 0)
+    return len(rows)
+
+
+def similar(media_id, limit=TOP_K):
+    return [
+        item.recommended for item in
+        Recommendation.objects.filter(media_content_id=media_id).select_related('recommended')[:limit]
+    ]
+
+
+def for_user(user_id, limit=TOP_K):
+    """«Вам может понравиться»: соседи последних тайтлов пользователя, которых он ещё не видел."""
+    if user_id is None:
+        return []
+    seen = []
+    views = (
+        ViewHistory.objects.filter(user_id=user_id).order_by('-viewed_at')
+        .values_list('media_content_id', 'episode__season__media_content_id')
+    )
+    for media_id, series_id in views:
+        seen.append(media_id or series_id)
+    seen.extend(Favorite.objects.filter(user_id=user_id).order_by('-added_at').values_list('media_content_id', flat=True))
+    if not seen:
+        return []
+    seeds = list(dict.fromkeys(seen))[:USER_SEEDS]
+    ranked = (
+        Recommendation.objects.filter(media_content_id__in=seeds)
+        .exclude(recommended_id__in=set(seen))
+        .values('recommended_id').annotate(total=Sum('score'))
+        .order_by('-total', 'recommended_id')[:limit]
+    )
+    ids = [row['recommended_id'] for row in ranked]
+    found = MediaContent.objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,122 @@
+"""Полнотекстовый поиск по каталогу на SQLite FTS5.
+
+Документ индекса - один MediaContent (rowid = id): название, описание,
+названия жанров и имена участников. Текст документа и запроса проходит
+normalize(): нижний регистр и ё -> е. Токенизатор unicode61 (таблица
+создаётся миграцией 0008) регистр тоже сворачивает, а ё и е различает.
+Окончания русских слов отбрасываются при разборе запроса, а основа ищется
+как префикс.
+"""
+import re
+
+from django.db import connection, transaction
+
+from .models import ContentParticipation, MediaContent
+
+TABLE = 'kf_app_search'
+
+# Веса столбцов для bm25: title, description, genres, people
+WEIGHTS = (10.0, 1.0, 3.0, 5.0)
+
+# Окончания, которые отбрасываются у слов запроса (от длинных к коротким)
+RU_ENDINGS = sorted("""
+    ами ями ого его ому ему ыми ими ией ий ый ой ая яя ое ее ые ие ых их
+    ую юю ом ем ам ям ах ях ов ев ей ью ия ья а я о е ы и у ю ь
+""".split(), key=len, reverse=True)
+MIN_STEM = 3
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def stem(word):
+    if re.search('[а-я]', word) and len(word) > MIN_STEM + 1:
+        for ending in RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+                return word[:-len(ending)]
+    return word
+
+
+def build_query(text):
+    terms = [stem(word) for word in WORD_RE.findall(normalize(text))]
+    # Каждое слово - префиксный запрос, слова объединяются через AND
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+def document_rows(ids):
+    media = MediaContent.objects.filter(pk__in=ids).prefetch_related('genres')
+    people = {}
+    participations = (
+        ContentParticipation.objects.filter(media_content_id__in=ids)
+        .values_list('media_content_id', 'person__first_name', 'person__last_name')
+    )
+    for media_id, first_name, last_name in participations:
+        people.setdefault(media_id, []).append(f'{first_name} {last_name}')
+    for item in media:
+        yield (
+            item.pk,
+            normalize(item.title),
+            normalize(item.description),
+            normalize(' '.join(genre.name for genre in item.genres.all())),
+            normalize(' '.join(people.get(item.pk, []))),
+        )
+
+
+def index_documents(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    rows = list(document_rows(ids))
+    # Одна транзакция на пачку: в autocommit каждая строка executemany - отдельный коммит
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, title, description, genres, people) VALUES (%s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def remove_document(pk):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [pk])
+
+
+def rebuild(batch_size=1000):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    total = 0
+    ids = MediaContent.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for pk in ids.iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            index_documents(batch)
+            total += len(batch)
+            batch = []
+    index_documents(batch)
+    total += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def search_ids(text, limit=50):
+    query = build_query(text)
+    if not query:
+        return []
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY bm25({TABLE}, {weights}) LIMIT %s',
+            [query, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(text, limit=50):
+    ids = search_ids(text, limit)
+    found = MediaContent.objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
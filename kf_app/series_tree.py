@@ -0,0 +1,59 @@
+"""Дерево сезонов и эпизодов сериала, собранное за два запроса и закэшированное.
+
+Кэш сбрасывается сигналами при сохранении и удалении Season/Episode. Из
+дерева же строится навигация по эпизодам (kf_app.navigation).
+
+Удаление видно только процессам с тем же кэшем: с кэшем в памяти воркера
+соседний воркер продолжит отдавать своё дерево. Поэтому ключ живёт
+CACHE_TIMEOUT секунд - правка в админке дойдёт до всех воркеров не позже
+этого срока и без общего кэша.
+"""
+from django.core.cache import cache
+
+from .models import Episode, Season
+
+CACHE_TIMEOUT = 300
+
+
+def cache_key(series_id):
+    return f'series-tree:{series_id}'
+
+
+def build_tree(series_id):
+    seasons = list(
+        Season.objects.filter(media_content_id=series_id)
+        .order_by('season_number')
+        .values('id', 'season_number', 'description')
+    )
+    by_id = {}
+    for season in seasons:
+        season['episodes'] = []
+        by_id[season['id']] = season
+
+    episodes = (
+        Episode.objects.filter(season__media_content_id=series_id)
+        .order_by('season__season_number', 'episode_number')
+        .values('id', 'season_id', 'episode_number', 'title', 'description', 'duration', 'release_date', 'video_file')
+    )
+    total = 0
+    for episode in episodes:
+        episode['has_video'] = bool(episode.pop('video_file'))
+        by_id[episode['season_id']]['episodes'].append(episode)
+        total += 1
+
+    for season in seasons:
+        season['episode_count'] = len(season['episodes'])
+    return {'seasons': seasons, 'total_episodes': total}
+
+
+def get_tree(series_id):
+    tree = cache.get(cache_key(series_id))
+    if tree is None:
+        tree = build_tree(series_id)
+        cache.set(cache_key(series_id), tree, CACHE_TIMEOUT)
+    return tree
+
+
+def invalidate(series_id):
+    if series_id:
+        cache.delete(cache_key(series_id))
@@ -0,0 +1,319 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import db, entitlements, facets, favorites, fragments, images, perf, ratings, search, series_tree, video
+from .models import ContentParticipation, Episode, FacetCount, Favorite, Genre, MediaContent, Person, Season, UserSubscription
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    db.configure_connection(connection)
+    perf.install(connection)
+
+
+@receiver(post_save, sender=MediaContent)
+@receiver(post_save, sender=Episode)
+def video_uploaded(sender, instance, **kwargs):
+    # Новый или сменившийся файл обрабатывается в фоне после коммита; обычное сохранение записи его не трогает
+    if video.is_pending(instance):
+        transaction.on_commit(lambda: video.schedule(instance))
+
+
+@receiver(post_save, sender=MediaContent)
+@receiver(post_save, sender=Person)
+def image_uploaded(sender, instance, **kwargs):
+    # Производные строятся, только если файл сменился: обычное сохранение записи их не трогает
+    if images.stale_fields(instance):
+        transaction.on_commit(lambda: images.update(instance))
+
+
+# Поисковый индекс: переиндексация после коммита, чтобы видеть итоговое состояние
+def reindex_later(ids):
+    ids = set(ids)
+    if ids:
+        transaction.on_commit(lambda: search.index_documents(ids))
+
+
+@receiver(post_save, sender=MediaContent)
+def media_saved_search(sender, instance, **kwargs):
+    reindex_later([instance.pk])
+
+
+@receiver(post_delete, sender=MediaContent)
+def media_deleted_search(sender, instance, **kwargs):
+    search.remove_document(instance.pk)
+
+
+@receiver(m2m_changed, sender=MediaContent.genres.through)
+def media_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reindex_later([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # genre.mediacontent_set.add(...): в pk_set id медиаконтента
+        reindex_later(pk_set)
+    elif action == 'pre_clear':
+        reindex_later(instance.mediacontent_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=ContentParticipation)
+@receiver(post_delete, sender=ContentParticipation)
+def participation_changed_search(sender, instance, **kwargs):
+    reindex_later([instance.media_content_id])
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved_search(sender, instance, created, **kwargs):
+    if not created:
+        reindex_later(instance.mediacontent_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+def genre_deleted_search(sender, instance, **kwargs):
+    reindex_later(instance.mediacontent_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Person)
+def person_saved_search(sender, instance, created, **kwargs):
+    if not created:
+        reindex_later(instance.contentparticipation_set.values_list('media_content_id', flat=True))
+
+
+# Рейтинг из редакционной оценки и голосов; до media_facets_before, чтобы тот видел новое значение
+@receiver(pre_save, sender=MediaContent)
+def media_rating(sender, instance, **kwargs):
+    # Агрегаты голосов правит только ratings.apply_vote (F-выражениями): обычное
+    # сохранение, в том числе устаревшего экземпляра, пишет их текущие значения из базы
+    if instance.pk:
+        stored = MediaContent.objects.filter(pk=instance.pk).values_list('rating_sum', 'rating_count').first()
+        if stored is not None:
+            instance.rating_sum, instance.rating_count = stored
+    if instance.rating_count or instance.rating_prior is not None:
+        instance.rating = ratings.bayesian(instance.rating_sum, instance.rating_count, instance.rating_prior)
+    else:
+        # Ни оценки редакции, ни голосов: рейтинга нет
+        instance.rating = 0.0
+
+
+# Счётчики фильтров каталога
+@receiver(pre_save, sender=MediaContent)
+def media_facets_before(sender, instance, **kwargs):
+    before = set()
+    old = None
+    if instance.pk:
+        old = (
+            MediaContent.objects.filter(pk=instance.pk)
+            .values('content_type', 'country', 'release_date', 'age_restriction', 'rating')
+            .first()
+        )
+    if old:
+        before = facets.scalar_keys(**old)
+        if old['content_type'] != instance.content_type:
+            genre_ids = list(instance.genres.values_list('pk', flat=True))
+            before |= facets.genre_keys(old['content_type'], genre_ids)
+            instance._facet_genres = genre_ids
+    instance._facet_keys = before
+
+
+@receiver(post_save, sender=MediaContent)
+def media_facets_after(sender, instance, **kwargs):
+    before = instance.__dict__.pop('_facet_keys', set())
+    after = facets.media_keys(instance)
+    genre_ids = instance.__dict__.pop('_facet_genres', None)
+    if genre_ids is not None:
+        after |= facets.genre_keys(instance.content_type, genre_ids)
+    facets.apply_changes(before, after)
+
+
+@receiver(pre_delete, sender=MediaContent)
+def media_facets_delete(sender, instance, **kwargs):
+    # Значения берём из базы: у устаревшего экземпляра может быть старый рейтинг
+    row = (
+        MediaContent.objects.filter(pk=instance.pk)
+        .values('content_type', 'country', 'release_date', 'age_restriction', 'rating')
+        .first()
+    )
+    if row is None:
+        return
+    # Строки жанров удаляются каскадом без m2m_changed, поэтому учитываем их здесь
+    keys = facets.scalar_keys(**row) | facets.genre_keys(
+        row['content_type'], instance.genres.values_list('pk', flat=True)
+    )
+    facets.apply_changes(keys, set())
+
+
+@receiver(m2m_changed, sender=MediaContent.genres.through)
+def media_genres_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    through = MediaContent.genres.through
+    if action in ('pre_remove', 'pre_clear'):
+        # Запоминаем реально существующие связи до удаления
+        links = through.objects.filter(genre=instance) if reverse else through.objects.filter(mediacontent=instance)
+        if action == 'pre_remove':
+            links = links.filter(**{'mediacontent__in' if reverse else 'genre__in': pk_set})
+        instance._facet_links = list(links.values_list('mediacontent__content_type', 'genre_id'))
+        return
+
+    if action == 'post_add':
+        if reverse:
+            links = [(ct, instance.pk) for ct in MediaContent.objects.filter(pk__in=pk_set).values_list('content_type', flat=True)]
+        else:
+            links = [(instance.content_type, pk) for pk in pk_set]
+        sign = 1
+    elif action in ('post_remove', 'post_clear'):
+        links = instance.__dict__.pop('_facet_links', [])
+        sign = -1
+    else:
+        return
+
+    deltas = Counter()
+    for content_type, genre_id in links:
+        deltas[(content_type, 'genre', str(genre_id))] += sign
+    facets.apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted_facets(sender, instance, **kwargs):
+    FacetCount.objects.filter(facet='genre', value=str(instance.pk)).delete()
+
+
+# Кэш дерева сезонов/эпизодов (и навигации, которая строится из него)
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def season_changed_tree(sender, instance, **kwargs):
+    series_tree.invalidate(instance.media_content_id)
+
+
+@receiver(post_save, sender=Episode)
+@receiver(post_delete, sender=Episode)
+def episode_changed_tree(sender, instance, **kwargs):
+    series_id = Season.objects.filter(pk=instance.season_id).values_list('media_content_id', flat=True).first()
+    series_tree.invalidate(series_id)
+
+
+# Версии кэша HTML-фрагментов
+@receiver(post_save, sender=MediaContent)
+@receiver(post_delete, sender=MediaContent)
+def media_changed_fragments(sender, instance, **kwargs):
+    fragments.bump('media', instance.pk)
+    fragments.bump('home', 0)
+
+
+@receiver(m2m_changed, sender=MediaContent.genres.through)
+def media_genres_fragments(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # genre.mediacontent_set.clear(): post_clear придёт с pk_set=None, тайтлы берём до удаления
+        media_ids = instance.mediacontent_set.values_list('pk', flat=True)
+    elif reverse and action in ('post_add', 'post_remove'):
+        media_ids = pk_set
+    elif not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        media_ids = [instance.pk]
+    else:
+        return
+    fragments.bump('media', *media_ids)
+    # Список каталога фильтруется по жанрам
+    fragments.bump('home', 0)
+
+
+@receiver(post_save, sender=ContentParticipation)
+@receiver(post_delete, sender=ContentParticipation)
+def participation_changed_fragments(sender, instance, **kwargs):
+    fragments.bump('media', instance.media_content_id)
+    fragments.bump('person', instance.person_id)
+
+
+@receiver(post_save, sender=Person)
+def person_changed_fragments(sender, instance, created, **kwargs):
+    fragments.bump('person', instance.pk)
+    if not created:
+        fragments.bump('media', *instance.contentparticipation_set.values_list('media_content_id', flat=True))
+
+
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def season_changed_fragments(sender, instance, **kwargs):
+    fragments.bump('season', instance.pk)
+    fragments.bump('media', instance.media_content_id)
+
+
+@receiver(post_save, sender=Episode)
+@receiver(post_delete, sender=Episode)
+def episode_changed_fragments(sender, instance, **kwargs):
+    fragments.bump('season', instance.season_id)
+    series_id = Season.objects.filter(pk=instance.season_id).values_list('media_content_id', flat=True).first()
+    if series_id:
+        fragments.bump('media', series_id)
+
+
+# Кеш множества избранного (правки из админки и каскадные удаления)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorite_changed(sender, instance, **kwargs):
+    favorites.invalidate(instance.user_id)
+
+
+# Кеш права на просмотр
+@receiver(post_save, sender=UserSubscription)
+@receiver(post_delete, sender=UserSubscription)
+def subscription_changed(sender, instance, **kwargs):
+    entitlements.invalidate(instance.user_id)
+
+
+# updated_at сериала/фильма меняется вместе с дочерними объектами
+def touch_media(queryset):
+    queryset.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def season_changed_touch(sender, instance, **kwargs):
+    touch_media(MediaContent.objects.filter(pk=instance.media_content_id))
+
+
+@receiver(post_save, sender=Episode)
+@receiver(post_delete, sender=Episode)
+def episode_changed_touch(sender, instance, **kwargs):
+    touch_media(MediaContent.objects.filter(season__id=instance.season_id))
+
+
+@receiver(post_save, sender=ContentParticipation)
+@receiver(post_delete, sender=ContentParticipation)
+def participation_changed_touch(sender, instance, **kwargs):
+    touch_media(MediaContent.objects.filter(pk=instance.media_content_id))
+
+
+@receiver(post_save, sender=Person)
+def person_changed_touch(sender, instance, created, **kwargs):
+    if not created:
+        touch_media(MediaContent.objects.filter(contentparticipation__person_id=instance.pk))
+
+
+@receiver(m2m_changed, sender=MediaContent.genres.through)
+def media_genres_touch(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Как и для фрагментов: после clear() связей уже нет, а pk_set пуст
+        touch_media(MediaContent.objects.filter(genres=instance))
+    elif reverse and action in ('post_add', 'post_remove'):
+        touch_media(MediaContent.objects.filter(pk__in=pk_set))
+    elif not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        touch_media(MediaContent.objects.filter(pk=instance.pk))
+
+
+# Название жанра выводится в фильтрах списков и в API тайтла
+@receiver(post_save, sender=Genre)
+def genre_saved_touch(sender, instance, created, **kwargs):
+    if not created:
+        touch_media(MediaContent.objects.filter(genres=instance))
+
+
+# Связи удаляются каскадом без m2m_changed
+@receiver(pre_delete, sender=Genre)
+def genre_deleted_touch(sender, instance, **kwargs):
+    media_ids = list(instance.mediacontent_set.values_list('pk', flat=True))
+    touch_media(MediaContent.objects.filter(pk__in=media_ids))
+    fragments.bump('media', *media_ids)
+    fragments.bump('home', 0)
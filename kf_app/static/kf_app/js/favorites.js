@@ -0,0 +1,39 @@
+// Кнопки «В избранное»: переключают отметку без перезагрузки страницы.
+// Обработчик висит на документе, поэтому работает и для карточек,
+// подгруженных бесконечной прокруткой. Без JS форма отправляется обычно.
+(function () {
+    document.addEventListener('submit', function (event) {
+        const form = event.target;
+        if (!form.classList || !form.classList.contains('favorite-form')) {
+            return;
+        }
+        event.preventDefault();
+        const button = form.querySelector('button[type="submit"]');
+        button.disabled = true;
+        fetch(form.action, {
+            method: 'POST',
+            body: new FormData(form),
+            headers: { 'Accept': 'application/json' },
+            credentials: 'same-origin'
+        })
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.json();
+            })
+            .then(function (data) {
+                button.classList.toggle('active', data.favorite);
+                button.setAttribute('aria-pressed', data.favorite ? 'true' : 'false');
+                if (button.dataset.labelOn) {
+                    button.textContent = data.favorite ? button.dataset.labelOn : button.dataset.labelOff;
+                }
+            })
+            .catch(function () {
+                form.submit();
+            })
+            .finally(function () {
+                button.disabled = false;
+            });
+    });
+})();
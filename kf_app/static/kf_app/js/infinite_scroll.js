@@ -0,0 +1,50 @@
+// Бесконечная прокрутка: подгружает следующую страницу карточек, когда
+// кнопка "Показать ещё" появляется в зоне видимости. Без JS кнопка
+// остаётся обычной ссылкой на следующую страницу.
+(function () {
+    const grid = document.querySelector('[data-page-url]');
+    if (!grid || !('IntersectionObserver' in window)) {
+        return;
+    }
+
+    let loading = false;
+    const observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                loadNext(entry.target);
+            }
+        });
+    }, { rootMargin: '600px' });
+
+    function watch() {
+        const more = grid.querySelector('[data-next-cursor]');
+        if (more) {
+            observer.observe(more);
+        }
+    }
+
+    function loadNext(more) {
+        if (loading) {
+            return;
+        }
+        loading = true;
+        observer.unobserve(more);
+        const pageUrl = grid.dataset.pageUrl;
+        const url = pageUrl + (pageUrl.indexOf('?') === -1 ? '?' : '&') +
+            'after=' + encodeURIComponent(more.dataset.nextCursor);
+        fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(function (response) { return response.text(); })
+            .then(function (html) {
+                more.remove();
+                grid.insertAdjacentHTML('beforeend', html);
+                loading = false;
+                watch();
+            })
+            .catch(function () {
+                loading = false;
+                observer.observe(more);
+            });
+    }
+
+    watch();
+})();
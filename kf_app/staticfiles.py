@@ -0,0 +1,189 @@
+"""Раздача статики в production: имена с хэшем содержимого и сжатые копии.
+
+collectstatic с CompressedManifestStaticFilesStorage кладёт в STATIC_ROOT
+файлы с хэшем в имени (style.3f2a1c.css) и рядом - .gz и, если установлен
+модуль brotli, .br для текстовых форматов. {% static %} отдаёт имя с
+хэшем, поэтому браузер кэширует его навсегда (immutable), а новая версия
+файла - это новый адрес.
+
+static_middleware при старте один раз обходит STATIC_ROOT и держит в
+памяти индекс: адрес -> путь, размер, тип, ETag и сжатые варианты. Запрос
+статики не делает stat и не проходит остальные middleware: выбирается
+вариант по Accept-Encoding, ответ получает Vary: Accept-Encoding.
+"""
+import gzip
+import json
+import mimetypes
+import os
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.http import http_date
+
+from .streaming import file_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map', '.ico', '.ttf', '.otf')
+MIN_COMPRESS_SIZE = 256
+# Сжатая копия хранится, только если она заметно меньше оригинала
+MIN_RATIO = 0.95
+# Порядок предпочтения кодировок: (Content-Encoding, расширение файла)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Имена без хэша (ссылки из старых страниц, manifest_strict = False) перепроверяются
+REVALIDATE = 'public, max-age=60'
+
+
+def compress_file(path):
+    """Пишет path.gz и path.br рядом с файлом; возвращает число новых файлов."""
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    compressors = [('.gz', lambda content: gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append(('.br', lambda content: brotli.compress(content, quality=11)))
+    written = 0
+    for suffix, compress in compressors:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        compressed = compress(data)
+        if len(compressed) < len(data) * MIN_RATIO:
+            with open(target, 'wb') as fh:
+                fh.write(compressed)
+            written += 1
+        elif os.path.exists(target):
+            os.remove(target)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Нет файла в манифесте (например, default_poster.jpg) - ссылка без хэша, а не ошибка страницы
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for root, _, files in os.walk(self.location):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if path == self.path(self.manifest_name):
+                    continue
+                if filename.endswith(COMPRESSIBLE) and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+                    compress_file(path)
+
+
+def build_index(root, url_prefix, manifest_name='staticfiles.json'):
+    """Адрес -> метаданные всех файлов STATIC_ROOT; сжатые копии - варианты оригинала."""
+    hashed = set()
+    try:
+        with open(os.path.join(root, manifest_name), encoding='utf-8') as fh:
+            hashed = set(json.load(fh).get('paths', {}).values())
+    except (OSError, ValueError):
+        pass
+    index = {}
+    suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    for directory, _, files in os.walk(root):
+        names = set(files)
+        for filename in files:
+            if filename.endswith(suffixes) or filename == manifest_name:
+                continue
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            variants = {}
+            for encoding, suffix in ENCODINGS:
+                if filename + suffix in names:
+                    variant = path + suffix
+                    variants[encoding] = (variant, os.path.getsize(variant))
+            content_type, _ = mimetypes.guess_type(filename)
+            index[url_prefix + name] = {
+                'path': path,
+                'size': stat.st_size,
+                'content_type': content_type or 'application/octet-stream',
+                'etag': file_etag(stat),
+                'last_modified': http_date(stat.st_mtime),
+                'cache_control': IMMUTABLE if name in hashed else REVALIDATE,
+                'variants': variants,
+            }
+    return index
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с q > 0."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def static_response(request, entry):
+    path, size, encoding = entry['path'], entry['size'], None
+    if entry['variants']:
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        for name, _ in ENCODINGS:
+            if name in entry['variants'] and (name in accepted or '*' in accepted):
+                encoding = name
+                path, size = entry['variants'][name]
+                break
+    # ETag у сжатого варианта свой: это другие байты
+    etag = entry['etag'] if encoding is None else entry['etag'][:-1] + f'-{encoding}"'
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=entry['content_type'])
+        response['Content-Length'] = str(size)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=entry['content_type'])
+        response['Content-Length'] = str(size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if entry['variants']:
+        response['Vary'] = 'Accept-Encoding'
+    response['ETag'] = etag
+    response['Last-Modified'] = entry['last_modified']
+    response['Cache-Control'] = entry['cache_control']
+    return response
+
+
+@sync_and_async_middleware
+def static_middleware(get_response):
+    index = build_index(settings.STATIC_ROOT, settings.STATIC_URL) if os.path.isdir(settings.STATIC_ROOT) else {}
+
+    def lookup(request):
+        if request.method in ('GET', 'HEAD'):
+            return index.get(request.path_info)
+        return None
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            entry = lookup(request)
+            if entry is not None:
+                return static_response(request, entry)
+            return await get_response(request)
+        return middleware
+
+    def middleware(request):
+        entry = lookup(request)
+        if entry is not None:
+            return static_response(request, entry)
+        return get_response(request)
+    return middleware
@@ -0,0 +1,196 @@
+import asyncio
+import mimetypes
+import os
+import re
+
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+# Размер порции чтения: память на одного зрителя не зависит от размера файла
+CHUNK_SIZE = 256 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(stat):
+    return quote_etag(f'{stat.st_size:x}-{int(stat.st_mtime):x}')
+
+
+def parse_range(header, size):
+    """Разбирает заголовок Range и возвращает (start, end) включительно.
+
+    None - заголовок отсутствует или не поддерживается (отдаём файл целиком),
+    False - диапазон не пересекается с файлом (416).
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Несколько диапазонов (multipart/byteranges) не поддерживаем
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-500: последние 500 байт
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def if_range_matches(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Слабые ETag для If-Range не годятся
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(mtime) <= since
+
+
+def range_iterator(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def async_range_iterator(fh, start, length):
+    """Асинхронный range_iterator: чтение файла не блокирует цикл событий.
+
+    Следующая порция читается только после того, как ASGIHandler отдал
+    предыдущую в send(), а сервер ждёт в send(), пока клиент не разгрузит
+    буфер сокета. Медленный зритель держит одну порцию в памяти и не
+    занимает поток: seek и read идут через asyncio.to_thread.
+    """
+    remaining = length
+    await asyncio.to_thread(fh.seek, start)
+    while remaining > 0:
+        chunk = await asyncio.to_thread(fh.read, min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+class AsyncFileResponse(StreamingHttpResponse):
+    """Потоковый ответ из файла, который закрывается в close().
+
+    Файл открывается в потоке (asyncio.to_thread) при отправке тела. При
+    разрыве соединения ASGIHandler отменяет отправку и вызывает close()
+    ответа, но не закрывает async-генератор тела: без этого файл оставался бы
+    открытым до сборки мусора.
+    """
+
+    def __init__(self, path, start, length, **kwargs):
+        self.file = None
+        super().__init__(self.read(path, start, length), **kwargs)
+
+    async def read(self, path, start, length):
+        self.file = await asyncio.to_thread(open, path, 'rb')
+        async for chunk in async_range_iterator(self.file, start, length):
+            yield chunk
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        super().close()
+
+
+def stat_file(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        raise Http404("Файл не найден")
+
+
+def serve_file(request, path, content_type=None, seek=None):
+    """Отдаёт файл с поддержкой Range/If-Range/ETag.
+
+    Полный ответ идёт через FileResponse, поэтому WSGI-сервер может
+    отправить его через wsgi.file_wrapper (os.sendfile в gunicorn/uwsgi).
+    Частичный ответ читается порциями по CHUNK_SIZE.
+
+    seek - смещение, с которого отдать файл (206), если клиент не прислал
+    Range: так отвечает переход по времени (?t=) по таблице ключевых кадров.
+    """
+    return file_response(request, path, stat_file(path), content_type, seek)
+
+
+async def aserve_file(request, path, content_type=None, seek=None):
+    """serve_file для async views под ASGI.
+
+    stat и открытие файла идут через asyncio.to_thread, тело ответа читает
+    async_range_iterator, а файл закрывается вместе с ответом, в том числе
+    при разрыве соединения.
+    """
+    stat = await asyncio.to_thread(stat_file, path)
+    return file_response(request, path, stat, content_type, seek, asynchronous=True)
+
+
+def file_response(request, path, stat, content_type=None, seek=None, asynchronous=False):
+    size = stat.st_size
+    etag = file_etag(stat)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    if request.method in ('GET', 'HEAD') and if_range_matches(request, etag, stat.st_mtime):
+        byte_range = parse_range(request.headers.get('Range'), size)
+    if byte_range is None and seek is not None and 0 <= seek < size and not request.headers.get('Range'):
+        byte_range = (seek, size - 1)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range is None:
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+        elif asynchronous:
+            response = AsyncFileResponse(path, 0, size, content_type=content_type)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type, status=206)
+        elif asynchronous:
+            response = AsyncFileResponse(path, start, length, content_type=content_type, status=206)
+        else:
+            response = StreamingHttpResponse(
+                range_iterator(path, start, length), content_type=content_type, status=206
+            )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
@@ -0,0 +1,36 @@
+from django import template
+
+from kf_app import fragments
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, name, deps, nodelist):
+        self.name = name
+        self.deps = deps
+        self.nodelist = nodelist
+
+    def render(self, context):
+        deps = [(scope, expr.resolve(context)) for scope, expr in self.deps]
+        # Версии читаются один раз на страницу, даже если фрагментов с теми же зависимостями несколько
+        known = context.render_context.setdefault('fragment_versions', {})
+        return fragments.cached(self.name, deps, lambda: self.nodelist.render(context), known)
+
+
+@register.tag
+def fragment(parser, token):
+    """{% fragment "имя" media=media.pk person=... %}...{% endfragment %}"""
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError("fragment: нужны имя и хотя бы одна зависимость")
+    name = bits[1].strip('"\'')
+    deps = []
+    for bit in bits[2:]:
+        scope, sep, expr = bit.partition('=')
+        if not sep:
+            raise template.TemplateSyntaxError(f"fragment: ожидалось scope=значение, получено {bit}")
+        deps.append((scope, parser.compile_filter(expr)))
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(name, deps, nodelist)
@@ -0,0 +1,37 @@
+from django import template
+from django.utils.html import format_html
+
+from kf_app import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(field, alt='', css_class='', sizes='300px'):
+    """<picture> с WebP/JPEG-вариантами нужной ширины вместо исходного файла."""
+    manifest = images.get_manifest(field)
+    if not manifest or not manifest['widths']:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', field.url, alt, css_class)
+
+    widths = manifest['widths']
+    fallback_width = max([width for width in widths if width <= images.FALLBACK_WIDTH] or widths[:1])
+    fallback = images.derivative_name(manifest['digest'], fallback_width, 'jpg')
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        images.srcset(manifest, 'webp'), sizes,
+        images.default_storage.url(fallback), images.srcset(manifest, 'jpg'), sizes, alt, css_class,
+    )
+
+
+@register.filter
+def time_position(seconds):
+    """Секунды в вид 1:02:03 / 2:03."""
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
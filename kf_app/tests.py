@@ -1,3 +1,1478 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import importlib
+import io
+import json
+import os
+import random
+import re
+import struct
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.templatetags.static import static
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    async_views, db, entitlements, facets, favorites, fragments, images, mp4, navigation, perf, progress, ratings,
+    recommendations, search, series_tree, staticfiles, streaming, urls, video,
+)
+from .budgets import VIEW_BUDGETS, targets
+from .catalog_import import FeedError, import_feed
+from .media_storage import media_storage
+from .models import (
+    ContentParticipation, Episode, FacetCount, Favorite, Genre, MediaBlob, MediaContent, Person, Rating, Season,
+    StoredFile, Subscription, User, UserSubscription, VideoIndex, ViewHistory,
+)
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .streaming import parse_range, serve_file
+from .templatetags.kf_media import responsive_image
+
+# Таблицы, которые растут вместе с каталогом и аудиторией: полный проход
+# по любой из них на странице - регрессия
+LARGE_TABLES = {
+    MediaContent._meta.db_table,
+    Season._meta.db_table,
+    Episode._meta.db_table,
+    ContentParticipation._meta.db_table,
+    ViewHistory._meta.db_table,
+    Favorite._meta.db_table,
+    UserSubscription._meta.db_table,
+    Rating._meta.db_table,
+    MediaContent.genres.through._meta.db_table,
+}
+
+# "SCAN kf_app_mediacontent" без индекса; SCAN ... USING INDEX допустим
+TABLE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def catalog():
+    """Небольшой каталог, на котором страницы выполняют все свои запросы."""
+    genre = Genre.objects.create(name='Драма')
+    person = Person.objects.create(first_name='Иван', last_name='Петров')
+    movie = MediaContent.objects.create(
+        title='Фильм', description='Описание', release_date=datetime.date(2020, 5, 1),
+        country='Россия', age_restriction=12, content_type='MOVIE', video_file='media_content_videos/movie.mp4',
+    )
+    series = MediaContent.objects.create(
+        title='Сериал', description='Описание', release_date=datetime.date(2021, 3, 1),
+        country='Россия', age_restriction=16, content_type='SERIES',
+    )
+    for item in (movie, series):
+        item.genres.add(genre)
+        ContentParticipation.objects.create(media_content=item, person=person, role='ACTOR')
+    season = Season.objects.create(media_content=series, season_number=1)
+    episodes = [
+        Episode.objects.create(season=season, episode_number=number, title=f'Эпизод {number}', description='')
+        for number in (1, 2, 3)
+    ]
+    user = User.objects.create(email='viewer@example.com', first_name='Зритель')
+    plan = Subscription.objects.create(tariff_plan='Месяц', description='', price=299, duration=30)
+    today = timezone.localdate()
+    UserSubscription.objects.create(
+        user=user, subscription=plan, start_date=today, end_date=today + datetime.timedelta(days=30),
+        payment_method='CARD',
+    )
+    ViewHistory.objects.create(user=user, media_content=movie, viewed_seconds=120)
+    ViewHistory.objects.create(user=user, episode=episodes[0], viewed_seconds=60)
+    Favorite.objects.create(user=user, media_content=movie)
+    Rating.objects.create(user=user, media_content=movie, score=8)
+    return movie, series, episodes, user
+
+
+class QueryPlanTests(TestCase):
+    """Запросы страниц не должны переходить к полному сканированию больших таблиц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie, cls.series, cls.episodes, cls.user = catalog()
+
+    def setUp(self):
+        cache.clear()
+        session = self.client.session
+        session.update({
+            'is_authenticated': True, 'username': 'viewer',
+            'email': self.user.email, 'user_id': self.user.pk,
+        })
+        session.save()
+
+    def table_scans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        scans = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    match = TABLE_SCAN_RE.match(row[-1])
+                    if match and match.group(1) in LARGE_TABLES:
+                        scans.append(f'{row[-1]}: {sql}')
+        return scans
+
+    def assertNoTableScans(self, url):
+        scans = self.table_scans(url)
+        self.assertFalse(scans, f'{url}:\n' + '\n'.join(scans))
+
+    def test_index(self):
+        self.assertNoTableScans(reverse('kf_app:index'))
+
+    def test_movies_list(self):
+        self.assertNoTableScans(reverse('kf_app:movies_list'))
+        self.assertNoTableScans(reverse('kf_app:movies_list') + '?country=Россия&rating=0')
+
+    def test_movies_page(self):
+        self.assertNoTableScans(reverse('kf_app:movies_page') + f'?after=2030-01-01.{self.movie.pk + 1}')
+
+    def test_series_list(self):
+        self.assertNoTableScans(reverse('kf_app:series_list'))
+        self.assertNoTableScans(reverse('kf_app:series_page') + '?after=2030-01-01.1')
+
+    def test_movie_detail(self):
+        self.assertNoTableScans(reverse('kf_app:movie_detail', args=[self.movie.pk]))
+
+    def test_series_detail(self):
+        self.assertNoTableScans(reverse('kf_app:series_detail', args=[self.series.pk]))
+
+    def test_episode_detail(self):
+        self.assertNoTableScans(reverse('kf_app:episode_detail', args=[self.episodes[1].pk]))
+
+    def test_search(self):
+        self.assertNoTableScans(reverse('kf_app:search') + '?q=фильм')
+
+    def test_profile(self):
+        self.assertNoTableScans(reverse('kf_app:profile'))
+
+    def test_detects_table_scan(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN SELECT * FROM {MediaContent._meta.db_table} WHERE title = %s', ['x'])
+            details = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(any(TABLE_SCAN_RE.match(detail) for detail in details), details)
+
+
+class QueryBudgetTests(TestCase):
+    """Страницы на сгенерированном каталоге укладываются в бюджет запросов kf_app.budgets."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_catalog', titles=60, users=30, views_per_user=20, verbosity=0)
+        cls.user = ViewHistory.objects.order_by('-viewed_at').first().user
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self):
+        session = self.client.session
+        session.update({
+            'is_authenticated': True, 'username': 'viewer',
+            'email': self.user.email, 'user_id': self.user.pk,
+        })
+        session.save()
+
+    def assertWithinBudget(self, names):
+        urls = targets(random.Random(1))
+        for name in names:
+            max_queries = VIEW_BUDGETS[name][0]
+            for _ in range(3):
+                url = urls[name]()
+                with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertLessEqual(len(queries), max_queries, '\n'.join(q['sql'] for q in queries.captured_queries))
+
+    def test_seeded_catalog(self):
+        self.assertEqual(MediaContent.objects.count(), 60)
+        self.assertTrue(Episode.objects.exists())
+        self.assertTrue(Favorite.objects.exists())
+        self.assertTrue(FacetCount.objects.filter(facet='genre', count__gt=0).exists())
+        self.assertEqual(ViewHistory.objects.filter(media_content__isnull=True, episode__isnull=True).count(), 0)
+
+    def test_anonymous(self):
+        self.assertWithinBudget([name for name in VIEW_BUDGETS if name != 'profile'])
+
+    def test_authenticated(self):
+        self.login()
+        self.assertWithinBudget(VIEW_BUDGETS)
+
+
+class PerfMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie, cls.series, cls.episodes, cls.user = catalog()
+
+    def setUp(self):
+        cache.clear()
+        perf.reset()
+
+    @override_settings(PERF_SERVER_TIMING=True)
+    def test_server_timing_and_stats(self):
+        url = reverse('kf_app:movie_detail', args=[self.movie.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        timing = response['Server-Timing']
+        for metric in ('db;', 'tpl;', 'app;', 'total;'):
+            self.assertIn(metric, timing)
+        self.assertIn(f'queries={len(queries)}', timing)
+
+        view = perf.stats()['views']['kf_app:movie_detail']
+        self.assertEqual(view['count'], 1)
+        self.assertEqual(view['queries']['max'], len(queries))
+        self.assertEqual(view['bytes']['max'], len(response.content))
+        self.assertEqual(sum(view['histogram_ms'].values()), 1)
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_server_timing_off(self):
+        response = self.client.get(reverse('kf_app:movie_detail', args=[self.movie.pk]))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(perf.stats()['views']['kf_app:movie_detail']['count'], 1)
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'kf_app.staticfiles.CompressedManifestStaticFilesStorage'},
+        }
+        overrides = override_settings(STATIC_ROOT=root.name, STORAGES=storages)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.middleware = staticfiles.static_middleware(lambda request: None)
+        self.url = static('kf_app/css/style.css')
+        self.factory = RequestFactory()
+
+    def test_hashed_gzip(self):
+        self.assertRegex(self.url, r'^/static/kf_app/css/style\.[0-9a-f]{12}\.css$')
+        response = self.middleware(self.factory.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            open(finders.find('kf_app/css/style.css'), 'rb').read(),
+        )
+        response.close()
+
+        response = self.middleware(self.factory.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                                    HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response.status_code, 304)
+
+    def test_identity_and_passthrough(self):
+        response = self.middleware(self.factory.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(int(response['Content-Length']), os.path.getsize(finders.find('kf_app/css/style.css')))
+        response.close()
+        self.assertNotIn('immutable', self.middleware(self.factory.head('/static/kf_app/css/style.css'))['Cache-Control'])
+        self.assertIsNone(self.middleware(self.factory.get('/static/kf_app/css/missing.css')))
+
+
+FEED = [
+    {
+        'id': 'm1', 'type': 'MOVIE', 'title': 'Матрица', 'description': 'Нео', 'release_date': '1999-03-31',
+        'country': 'США', 'age_restriction': 16, 'duration': 136, 'genres': ['Фантастика', 'Боевик'],
+        'people': [
+            {'first_name': 'Киану', 'last_name': 'Ривз', 'role': 'ACTOR', 'role_name': 'Нео'},
+            {'first_name': 'Лана', 'last_name': 'Вачовски', 'role': 'DIRECTOR'},
+        ],
+    },
+    {
+        'id': 's1', 'type': 'SERIES', 'title': 'Тьма', 'release_date': '2017-12-01', 'country': 'Германия',
+        'age_restriction': 16, 'genres': ['Фантастика'],
+        'people': [{'first_name': 'Киану', 'last_name': 'Ривз', 'role': 'ACTOR'}],
+        'seasons': [{'season_number': 1, 'episodes': [
+            {'episode_number': 1, 'title': 'Секреты'}, {'episode_number': 2, 'title': 'Ложь'},
+        ]}],
+    },
+]
+
+
+def jsonl(feed):
+    return io.StringIO(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in feed))
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_import(self):
+        import_feed(jsonl(FEED), batch_size=1)
+        movie = MediaContent.objects.get(external_id='m1')
+        self.assertEqual(Person.objects.count(), 2)
+        self.assertEqual(sorted(movie.genres.values_list('name', flat=True)), ['Боевик', 'Фантастика'])
+        self.assertEqual(Episode.objects.filter(season__media_content__external_id='s1').count(), 2)
+        self.assertEqual([item.pk for item in search.search('матрица')], [movie.pk])
+        self.assertEqual(FacetCount.objects.filter(content_type='MOVIE', facet='genre', count=1).count(), 2)
+
+    def test_reimport_writes_nothing(self):
+        import_feed(jsonl(FEED))
+        updated_at = MediaContent.objects.get(external_id='m1').updated_at
+        with CaptureQueriesContext(connection) as queries:
+            counts, _ = import_feed(jsonl(FEED))
+        writes = [query['sql'] for query in queries.captured_queries
+                  if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(counts['unchanged'], 2)
+        self.assertEqual(MediaContent.objects.get(external_id='m1').updated_at, updated_at)
+
+    def test_update(self):
+        import_feed(jsonl(FEED))
+        series = MediaContent.objects.get(external_id='s1')
+        series_tree.get_tree(series.pk)
+        feed = json.loads(json.dumps(FEED))
+        feed[0]['genres'] = ['Драма']
+        feed[0]['people'][0]['role_name'] = 'Томас Андерсон'
+        feed[1]['seasons'][0]['episodes'][1]['title'] = 'Правда'
+        import_feed(jsonl(feed))
+        movie = MediaContent.objects.get(external_id='m1')
+        self.assertEqual(list(movie.genres.values_list('name', flat=True)), ['Драма'])
+        self.assertEqual(ContentParticipation.objects.get(media_content=movie, role='ACTOR').role_name, 'Томас Андерсон')
+        self.assertEqual(series_tree.get_tree(series.pk)['seasons'][0]['episodes'][1]['title'], 'Правда')
+        self.assertGreater(MediaContent.objects.get(pk=series.pk).updated_at, series.updated_at)
+
+    def test_csv_episode_rows(self):
+        feed = (
+            'id,type,title,release_date,genres,people,season,episode,episode_title\n'
+            'c1,SERIES,Сериал,2020-01-01,Драма|Комедия,Иван Петров/ACTOR/Герой,1,1,Пилот\n'
+            'c1,,,,,,1,2,Второй\n'
+            'c1,,,,,,2,1,Новый сезон\n'
+        )
+        import_feed(io.StringIO(feed), 'csv')
+        series = MediaContent.objects.get(external_id='c1')
+        self.assertEqual(Season.objects.filter(media_content=series).count(), 2)
+        self.assertEqual(Episode.objects.filter(season__media_content=series).count(), 3)
+        self.assertEqual(ContentParticipation.objects.get(media_content=series).role_name, 'Герой')
+
+    def test_unknown_title(self):
+        with self.assertRaises(FeedError):
+            import_feed(jsonl([{'id': 'x', 'seasons': [{'season_number': 1}]}]))
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.movie = MediaContent.objects.create(
+            title='Фильм', description='', release_date=datetime.date(2020, 1, 1), country='Россия',
+            age_restriction=0, content_type='MOVIE',
+        )
+
+    def write(self, name, content):
+        path = media_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(content)
+
+    def test_identical_uploads_share_blob(self):
+        self.movie.poster.save('a.jpg', ContentFile(b'poster' * 100))
+        other = MediaContent.objects.create(
+            title='Другой', description='', release_date=datetime.date(2020, 1, 1), country='Россия',
+            age_restriction=0, content_type='MOVIE',
+        )
+        other.poster.save('a.jpg', ContentFile(b'poster' * 100))
+        # Своё имя у каждой записи, общий блоб на диске
+        self.assertNotEqual(other.poster.name, self.movie.poster.name)
+        self.assertTrue(os.path.samefile(self.movie.poster.path, other.poster.path))
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+
+        # Удаление файла одной записи не трогает файл другой
+        other.poster.delete()
+        self.assertTrue(os.path.exists(self.movie.poster.path))
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+        self.assertEqual(list(StoredFile.objects.values_list('name', flat=True)), [self.movie.poster.name])
+
+    def test_dedupe_gc_and_adopt(self):
+        self.write('media_content_videos/a.mp4', b'video' * 100)
+        self.write('media_content_videos/b.mp4', b'video' * 100)
+        self.write('media_content_videos/c.mp4', b'other' * 100)
+        call_command('dedupe_media', stdout=io.StringIO())
+        self.assertTrue(os.path.samefile(media_storage.path('media_content_videos/a.mp4'),
+                                         media_storage.path('media_content_videos/b.mp4')))
+        self.assertEqual(sorted(MediaBlob.objects.values_list('refcount', flat=True)), [1, 2])
+
+        # Файл переписан подменой, как это делает faststart
+        self.write('media_content_videos/new.tmp', b'faststart' * 100)
+        os.replace(media_storage.path('media_content_videos/new.tmp'), media_storage.path('media_content_videos/a.mp4'))
+        media_storage.adopt('media_content_videos/a.mp4')
+        self.assertEqual(sorted(MediaBlob.objects.values_list('refcount', flat=True)), [1, 1, 1])
+
+        MediaContent.objects.filter(pk=self.movie.pk).update(video_file='media_content_videos/a.mp4')
+        call_command('gc_media', grace=0, stdout=io.StringIO())
+        self.assertEqual(list(StoredFile.objects.values_list('name', flat=True)), ['media_content_videos/a.mp4'])
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+        self.assertFalse(media_storage.exists('media_content_videos/b.mp4'))
+        blobs = [name for _, _, names in os.walk(media_storage.path('blobs')) for name in names]
+        self.assertEqual(blobs, [MediaBlob.objects.get().digest])
+
+
+class AccountTests(TestCase):
+    PASSWORD = 'kino-parol-2024'
+
+    def register(self, username='viewer', email='viewer@example.com'):
+        return self.client.post(reverse('kf_app:register'), {
+            'username': username, 'email': email, 'password': self.PASSWORD, 'confirm_password': self.PASSWORD,
+        })
+
+    def test_register_login_logout(self):
+        response = self.register()
+        self.assertRedirects(response, reverse('kf_app:index'), fetch_redirect_response=False)
+        profile = User.objects.get(email='viewer@example.com')
+        self.assertEqual(profile.account.username, 'viewer')
+        self.assertEqual(self.client.session['user_id'], profile.pk)
+
+        session_key = self.client.session.session_key
+        self.client.get(reverse('kf_app:logout'))
+        self.assertFalse(Session.objects.filter(session_key=session_key).exists())
+        self.assertFalse(self.client.session.get('is_authenticated'))
+
+        response = self.client.post(reverse('kf_app:login'), {'username': 'viewer', 'password': 'неверный'})
+        self.assertContains(response, 'Неверное имя пользователя или пароль')
+        self.client.post(reverse('kf_app:login'), {'username': 'viewer', 'password': self.PASSWORD})
+        self.assertEqual(self.client.session['user_id'], profile.pk)
+
+    def test_existing_profile_is_not_claimed(self):
+        # Профиль из админки с подписками не достаётся тому, кто первым зарегистрирует его почту
+        profile = User.objects.create(email='owner@example.com', first_name='Владелец')
+        response = self.register(username='intruder', email='owner@example.com')
+        self.assertContains(response, 'обратитесь в поддержку')
+        profile.refresh_from_db()
+        self.assertIsNone(profile.account)
+        self.assertFalse(get_user_model().objects.filter(username='intruder').exists())
+
+    def test_legacy_session_logs_in_again(self):
+        # Сессия без user_id: профиль по непроверенному email не ищется
+        User.objects.create(email='owner@example.com', first_name='Владелец')
+        session = self.client.session
+        session.update({'is_authenticated': True, 'username': 'owner', 'email': 'owner@example.com'})
+        session.save()
+        self.client.get(reverse('kf_app:movies_list'))
+        self.assertFalse(self.client.session.get('is_authenticated'))
+        self.assertIsNone(self.client.session.get('email'))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.movie = MediaContent.objects.create(
+            title='Ёлки', description='Новогодняя КОМЕДИЯ', release_date=datetime.date(2010, 12, 16),
+            country='Россия', age_restriction=6, content_type='MOVIE',
+        )
+
+    def test_yo_and_case(self):
+        search.index_documents([self.movie.pk])
+        for query in ('елки', 'ЁЛКИ', 'Ёлки', 'комедия новогодние'):
+            self.assertEqual([item.pk for item in search.search(query)], [self.movie.pk], query)
+
+    def test_migration_folds_existing_rows(self):
+        # Строка в том виде, в каком её оставлял старый бэкфилл 0008
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {search.TABLE} (rowid, title, description, genres, people) VALUES (%s, %s, %s, %s, %s)',
+                [self.movie.pk, 'Ёлки', '', '', ''],
+            )
+            self.assertEqual(search.search('елки'), [])
+            cursor.execute(importlib.import_module('kf_app.migrations.0019_search_fold_yo').Migration.operations[0].sql)
+        self.assertEqual(search.search('елки'), [self.movie])
+
+
+class EntitlementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.plan = Subscription.objects.create(tariff_plan='Месяц', description='', price=299, duration=30)
+
+    def subscribe(self, email, end_date, auto_renewal):
+        user = User.objects.create(email=email, first_name='Зритель')
+        UserSubscription.objects.create(
+            user=user, subscription=self.plan, start_date=end_date - datetime.timedelta(days=29),
+            end_date=end_date, auto_renewal=auto_renewal, payment_method='CARD',
+        )
+        return user
+
+    def test_expire_due(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        renewing = self.subscribe('renew@example.com', yesterday, True)
+        lapsing = self.subscribe('lapse@example.com', yesterday, False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(entitlements.expire_due(), (1, 1))
+        renewed = UserSubscription.objects.get(user=renewing)
+        self.assertEqual((renewed.status, renewed.end_date), ('ACTIVE', yesterday + datetime.timedelta(days=30)))
+        self.assertEqual(UserSubscription.objects.get(user=lapsing).status, 'EXPIRED')
+        self.assertTrue(entitlements.has_access(renewing.pk))
+        self.assertFalse(entitlements.has_access(lapsing.pk))
+
+    def test_cache_lives_until_answer_changes(self):
+        now = timezone.now()
+        midnight = timezone.make_aware(
+            datetime.datetime.combine(timezone.localdate(now) + datetime.timedelta(days=1), datetime.time.min)
+        )
+        # Подписка кончается сегодня: ключ не переживёт полночь, даже если его не сбросят
+        self.assertEqual(
+            entitlements.timeout(((self.today - datetime.timedelta(days=10), self.today),), now),
+            min(entitlements.CACHE_TIMEOUT, int((midnight - now).total_seconds())),
+        )
+        self.assertEqual(entitlements.timeout((), now), entitlements.EMPTY_TIMEOUT)
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = MediaContent.objects.create(
+            title='Фильм', description='', release_date=datetime.date(2020, 1, 1), country='Россия',
+            age_restriction=0, content_type='MOVIE', rating_prior=8.7,
+        )
+        self.users = [User.objects.create(email=f'u{number}@example.com', first_name='Зритель') for number in (1, 2)]
+
+    def rating(self):
+        return MediaContent.objects.values_list('rating', 'rating_sum', 'rating_count').get(pk=self.movie.pk)
+
+    def test_vote_revote_retract(self):
+        self.assertEqual(self.rating(), (8.7, 0, 0))
+        # Один голос не обнуляет оценку редакции: (10 * 8.7 + 5) / 11
+        ratings.cast_vote(self.users[0].pk, self.movie.pk, 5)
+        self.assertEqual(self.rating(), (8.4, 5, 1))
+        ratings.cast_vote(self.users[0].pk, self.movie.pk, 9)
+        self.assertEqual(self.rating(), (8.7, 9, 1))
+        ratings.cast_vote(self.users[1].pk, self.movie.pk, 10)
+        self.assertEqual(self.rating(), (8.8, 19, 2))
+        ratings.retract_vote(self.users[0].pk, self.movie.pk)
+        self.assertEqual(self.rating(), (8.8, 10, 1))
+        self.assertEqual(ratings.find_drift(), [])
+
+    def test_stale_save_keeps_vote_aggregates(self):
+        stale = MediaContent.objects.get(pk=self.movie.pk)
+        ratings.cast_vote(self.users[0].pk, self.movie.pk, 5)
+        ratings.cast_vote(self.users[1].pk, self.movie.pk, 9)
+        # Правка в админке по объекту, загруженному до голосов
+        stale.title = 'Новое название'
+        stale.save()
+        self.assertEqual(self.rating(), (ratings.bayesian(14, 2, 8.7), 14, 2))
+        ratings.retract_vote(self.users[0].pk, self.movie.pk)
+        ratings.cast_vote(self.users[1].pk, self.movie.pk, 1)
+        self.assertEqual(self.rating(), (ratings.bayesian(1, 1, 8.7), 1, 1))
+        self.assertEqual(ratings.find_drift(), [])
+
+    def test_editor_changes_prior(self):
+        ratings.cast_vote(self.users[0].pk, self.movie.pk, 5)
+        movie = MediaContent.objects.get(pk=self.movie.pk)
+        movie.rating_prior = 6.0
+        movie.save()
+        self.assertEqual(self.rating(), (ratings.bayesian(5, 1, 6.0), 5, 1))
+
+
+def box(kind, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def full_box(kind, payload, version=0, flags=0):
+    return box(kind, bytes([version]) + flags.to_bytes(3, 'big') + payload)
+
+
+def video_trak(stbl=b''):
+    return box(b'trak', full_box(b'tkhd', struct.pack('>III', 0, 0, 1) + bytes(72)) + box(b'mdia', (
+        full_box(b'mdhd', struct.pack('>IIII', 0, 0, 1000, 0) + bytes(4))
+        + full_box(b'hdlr', bytes(4) + b'vide' + bytes(12) + b'\0')
+        + box(b'minf', box(b'stbl', stbl))
+    )))
+
+
+def plain_mp4(samples, moov_first=False):
+    """Три сэмпла в одном чанке; moov по умолчанию в конце файла."""
+    ftyp = box(b'ftyp', b'isom' + bytes(4) + b'isom')
+    mdat = box(b'mdat', b''.join(samples))
+
+    def moov(chunk_offset):
+        stbl = (
+            full_box(b'stts', struct.pack('>III', 1, len(samples), 1000))
+            + full_box(b'stsc', struct.pack('>IIII', 1, 1, len(samples), 1))
+            + full_box(b'stsz', struct.pack('>II', 0, len(samples)) + b''.join(struct.pack('>I', len(s)) for s in samples))
+            + full_box(b'stco', struct.pack('>II', 1, chunk_offset))
+        )
+        return box(b'moov', full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 1000 * len(samples)) + bytes(80)) + video_trak(stbl))
+
+    if moov_first:
+        size = len(moov(0))
+        return ftyp + moov(len(ftyp) + size + 8) + mdat
+    return ftyp + mdat + moov(len(ftyp) + 8)
+
+
+def fragmented_mp4(fragments):
+    """Фрагментированный MP4: пустой mvhd, длительность сэмплов из trex."""
+    moov = box(b'moov', (
+        full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 0) + bytes(80))
+        + video_trak()
+        + box(b'mvex', full_box(b'trex', struct.pack('>IIIII', 1, 1, 500, 0, 0)))
+    ))
+    data = box(b'ftyp', b'iso6' + bytes(4) + b'iso6') + moov
+    start = 0
+    for count in fragments:
+        data += box(b'moof', full_box(b'mfhd', struct.pack('>I', 1)) + box(b'traf', (
+            full_box(b'tfhd', struct.pack('>I', 1))
+            + full_box(b'tfdt', struct.pack('>Q', start), version=1)
+            + full_box(b'trun', struct.pack('>I', count))
+        )))
+        data += box(b'mdat', bytes(10 * count))
+        start += 500 * count
+    return data
+
+
+class Mp4Tests(TestCase):
+    def write(self, data):
+        handle, path = tempfile.mkstemp(suffix='.mp4')
+        with os.fdopen(handle, 'wb') as fh:
+            fh.write(data)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def test_faststart_plain(self):
+        samples = [bytes([number]) * 100 for number in (1, 2, 3)]
+        path = self.write(plain_mp4(samples))
+        info = mp4.probe(path)
+        self.assertEqual((info['duration'], info['faststart'], info['fragmented']), (3.0, False, False))
+
+        self.assertTrue(mp4.faststart(path))
+        info = mp4.probe(path)
+        self.assertTrue(info['faststart'])
+        self.assertEqual(info['duration'], 3.0)
+        # Смещение чанка в stco сдвинуто вместе с mdat
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        self.assertEqual(data, plain_mp4(samples, moov_first=True))
+        self.assertFalse(mp4.faststart(path))
+
+    def test_fragmented(self):
+        path = self.write(fragmented_mp4([2, 3]))
+        info = mp4.probe(path)
+        self.assertEqual((info['duration'], info['faststart'], info['fragmented']), (2.5, True, True))
+        # У фрагментированного файла moov и так в начале - файл не трогаем
+        self.assertFalse(mp4.faststart(path))
+
+    def test_keyframes(self):
+        samples = [bytes([number]) * 100 for number in (1, 2, 3)]
+        data = plain_mp4(samples, moov_first=True)
+        offsets = [data.index(sample) for sample in samples]
+        keyframes = mp4.probe(self.write(data))['keyframes']
+        # Без stss каждый сэмпл - ключевой
+        self.assertEqual(keyframes, [(0.0, offsets[0]), (1.0, offsets[1]), (2.0, offsets[2])])
+        self.assertEqual(mp4.keyframe_at(keyframes, 1.5), (1.0, offsets[1]))
+        self.assertEqual(mp4.keyframe_at(keyframes, 99), (2.0, offsets[2]))
+        self.assertIsNone(mp4.keyframe_at([], 1))
+
+        data = fragmented_mp4([2, 3])
+        moofs = [match.start() - 4 for match in re.finditer(b'moof', data)]
+        # У фрагментированного файла точка перехода - начало moof
+        self.assertEqual(mp4.probe(self.write(data))['keyframes'], [(0.0, moofs[0]), (1.0, moofs[1])])
+
+    def test_not_mp4(self):
+        with self.assertRaises(mp4.Mp4Error):
+            mp4.probe(self.write(box(b'ftyp', b'isom') + box(b'free', bytes(16))))
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.movie = MediaContent.objects.create(
+            title='Фильм', description='', release_date=datetime.date(2020, 1, 1), country='Россия',
+            age_restriction=0, content_type='MOVIE',
+        )
+
+    def upload(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 960), color).save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movie.poster.save('poster.jpg', ContentFile(buffer.getvalue()))
+
+    def test_built_on_upload_only(self):
+        # Без производных шаблон отдаёт исходник и ничего не строит
+        self.movie.poster.save('poster.jpg', ContentFile(b'not an image'), save=False)
+        self.assertIn(f'src="{self.movie.poster.url}"', responsive_image(self.movie.poster))
+
+        self.upload('red')
+        movie = MediaContent.objects.get(pk=self.movie.pk)
+        manifest = movie.derivatives['poster']
+        self.assertEqual((manifest['name'], manifest['widths']), (movie.poster.name, [150, 300, 600]))
+        self.assertIn('<picture>', responsive_image(movie.poster))
+
+        # Сохранение без смены файла производные не перестраивает
+        movie.title = 'Новое название'
+        movie.save()
+        self.assertEqual(images.stale_fields(movie), [])
+
+        self.upload('blue')
+        self.assertNotEqual(MediaContent.objects.get(pk=self.movie.pk).derivatives['poster']['digest'], manifest['digest'])
+
+    def test_build_invalidates_pages(self):
+        home = fragments.get_versions([('home', 0)])[0]
+        self.upload('red')
+        self.assertGreater(fragments.get_versions([('home', 0)])[0], home)
+
+        person = Person.objects.create(first_name='Иван', last_name='Петров')
+        ContentParticipation.objects.create(media_content=self.movie, person=person, role='ACTOR')
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 400), 'green').save(buffer, 'JPEG')
+        person.photo.save('photo.jpg', ContentFile(buffer.getvalue()), save=False)
+        Person.objects.filter(pk=person.pk).update(photo=person.photo.name)
+        updated_at = MediaContent.objects.get(pk=self.movie.pk).updated_at
+        media = fragments.get_versions([('media', self.movie.pk)])[0]
+        # Построение командой build_image_derivatives: сигналы сохранения не срабатывают
+        self.assertEqual(images.update(Person.objects.get(pk=person.pk)), 1)
+        # Новый srcset фото в блоке «В ролях»: тайтл считается изменённым
+        self.assertGreater(MediaContent.objects.get(pk=self.movie.pk).updated_at, updated_at)
+        self.assertGreater(fragments.get_versions([('media', self.movie.pk)])[0], media)
+
+
+class FragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+
+    def versions(self, *deps):
+        return fragments.get_versions(deps)
+
+    def test_versions_shared_through_database(self):
+        before = self.versions(('media', self.movie.pk), ('home', 0))
+        # Другой воркер со своим (пустым) кэшем видит те же версии
+        cache.clear()
+        self.assertEqual(self.versions(('media', self.movie.pk), ('home', 0)), before)
+        Person.objects.get().save()
+        after = self.versions(('media', self.movie.pk), ('home', 0))
+        self.assertGreater(after[0], before[0])
+        self.assertEqual(after[1], before[1])
+
+    def test_cast_follows_person_edit(self):
+        url = reverse('kf_app:movie_detail', args=[self.movie.pk])
+        self.assertContains(self.client.get(url), 'Иван Петров')
+        person = Person.objects.get()
+        person.last_name = 'Сидоров'
+        person.save()
+        self.assertContains(self.client.get(url), 'Иван Сидоров')
+
+    def test_vote_keeps_home_fragments(self):
+        home, series = self.versions(('home', 0), ('media', self.series.pk))
+        ratings.cast_vote(self.user.pk, self.series.pk, 9)
+        self.assertEqual(self.versions(('home', 0))[0], home)
+        self.assertGreater(self.versions(('media', self.series.pk))[0], series)
+
+    def test_bump_rolls_back_with_transaction(self):
+        before = self.versions(('season', 1))
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            fragments.bump('season', 1)
+            raise RuntimeError
+        self.assertEqual(self.versions(('season', 1)), before)
+
+
+class ApiConditionalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+
+    def assertRevalidates(self, url, edit):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        edit()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_media_after_edit(self):
+        def edit():
+            self.movie.title = 'Новое название'
+            self.movie.save()
+        self.assertRevalidates(reverse('kf_app:api_media', args=[self.movie.pk]), edit)
+
+    def test_catalog_after_delete(self):
+        extra = MediaContent.objects.create(
+            title='Ещё фильм', description='', release_date=datetime.date(2019, 1, 1), country='Россия',
+            age_restriction=0, content_type='MOVIE',
+        )
+        # Удаление не меняет MAX(updated_at), если удалён не самый свежий тайтл
+        MediaContent.objects.filter(pk=extra.pk).update(updated_at=self.movie.updated_at - datetime.timedelta(days=1))
+        self.assertRevalidates(reverse('kf_app:api_catalog') + '?type=MOVIE', extra.delete)
+
+    def test_catalog_state_without_count(self):
+        url = reverse('kf_app:api_catalog')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'type': 'MOVIE'})
+            b''.join(response.streaming_content)
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+        # ETag зависит от фильтров и курсора
+        filtered = self.client.get(url, {'type': 'MOVIE', 'country': 'Россия'})
+        self.assertNotEqual(filtered['ETag'], response['ETag'])
+        oversized = self.client.get(url, {'type': 'MOVIE', 'after': '2020-01-01.' + '9' * 30})
+        self.assertEqual(oversized.status_code, 200)
+        self.assertEqual(json.loads(b''.join(oversized.streaming_content))['results'][0]['id'], self.movie.pk)
+
+    def test_episode_after_neighbour_edit(self):
+        def edit():
+            self.episodes[2].title = 'Финал'
+            self.episodes[2].save()
+        self.assertRevalidates(reverse('kf_app:api_episode', args=[self.episodes[1].pk]), edit)
+
+    def test_person_after_filmography_change(self):
+        person = Person.objects.get()
+        self.assertRevalidates(
+            reverse('kf_app:api_person', args=[person.pk]),
+            lambda: ContentParticipation.objects.filter(media_content=self.series).delete(),
+        )
+
+
+class PageConditionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+        self.genre = Genre.objects.get()
+
+    def assertRevalidates(self, url, edit):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        edit()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_series_after_episode_edit(self):
+        def edit():
+            self.episodes[0].title = 'Пилот'
+            self.episodes[0].save()
+        self.assertRevalidates(reverse('kf_app:series_detail', args=[self.series.pk]), edit)
+
+    def test_episode_after_person_edit(self):
+        def edit():
+            person = Person.objects.get()
+            person.last_name = 'Сидоров'
+            person.save()
+        self.assertRevalidates(reverse('kf_app:episode_detail', args=[self.episodes[1].pk]), edit)
+
+    def test_movie_after_genre_clear(self):
+        version = fragments.get_versions([('media', self.movie.pk)])[0]
+        self.assertRevalidates(reverse('kf_app:movie_detail', args=[self.movie.pk]), self.genre.mediacontent_set.clear)
+        self.assertGreater(fragments.get_versions([('media', self.movie.pk)])[0], version)
+
+    def test_list_after_genre_rename(self):
+        def edit():
+            self.genre.name = 'Мелодрама'
+            self.genre.save()
+        self.assertRevalidates(reverse('kf_app:movies_list'), edit)
+
+
+class EpisodeNavigationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+        season = Season.objects.create(media_content=self.series, season_number=2)
+        self.premiere = Episode.objects.create(season=season, episode_number=1, title='Премьера', description='')
+
+    def episode(self, pk):
+        return Episode.objects.get(pk=pk)
+
+    def test_crosses_season_boundary(self):
+        finale = self.episode(self.episodes[2].pk)
+        self.assertEqual(finale.get_next_episode(), self.premiere)
+        self.assertIsInstance(finale.get_next_episode(), Episode)
+        self.assertEqual(self.episode(self.premiere.pk).get_previous_episode(), finale)
+        self.assertIsNone(self.episode(self.episodes[0].pk).get_previous_episode())
+        self.assertIsNone(self.episode(self.premiere.pk).get_next_episode())
+
+    def test_follows_renumbering(self):
+        first, second, third = (self.episode(episode.pk) for episode in self.episodes)
+        self.assertEqual(second.get_previous_episode(), first)
+        # Первый эпизод становится четвёртым: карта соседей пересчитывается
+        first.episode_number = 4
+        first.save()
+        self.assertIsNone(self.episode(second.pk).get_previous_episode())
+        self.assertEqual(self.episode(third.pk).get_next_episode(), first)
+        self.assertEqual(self.episode(first.pk).get_next_episode(), self.premiere)
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        handle = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        self.addCleanup(os.unlink, handle.name)
+        self.data = bytes(range(100))
+        with handle:
+            handle.write(self.data)
+        self.path = handle.name
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        response = serve_file(self.factory.get('/video', headers=headers), self.path)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_head_range(self):
+        # HEAD отвечает теми же заголовками, что и GET с тем же Range, но без тела
+        response = serve_file(self.factory.head('/video', headers={'Range': 'bytes=10-19'}), self.path)
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 10-19/100'))
+        self.assertEqual((response['Content-Length'], response.content), ('10', b''))
+        response = serve_file(self.factory.head('/video', headers={'Range': 'bytes=200-'}), self.path)
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */100'))
+        response = serve_file(self.factory.head('/video'), self.path)
+        self.assertEqual((response.status_code, response['Content-Length']), (200, '100'))
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=10-1000', 100), (10, 99))
+        self.assertIs(parse_range('bytes=100-', 100), False)
+        self.assertIs(parse_range('bytes=-0', 100), False)
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+
+    def test_suffix_and_open_ended(self):
+        response, body = self.get(Range='bytes=-10')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 90-99/100'))
+        self.assertEqual(body, self.data[90:])
+        response, body = self.get(Range='bytes=95-')
+        self.assertEqual((response.status_code, response['Content-Length']), (206, '5'))
+        self.assertEqual(body, self.data[95:])
+
+    def test_unsatisfiable(self):
+        response, _ = self.get(Range='bytes=200-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */100'))
+
+    def test_multiple_ranges_get_whole_file(self):
+        response, body = self.get(Range='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(Range='bytes=0-9', If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[:10])
+        # Файл сменился с тех пор, как клиент получил начало: отдаём целиком
+        response, body = self.get(Range='bytes=0-9', If_Range='"0-0"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_not_modified(self):
+        etag = self.get()[0]['ETag']
+        self.assertEqual(self.get(If_None_Match=etag)[0].status_code, 304)
+
+
+class ProgressTests(TestCase):
+    def setUp(self):
+        self.movie, self.series, self.episodes, self.user = catalog()
+        ViewHistory.objects.all().delete()
+
+    def buffer(self, size=10):
+        buffer = progress.ProgressBuffer(size=size, interval=3600)
+        self.addCleanup(lambda: buffer._timer and buffer._timer.cancel())
+        return buffer
+
+    def positions(self):
+        return set(ViewHistory.objects.values_list('media_content_id', 'episode_id', 'viewed_seconds'))
+
+    def test_coalesces_heartbeats(self):
+        buffer = self.buffer()
+        for seconds in (10, 20, 30):
+            buffer.add(self.user.pk, seconds, media_content_id=self.movie.pk)
+        buffer.add(self.user.pk, 5, episode_id=self.episodes[0].pk)
+        self.assertEqual((len(buffer), ViewHistory.objects.count()), (2, 0))
+        self.assertEqual(buffer.get(self.user.pk, media_content_id=self.movie.pk), 30)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.positions(), {(None, self.episodes[0].pk, 5), (self.movie.pk, None, 30)})
+        buffer.add(self.user.pk, 40, media_content_id=self.movie.pk)
+        buffer.flush()
+        self.assertEqual(ViewHistory.objects.get(media_content=self.movie).viewed_seconds, 40)
+
+    def test_flushes_when_full(self):
+        buffer = self.buffer(size=2)
+        buffer.add(self.user.pk, 10, media_content_id=self.movie.pk)
+        self.assertEqual(ViewHistory.objects.count(), 0)
+        buffer.add(self.user.pk, 20, episode_id=self.episodes[1].pk)
+        self.assertEqual((len(buffer), ViewHistory.objects.count()), (0, 2))
+
+    def test_timer_scheduled_for_idle_buffer(self):
+        buffer = self.buffer()
+        buffer.add(self.user.pk, 10, media_content_id=self.movie.pk)
+        timer = buffer._timer
+        self.assertTrue(timer.is_alive())
+        self.assertEqual(timer.interval, 3600)
+        buffer.add(self.user.pk, 20, media_content_id=self.movie.pk)
+        self.assertIs(buffer._timer, timer)
+
+    def test_bad_row_does_not_block_batch(self):
+        buffer = self.buffer()
+        buffer.add(self.user.pk, 10 ** 25, media_content_id=self.movie.pk)
+        buffer.add(self.user.pk, 30, episode_id=self.episodes[0].pk)
+        with self.assertLogs('kf_app.progress', 'ERROR'):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.positions(), {(None, self.episodes[0].pk, 30)})
+        buffer.add(self.user.pk, 40, media_content_id=self.movie.pk)
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_report_rejects_out_of_range(self):
+        session = self.client.session
+        session.update({'is_authenticated': True, 'username': 'viewer', 'email': self.user.email, 'user_id': self.user.pk})
+        session.save()
+        url = reverse('kf_app:report_progress')
+        for data in (
+            {'media_content': self.movie.pk, 'position': 'inf'},
+            {'media_content': self.movie.pk, 'position': 'nan'},
+            {'media_content': self.movie.pk, 'position': '1e25'},
+            {'media_content': self.movie.pk, 'position': '-5'},
+            {'media_content': '9' * 30, 'position': '10'},
+            {'media_content': self.movie.pk, 'episode': self.episodes[0].pk, 'position': '10'},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(url, data).status_code, 400)
+        self.assertEqual(len(progress.buffer), 0)
+        self.addCleanup(lambda: progress.buffer._timer and progress.buffer._timer.cancel())
+        self.assertEqual(self.client.post(url, {'episode': self.episodes[0].pk, 'position': '12.7'}).status_code, 204)
+        self.assertEqual(progress.buffer.get(self.user.pk, episode_id=self.episodes[0].pk), 12)
+        progress.buffer.flush()
+
+    def test_continue_watching_flushes_user(self):
+        self.addCleanup(lambda: progress.buffer._timer and progress.buffer._timer.cancel())
+        progress.record(self.user.pk, 42, media_content_id=self.movie.pk)
+        self.assertTrue(progress.buffer.has_pending(self.user.pk))
+        watching = progress.continue_watching(self.user.pk)
+        self.assertEqual([(item.media_content_id, item.viewed_seconds) for item in watching], [(self.movie.pk, 42)])
+        self.assertFalse(progress.buffer.has_pending(self.user.pk))
+
+
+class FavoriteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+        session = self.client.session
+        session.update({'is_authenticated': True, 'username': 'viewer', 'email': self.user.email, 'user_id': self.user.pk})
+        session.save()
+
+    def toggle(self, media):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('kf_app:favorite', args=[media.pk, 'toggle']), HTTP_ACCEPT='application/json',
+            )
+        return response.json()['favorite']
+
+    def test_toggle_invalidates_cached_set(self):
+        self.assertEqual(favorites.favorite_ids(self.user.pk), {self.movie.pk})
+        self.assertTrue(self.toggle(self.series))
+        self.assertEqual(favorites.favorite_ids(self.user.pk), {self.movie.pk, self.series.pk})
+        self.assertFalse(self.toggle(self.movie))
+        self.assertEqual(favorites.favorite_ids(self.user.pk), {self.series.pk})
+        # Прочитанное множество снова берётся из кеша, без запросов
+        with self.assertNumQueries(0):
+            favorites.favorite_ids(self.user.pk)
+
+    def test_cascade_delete_invalidates(self):
+        favorites.favorite_ids(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movie.delete()
+        self.assertEqual(favorites.favorite_ids(self.user.pk), frozenset())
+
+    def test_cached_set_expires(self):
+        # Удаление ключа не доходит до кэшей других воркеров: множество живёт ограниченное время
+        with mock.patch.object(favorites.cache, 'set') as cache_set:
+            favorites.favorite_ids(self.user.pk)
+        cache_set.assert_called_once_with(favorites.cache_key(self.user.pk), {self.movie.pk}, favorites.CACHE_TIMEOUT)
+        self.assertIsNotNone(favorites.CACHE_TIMEOUT)
+
+
+class SqlitePragmaTests(TestCase):
+    def test_production_pragmas_on_new_connection(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = dict(
+            connection.settings_dict, NAME=os.path.join(directory.name, 'bench.sqlite3'),
+            PRAGMAS=settings.SQLITE_PRODUCTION_PRAGMAS,
+        )
+        # Новое соединение: PRAGMA ставит обработчик connection_created
+        other = type(connections['default'])(settings_dict, alias='pragmas')
+        self.addCleanup(other.close)
+        self.assertEqual(db.current_pragmas(other), {
+            'journal_mode': 'wal', 'synchronous': 1, 'mmap_size': 256 * 1024 * 1024, 'busy_timeout': 5000,
+        })
+
+
+class AsyncUrls:
+    """Маршруты kf_app с async views независимо от KF_ASYNC_VIEWS."""
+    urlpatterns = [path('', include(([
+        URLPattern(pattern.pattern, getattr(async_views, pattern.callback.__name__, pattern.callback),
+                   pattern.default_args, pattern.name)
+        for pattern in urls.urlpatterns
+    ], 'kf_app')))]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.movie, self.series, self.episodes, self.user = catalog()
+        self.data = bytes(range(256)) * 4
+        os.makedirs(os.path.dirname(self.movie.video_file.path))
+        with open(self.movie.video_file.path, 'wb') as fh:
+            fh.write(self.data)
+        session = self.client.session
+        session.update({'is_authenticated': True, 'username': 'viewer', 'email': self.user.email, 'user_id': self.user.pk})
+        session.save()
+        self.session_key = session.session_key
+
+    async def test_range_request(self):
+        url = reverse('kf_app:movie_stream', args=[self.movie.pk])
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = self.session_key
+        response = await self.async_client.get(url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 100-199/1024'))
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.data[100:200])
+
+    async def test_not_modified(self):
+        url = reverse('kf_app:movie_detail', args=[self.movie.pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_cast_skips_query(self):
+        url = reverse('kf_app:movie_detail', args=[self.movie.pk])
+        self.assertContains(self.client.get(url), 'Иван Петров')
+        # Фрагмент «В ролях» из кэша: участники не запрашиваются
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(url), 'Иван Петров')
+        self.assertFalse([query for query in queries.captured_queries if 'contentparticipation' in query['sql']])
+
+    async def test_client_disconnect_closes_file(self):
+        url = reverse('kf_app:movie_stream', args=[self.movie.pk])
+        handles = []
+
+        def tracking_open(*args, **kwargs):
+            handles.append(open(*args, **kwargs))
+            return handles[-1]
+
+        disconnected = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if not sent:
+                sent.append(b'')
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                sent.append(message['body'])
+                # Клиент принял первую порцию и ушёл, не дочитав ответ
+                disconnected.set()
+                await asyncio.Event().wait()
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url, 'raw_path': url.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', f'{settings.SESSION_COOKIE_NAME}={self.session_key}'.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        with mock.patch.object(streaming, 'CHUNK_SIZE', 64), \
+                mock.patch.object(streaming, 'open', tracking_open, create=True):
+            await asyncio.wait_for(ASGIHandler()(scope, receive, send), timeout=5)
+        self.assertEqual(b''.join(sent), self.data[:64])
+        self.assertEqual(len(handles), 1)
+        self.assertTrue(handles[0].closed)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+        self.genre = Genre.objects.get()
+        self.other = Genre.objects.create(name='Комедия')
+
+    def assertCountsMatch(self):
+        stored = {
+            (row.content_type, row.facet, row.value): row.count
+            for row in FacetCount.objects.exclude(count=0)
+        }
+        self.assertEqual(stored, {key: total for key, total in facets.compute_counts().items() if total})
+
+    def test_incremental_counts(self):
+        self.assertCountsMatch()
+        self.movie.country = 'Франция'
+        self.movie.content_type = 'SERIES'
+        self.movie.save()
+        self.assertCountsMatch()
+        self.movie.genres.add(self.other)
+        self.assertCountsMatch()
+        self.other.mediacontent_set.add(self.series)
+        self.assertCountsMatch()
+        self.movie.genres.remove(self.genre)
+        self.assertCountsMatch()
+        self.other.mediacontent_set.clear()
+        self.assertCountsMatch()
+        self.series.genres.clear()
+        self.assertCountsMatch()
+        self.other.delete()
+        self.assertCountsMatch()
+
+    def test_delete_stale_instance(self):
+        stale = MediaContent.objects.get(pk=self.movie.pk)
+        # Голоса меняют рейтинг через update(): экземпляр в памяти об этом не знает
+        for number in range(30):
+            voter = User.objects.create(email=f'v{number}@example.com', first_name='Зритель')
+            ratings.cast_vote(voter.pk, self.movie.pk, 10)
+        self.assertNotEqual(
+            facets.rating_band(stale.rating),
+            facets.rating_band(MediaContent.objects.get(pk=self.movie.pk).rating),
+        )
+        stale.delete()
+        self.assertCountsMatch()
+
+    def test_out_of_range_filters_ignored(self):
+        for query in ('year=0', 'year=99999', 'genre=999999999999999999999', 'age=99999999999999', 'genre=٣'):
+            for name in ('kf_app:movies_list', 'kf_app:api_catalog'):
+                with self.subTest(query=query, view=name):
+                    response = self.client.get(reverse(name) + '?' + query)
+                    self.assertEqual(response.status_code, 200)
+        queryset = facets.apply_filters(MediaContent.objects.all(), {'year': '2020', 'genre': str(self.genre.pk)})
+        self.assertEqual(list(queryset), [self.movie])
+
+
+class VideoProcessingTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.movie, self.series, self.episodes, self.user = catalog()
+        self.samples = [bytes([number]) * 100 for number in (1, 2, 3)]
+        os.makedirs(os.path.dirname(self.movie.video_file.path))
+        with open(self.movie.video_file.path, 'wb') as fh:
+            fh.write(plain_mp4(self.samples))
+        session = self.client.session
+        session.update({'is_authenticated': True, 'username': 'viewer', 'email': self.user.email, 'user_id': self.user.pk})
+        session.save()
+
+    def save(self):
+        with mock.patch.object(video.executor, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.movie.save()
+        return submit
+
+    def stream(self, **kwargs):
+        response = self.client.get(reverse('kf_app:movie_stream', args=[self.movie.pk]), **kwargs)
+        response.close()
+        return response
+
+    def test_processed_in_background_after_save(self):
+        self.save().assert_called_once_with(video.process_in_worker, MediaContent, self.movie.pk)
+        video.process_video(self.movie)
+
+        index = VideoIndex.objects.get(media_content=self.movie)
+        self.assertTrue(index.faststart)
+        offset = plain_mp4(self.samples, moov_first=True).index(self.samples[1])
+        self.assertEqual(index.keyframe_at(1.5), (1.0, offset))
+        # Обработанный файл при обычном сохранении записи в очередь не попадает
+        self.save().assert_not_called()
+
+    def test_time_seek(self):
+        video.process_video(self.movie)
+        data = plain_mp4(self.samples, moov_first=True)
+        offset = data.index(self.samples[2])
+        response = self.stream(data={'t': '2.5'})
+        self.assertEqual((response.status_code, response['Content-Range']), (206, f'bytes {offset}-{len(data) - 1}/{len(data)}'))
+        # Range клиента важнее, неразобранное время - файл целиком
+        response = self.stream(data={'t': '2.5'}, headers={'Range': 'bytes=0-9'})
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{len(data)}')
+        self.assertEqual(self.stream(data={'t': 'nan'}).status_code, 200)
+
+        # Файл заменён, индекс ещё не обновлён: таблицей не пользуемся
+        with open(self.movie.video_file.path, 'ab') as fh:
+            fh.write(bytes(10))
+        self.assertEqual(self.stream(data={'t': '2.5'}).status_code, 200)
+
+
+class SeriesTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie, self.series, self.episodes, self.user = catalog()
+
+    def titles(self):
+        return [
+            (season['season_number'], [episode['title'] for episode in season['episodes']])
+            for season in series_tree.get_tree(self.series.pk)['seasons']
+        ]
+
+    def test_tree_is_cached_with_timeout(self):
+        with self.assertNumQueries(2):
+            tree = series_tree.get_tree(self.series.pk)
+        self.assertEqual(tree['total_episodes'], 3)
+        self.assertEqual(tree['seasons'][0]['episode_count'], 3)
+        with self.assertNumQueries(0):
+            series_tree.get_tree(self.series.pk)
+        # Удаление ключа не доходит до кэшей других воркеров: дерево живёт ограниченное время
+        cache.clear()
+        with mock.patch.object(series_tree.cache, 'set') as cache_set:
+            series_tree.get_tree(self.series.pk)
+        cache_set.assert_called_once_with(series_tree.cache_key(self.series.pk), tree, series_tree.CACHE_TIMEOUT)
+
+    def test_invalidated_by_changes(self):
+        self.assertEqual(self.titles(), [(1, ['Эпизод 1', 'Эпизод 2', 'Эпизод 3'])])
+        season = Season.objects.create(media_content=self.series, season_number=2)
+        premiere = Episode.objects.create(season=season, episode_number=1, title='Премьера', description='')
+        self.assertEqual(self.titles(), [(1, ['Эпизод 1', 'Эпизод 2', 'Эпизод 3']), (2, ['Премьера'])])
+
+        self.episodes[1].title = 'Правда'
+        self.episodes[1].save()
+        self.episodes[2].delete()
+        self.assertEqual(self.titles(), [(1, ['Эпизод 1', 'Правда']), (2, ['Премьера'])])
+        # Навигация строится из того же дерева
+        self.assertEqual(navigation.neighbours(Episode.objects.get(pk=premiere.pk))[0]['id'], self.episodes[1].pk)
+
+        season.delete()
+        self.assertEqual(self.titles(), [(1, ['Эпизод 1', 'Правда'])])
+        self.assertEqual(navigation.neighbours(Episode.objects.get(pk=self.episodes[1].pk)), (
+            {'id': self.episodes[0].pk, 'season_number': 1, 'episode_number': 1, 'position': 1}, None,
+        ))
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        same_day = datetime.date(2020, 1, 1)
+        for number in range(7):
+            MediaContent.objects.create(
+                title=f'Фильм {number}', description='', country='Россия', age_restriction=0, content_type='MOVIE',
+                release_date=same_day if number < 5 else datetime.date(2021, number, 1),
+            )
+        self.queryset = MediaContent.objects.filter(content_type='MOVIE')
+        self.expected = list(self.queryset.order_by('-release_date', '-id').values_list('pk', flat=True))
+
+    def test_ties_on_release_date(self):
+        # Пять тайтлов с одной датой: порядок и границы страниц решает id
+        seen, cursor = [], None
+        while True:
+            items, cursor = keyset_page(self.queryset, cursor, size=2)
+            seen += [item.pk for item in items]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_last_page(self):
+        items, cursor = keyset_page(self.queryset, size=len(self.expected))
+        self.assertEqual((len(items), cursor), (len(self.expected), None))
+        items, cursor = keyset_page(self.queryset, encode_cursor(items[-1]))
+        self.assertEqual((items, cursor), ([], None))
+
+    def test_malformed_cursor_gives_first_page(self):
+        first = [item.pk for item in keyset_page(self.queryset, size=3)[0]]
+        for cursor in ('abc', '2020-01-01', '2020-13-01.5', '2020-01-01.x', '2020-01-01.-5', '2020-01-01.٣',
+                       '2020-01-01.' + '9' * 19, '2020-01-01.' + '9' * 5000, '2020-01-01.1.2'):
+            self.assertIsNone(decode_cursor(cursor), cursor)
+            self.assertEqual([item.pk for item in keyset_page(self.queryset, cursor, size=3)[0]], first)
+        self.assertEqual(decode_cursor(f'2020-01-01.{facets.MAX_ID}'), (datetime.date(2020, 1, 1), facets.MAX_ID))
+
+        response = self.client.get(reverse('kf_app:movies_page'), {'after': '2020-01-01.' + '9' * 30})
+        self.assertEqual(response.status_code, 200)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        drama, comedy = Genre.objects.create(name='Драма'), Genre.objects.create(name='Комедия')
+        director = Person.objects.create(first_name='Иван', last_name='Петров')
+        self.a, self.b, self.c, self.d = (
+            MediaContent.objects.create(
+                title=title, description='', release_date=datetime.date(2020, 1, 1), country='Россия',
+                age_restriction=0, content_type='MOVIE',
+            )
+            for title in ('А', 'Б', 'В', 'Г')
+        )
+        self.a.genres.add(drama)
+        self.b.genres.add(drama)
+        self.c.genres.add(comedy)
+        for item in (self.a, self.c):
+            ContentParticipation.objects.create(media_content=item, person=director, role='DIRECTOR')
+        self.users = [User.objects.create(email=f'r{number}@example.com', first_name='Зритель') for number in range(4)]
+        for user in self.users[:2]:
+            for item in (self.a, self.b):
+                ViewHistory.objects.create(user=user, media_content=item, viewed_seconds=60)
+        ViewHistory.objects.create(user=self.users[2], media_content=self.c, viewed_seconds=60)
+
+    def test_compute_neighbours(self):
+        weights = recommendations.WEIGHTS
+        rows = {(media_id, other_id): (score, rank) for media_id, other_id, score, rank in recommendations.compute()}
+        # А и Б: одни зрители и общий жанр; А и В - только общий режиссёр; Г ни с кем не связан
+        self.assertAlmostEqual(rows[(self.a.pk, self.b.pk)][0], weights['cooccurrence'] + weights['genres'], places=5)
+        self.assertAlmostEqual(rows[(self.a.pk, self.c.pk)][0], weights['people'], places=5)
+        self.assertEqual([rows[(self.a.pk, self.b.pk)][1], rows[(self.a.pk, self.c.pk)][1]], [1, 2])
+        self.assertNotIn((self.b.pk, self.c.pk), rows)
+        self.assertFalse([key for key in rows if self.d.pk in key])
+        self.assertEqual(len(recommendations.compute(top_k=1)), 3)
+
+    def test_rebuild_and_similar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(recommendations.rebuild(), 4)
+        self.assertEqual(recommendations.similar(self.a.pk), [self.b, self.c])
+        self.assertEqual(recommendations.similar(self.d.pk), [])
+        # Повторный расчёт заменяет строки, а не добавляет
+        version = fragments.get_versions([('recommendations', 0)])[0]
+        self.assertEqual(recommendations.rebuild(), 4)
+        self.assertEqual(recommendations.similar(self.a.pk), [self.b, self.c])
+        self.assertGreater(fragments.get_versions([('recommendations', 0)])[0], version)
+
+    def test_for_user(self):
+        recommendations.rebuild()
+        viewer = self.users[3]
+        ViewHistory.objects.create(user=viewer, media_content=self.a, viewed_seconds=60)
+        self.assertEqual(recommendations.for_user(viewer.pk), [self.b, self.c])
+        # Просмотренное и избранное не рекомендуется
+        Favorite.objects.create(user=viewer, media_content=self.b)
+        self.assertEqual(recommendations.for_user(viewer.pk), [self.c])
+        self.assertEqual(recommendations.for_user(self.users[2].pk), [self.a])
+
+    def test_empty_and_cold_start(self):
+        # Новый зритель и аноним: персональной подборки нет
+        recommendations.rebuild()
+        self.assertEqual(recommendations.for_user(None), [])
+        self.assertEqual(recommendations.for_user(User.objects.create(email='new@example.com', first_name='Новый').pk), [])
+
+        # Каталог без связей: соседей нет, старые рекомендации удаляются
+        ViewHistory.objects.all().delete()
+        ContentParticipation.objects.all().delete()
+        MediaContent.genres.through.objects.all().delete()
+        self.assertEqual(recommendations.compute(), [])
+        self.assertEqual(recommendations.rebuild(), 0)
+        self.assertEqual(recommendations.similar(self.a.pk), [])
+
+        MediaContent.objects.exclude(pk=self.a.pk).delete()
+        self.assertEqual(recommendations.compute(), [])
@@ -1,15 +1,39 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+# Под ASGI страницы каталога и видео обслуживают async-версии views
+if settings.KF_ASYNC_VIEWS:
+    from . import async_views as catalog_views
+else:
+    catalog_views = views
 
 app_name = 'kf_app'
 
 urlpatterns = [
     path('', views.index, name='index'),
-    path('movies/', views.movies_list, name='movies_list'),
-    path('series/', views.series_list, name='series_list'),
-    path('movie/<int:pk>/', views.movie_detail, name='movie_detail'),
-    path('series/<int:pk>/', views.series_detail, name='series_detail'),
-    path('episode/<int:episode_id>/', views.episode_detail, name='episode_detail'),
+    path('movies/', catalog_views.movies_list, name='movies_list'),
+    path('movies/page/', catalog_views.movies_page, name='movies_page'),
+    path('series/', catalog_views.series_list, name='series_list'),
+    path('series/page/', catalog_views.series_page, name='series_page'),
+    path('movie/<int:pk>/', catalog_views.movie_detail, name='movie_detail'),
+    path('series/<int:pk>/', catalog_views.series_detail, name='series_detail'),
+    path('episode/<int:episode_id>/', catalog_views.episode_detail, name='episode_detail'),
+    path('search/', views.search_view, name='search'),
+    path('rate/<int:pk>/', views.rate_view, name='rate'),
+    path('favorites/<int:pk>/<str:action>/', views.favorite_view, name='favorite'),
+    path('progress/', views.report_progress, name='report_progress'),
+    path('stats/cache/', views.cache_stats, name='cache_stats'),
+    path('stats/perf/', views.perf_stats, name='perf_stats'),
+    path('movie/<int:pk>/stream/', catalog_views.movie_stream, name='movie_stream'),
+    path('episode/<int:episode_id>/stream/', catalog_views.episode_stream, name='episode_stream'),
+
+    # JSON API
+    path('api/catalog/', api.catalog, name='api_catalog'),
+    path('api/catalog/<int:pk>/', api.media_detail, name='api_media'),
+    path('api/series/<int:pk>/tree/', api.series_tree, name='api_series_tree'),
+    path('api/episodes/<int:episode_id>/', api.episode_detail, name='api_episode'),
+    path('api/people/<int:pk>/', api.person_detail, name='api_person'),
     
     # Аутентификация
     path('login/', views.login_view, name='login'),
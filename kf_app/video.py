@@ -0,0 +1,129 @@
+import logging
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Episode, MediaContent, VideoIndex
+from . import mp4
+
+logger = logging.getLogger(__name__)
+
+# faststart копирует файл целиком: один поток на процесс, запрос сохранения его не ждёт
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='video')
+
+
+def index_lookup(instance):
+    return {'episode': instance} if isinstance(instance, Episode) else {'media_content': instance}
+
+
+def index_is_current(index, field):
+    return (
+        index is not None
+        and index.file_name == field.name
+        and index.file_size == os.path.getsize(field.path)
+    )
+
+
+def is_pending(instance):
+    """Файл загружен, но актуального VideoIndex для него ещё нет."""
+    field = instance.video_file
+    if not field or not os.path.exists(field.path):
+        return False
+    return not index_is_current(VideoIndex.objects.filter(**index_lookup(instance)).first(), field)
+
+
+def schedule(instance):
+    """Ставит файл в очередь фонового потока (вызывается после коммита сохранения).
+
+    Пока файл не обработан, он считается ожидающим (is_pending): если процесс
+    завершится раньше, файл подберёт index_videos.
+    """
+    executor.submit(process_in_worker, type(instance), instance.pk)
+
+
+def process_in_worker(model, pk):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None:
+            process_video(instance)
+    except Exception:
+        logger.exception("Ошибка обработки видео %s #%s", model.__name__, pk)
+    finally:
+        # Поток не обслуживает запросы: соединение закрываем сами
+        connection.close()
+
+
+def process_video(instance):
+    """Обработка загруженного видео: faststart, длительность, битрейт и ключевые кадры.
+
+    faststart переписывает файл целиком (для фильма - гигабайты), поэтому
+    вызывается не в запросе сохранения, а в фоновом потоке (schedule) или
+    командой index_videos. Если файл уже проиндексирован и не менялся,
+    ничего не делает.
+    """
+    field = instance.video_file
+    if not field or not os.path.exists(field.path):
+        return None
+
+    lookup = index_lookup(instance)
+    index = VideoIndex.objects.filter(**lookup).first()
+    if index_is_current(index, field):
+        return index
+
+    try:
+        if mp4.faststart(field.path) and hasattr(field.storage, 'adopt'):
+            # faststart подменил файл новым: имя переходит на блоб нового содержимого
+            field.storage.adopt(field.name)
+        info = mp4.probe(field.path)
+    except (mp4.Mp4Error, OSError, struct.error, IndexError, TypeError) as exc:
+        # Битый или не-MP4 файл: отдаём как есть, без индекса
+        logger.warning("Не удалось разобрать видео %s: %s", field.name, exc)
+        return None
+
+    index, _ = VideoIndex.objects.update_or_create(
+        **lookup,
+        defaults={
+            'file_name': field.name,
+            'file_size': info['size'],
+            'duration': info['duration'],
+            'bitrate': info['bitrate'],
+            'faststart': info['faststart'],
+            'keyframes': info['keyframes'],
+        },
+    )
+
+    # Длительность в минутах заполняем, только если её не указали вручную
+    if not instance.duration and info['duration']:
+        minutes = max(1, math.ceil(info['duration'] / 60))
+        type(instance).objects.filter(pk=instance.pk).update(duration=minutes, updated_at=timezone.now())
+        instance.duration = minutes
+    return index
+
+
+def seek_offset(instance, seconds):
+    """Смещение ключевого кадра не позже seconds по сохранённой таблице.
+
+    Файл при этом не читается. None - индекса нет или он устарел.
+    """
+    field = instance.video_file
+    index = VideoIndex.objects.filter(**index_lookup(instance)).first()
+    try:
+        if not index_is_current(index, field):
+            return None
+    except OSError:
+        return None
+    keyframe = index.keyframe_at(seconds)
+    return keyframe[1] if keyframe else None
+
+
+def process_all():
+    processed = 0
+    for model in (MediaContent, Episode):
+        for instance in model.objects.exclude(video_file='').exclude(video_file__isnull=True).iterator():
+            if process_video(instance):
+                processed += 1
+    return processed
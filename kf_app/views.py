@@ -1,7 +1,20 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import authenticate, logout
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import MediaContent, ContentParticipation, Season, Episode
-
-REGISTERED_USERS = {}
+from django.utils.http import url_has_allowed_host_and_scheme, urlencode
+from django.views.decorators.http import require_POST, require_safe
+from . import accounts, entitlements, favorites, fragments, perf, progress, ratings, recommendations, video
+from .accounts import RegistrationError, session_user_id
+from .conditional import episode_state, list_state, media_state, page_condition
+from .facets import apply_filters, facet_groups, selected_filters
+from .models import MediaContent, ContentParticipation, Episode
+from .navigation import neighbours
+from .pagination import keyset_page
+from .search import search
+from .series_tree import get_tree
+from .streaming import serve_file
 
 def index(request):
     if request.method == 'POST' and 'name' in request.POST:
@@ -28,68 +41,233 @@ def index(request):
     }
     return render(request, 'kf_app/index.html', context)
 
+@page_condition(list_state('MOVIE'))
 def movies_list(request):
-    movies = MediaContent.objects.filter(content_type='MOVIE').order_by('-release_date')
+    filters = selected_filters(request.GET)
+    movies, next_cursor = keyset_page(
+        apply_filters(MediaContent.objects.filter(content_type='MOVIE'), filters), request.GET.get('after')
+    )
     context = {
         'movies': movies,
+        'next_cursor': next_cursor,
+        'favorite_ids': favorites.favorite_ids(session_user_id(request)),
+        'facets': facet_groups('MOVIE', filters),
+        'filter_query': urlencode(filters),
     }
     return render(request, 'kf_app/movies.html', context)
 
+@page_condition(list_state('MOVIE'))
+def movies_page(request):
+    filters = selected_filters(request.GET)
+    movies, next_cursor = keyset_page(
+        apply_filters(MediaContent.objects.filter(content_type='MOVIE'), filters), request.GET.get('after')
+    )
+    context = {
+        'items': movies,
+        'detail_url': 'kf_app:movie_detail',
+        'next_cursor': next_cursor,
+        'filter_query': urlencode(filters),
+        'favorite_ids': favorites.favorite_ids(session_user_id(request)),
+    }
+    return render(request, 'kf_app/partials/media_cards.html', context)
+
+@page_condition(list_state('SERIES'))
 def series_list(request):
-    series = MediaContent.objects.filter(content_type='SERIES').order_by('-release_date')
+    filters = selected_filters(request.GET)
+    series, next_cursor = keyset_page(
+        apply_filters(MediaContent.objects.filter(content_type='SERIES'), filters), request.GET.get('after')
+    )
     context = {
         'series': series,
+        'next_cursor': next_cursor,
+        'favorite_ids': favorites.favorite_ids(session_user_id(request)),
+        'facets': facet_groups('SERIES', filters),
+        'filter_query': urlencode(filters),
     }
     return render(request, 'kf_app/series.html', context)
 
+@page_condition(list_state('SERIES'))
+def series_page(request):
+    filters = selected_filters(request.GET)
+    series, next_cursor = keyset_page(
+        apply_filters(MediaContent.objects.filter(content_type='SERIES'), filters), request.GET.get('after')
+    )
+    context = {
+        'items': series,
+        'detail_url': 'kf_app:series_detail',
+        'next_cursor': next_cursor,
+        'filter_query': urlencode(filters),
+        'favorite_ids': favorites.favorite_ids(session_user_id(request)),
+    }
+    return render(request, 'kf_app/partials/media_cards.html', context)
+
+@page_condition(media_state('MOVIE'))
 def movie_detail(request, pk):
     movie = get_object_or_404(MediaContent, pk=pk, content_type='MOVIE')
     participants = ContentParticipation.objects.filter(media_content=movie).select_related('person')
-    
+    user_id = session_user_id(request)
+
     context = {
         'media': movie,
         'participants': participants,
+        'resume_seconds': progress.resume_position(user_id, media_content_id=movie.pk) if user_id else 0,
+        'user_vote': ratings.user_vote(user_id, movie.pk),
+        'rating_scale': ratings.SCALE,
+        'is_favorite': movie.pk in favorites.favorite_ids(user_id),
+        'can_watch': entitlements.can_watch(user_id),
+        'similar': recommendations.similar(movie.pk),
     }
     return render(request, 'kf_app/movie_detail.html', context)
 
+@page_condition(media_state('SERIES'))
 def series_detail(request, pk):
     series = get_object_or_404(MediaContent, pk=pk, content_type='SERIES')
     participants = ContentParticipation.objects.filter(media_content=series).select_related('person')
-    seasons = series.season_set.all().prefetch_related('episode_set')
-    
-    total_episodes = 0
-    for season in seasons:
-        total_episodes += season.episode_set.count()
-    
+    tree = get_tree(series.pk)
+    user_id = session_user_id(request)
+
     context = {
         'media': series,
         'participants': participants,
-        'seasons': seasons,
-        'total_episodes': total_episodes,
+        'seasons': tree['seasons'],
+        'total_episodes': tree['total_episodes'],
+        'user_vote': ratings.user_vote(user_id, series.pk),
+        'rating_scale': ratings.SCALE,
+        'is_favorite': series.pk in favorites.favorite_ids(user_id),
+        'similar': recommendations.similar(series.pk),
     }
     return render(request, 'kf_app/series_detail.html', context)
 
+@page_condition(episode_state)
 def episode_detail(request, episode_id):
-    episode = get_object_or_404(Episode, pk=episode_id)
+    episode = get_object_or_404(Episode.objects.select_related('season__media_content'), pk=episode_id)
     season = episode.season
     series = season.media_content
-    
+    previous_episode, next_episode = neighbours(episode)
+    user_id = session_user_id(request)
+
     context = {
         'episode': episode,
         'season': season,
         'series': series,
+        'previous_episode': previous_episode,
+        'next_episode': next_episode,
+        'resume_seconds': progress.resume_position(user_id, episode_id=episode.pk) if user_id else 0,
+        'can_watch': entitlements.can_watch(user_id),
     }
     return render(request, 'kf_app/episode_detail.html', context)
 
+def search_view(request):
+    query = request.GET.get('q', '').strip()
+    results = search(query) if query else []
+    context = {
+        'title': f'Поиск: {query}' if query else 'Поиск',
+        'query': query,
+        'results': results,
+    }
+    return render(request, 'kf_app/search.html', context)
+
+@require_POST
+def report_progress(request):
+    user_id = session_user_id(request)
+    if user_id is None:
+        return JsonResponse({'error': 'Требуется вход'}, status=403)
+
+    seconds = progress.parse_position(request.POST.get('position'))
+    if seconds is None:
+        return JsonResponse({'error': 'Некорректная позиция'}, status=400)
+    media_id = progress.parse_id(request.POST.get('media_content'))
+    episode_id = progress.parse_id(request.POST.get('episode'))
+    if (media_id is None) == (episode_id is None):
+        return JsonResponse({'error': 'Укажите фильм или эпизод'}, status=400)
+
+    progress.record(user_id, seconds, media_content_id=media_id, episode_id=episode_id)
+    return HttpResponse(status=204)
+
+@require_POST
+def rate_view(request, pk):
+    media = get_object_or_404(MediaContent, pk=pk)
+    user_id = session_user_id(request)
+    if user_id is None:
+        return redirect('kf_app:login')
+
+    score = request.POST.get('score', '')
+    if score.isdigit() and 1 <= int(score) <= 10:
+        ratings.cast_vote(user_id, media.pk, int(score))
+    elif not score:
+        ratings.retract_vote(user_id, media.pk)
+
+    if media.content_type == 'SERIES':
+        return redirect('kf_app:series_detail', pk=media.pk)
+    return redirect('kf_app:movie_detail', pk=media.pk)
+
+FAVORITE_ACTIONS = {
+    'add': favorites.add,
+    'remove': favorites.remove,
+    'toggle': favorites.toggle,
+}
+
+@require_POST
+def favorite_view(request, pk, action):
+    if action not in FAVORITE_ACTIONS:
+        raise Http404("Неизвестное действие")
+    media = get_object_or_404(MediaContent, pk=pk)
+    user_id = session_user_id(request)
+    if user_id is None:
+        if 'application/json' in request.headers.get('Accept', ''):
+            return JsonResponse({'error': 'Требуется вход'}, status=403)
+        return redirect('kf_app:login')
+
+    state = FAVORITE_ACTIONS[action](user_id, media.pk)
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({'favorite': state})
+
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    if media.content_type == 'SERIES':
+        return redirect('kf_app:series_detail', pk=media.pk)
+    return redirect('kf_app:movie_detail', pk=media.pk)
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(fragments.stats())
+
+@staff_member_required
+def perf_stats(request):
+    return JsonResponse(perf.stats())
+
+def time_seek(request, item):
+    # ?t=<секунды>: смещение ближайшего ключевого кадра из VideoIndex, файл не перечитывается
+    seconds = progress.parse_position(request.GET.get('t'))
+    return video.seek_offset(item, seconds) if seconds is not None else None
+
+@require_safe
+def movie_stream(request, pk):
+    movie = get_object_or_404(MediaContent, pk=pk, content_type='MOVIE')
+    if not movie.video_file:
+        raise Http404("Видео недоступно")
+    if not entitlements.can_watch(session_user_id(request)):
+        raise PermissionDenied("Нужна активная подписка")
+    return serve_file(request, movie.video_file.path, seek=time_seek(request, movie))
+
+@require_safe
+def episode_stream(request, episode_id):
+    episode = get_object_or_404(Episode, pk=episode_id)
+    if not episode.video_file:
+        raise Http404("Видео недоступно")
+    if not entitlements.can_watch(session_user_id(request)):
+        raise PermissionDenied("Нужна активная подписка")
+    return serve_file(request, episode.video_file.path, seek=time_seek(request, episode))
+
 def login_view(request):
     if request.method == 'POST':
         username = request.POST.get('username')
         password = request.POST.get('password')
         
-        if username in REGISTERED_USERS and REGISTERED_USERS[username]['password'] == password:
-            request.session['is_authenticated'] = True
-            request.session['username'] = username
-            request.session['email'] = REGISTERED_USERS[username]['email']
+        account = authenticate(request, username=username, password=password)
+        if account is not None:
+            accounts.login(request, account)
             return redirect('kf_app:index')
         else:
             context = {
@@ -117,14 +295,16 @@ def register_view(request):
             }
             return render(request, 'kf_app/register.html', context)
         
-        REGISTERED_USERS[username] = {
-            'email': email,
-            'password': password
-        }
+        try:
+            account = accounts.register(username, email, password)
+        except RegistrationError as exc:
+            context = {
+                'title': 'Регистрация в CINEMAX',
+                'error': str(exc)
+            }
+            return render(request, 'kf_app/register.html', context)
         
-        request.session['is_authenticated'] = True
-        request.session['username'] = username
-        request.session['email'] = email
+        accounts.login(request, account)
         return redirect('kf_app:index')
     
     context = {
@@ -138,14 +318,17 @@ def profile_view(request):
     
     username = request.session.get('username')
     email = request.session.get('email')
+    user_id = session_user_id(request)
     
     context = {
         'title': f'Профиль - {username}',
         'username': username,
         'email': email,
+        'continue_watching': progress.continue_watching(user_id),
+        'recommended': recommendations.for_user(user_id),
     }
     return render(request, 'kf_app/profile.html', context)
 
 def logout_view(request):
-    request.session.flush()
+    logout(request)
     return redirect('kf_app:index')
\ No newline at end of file
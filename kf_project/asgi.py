@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kf_project.settings')
+# Под ASGI каталог и видео обслуживают async views (см. kf_app.async_views)
+os.environ.setdefault('KF_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: время ответа включает все остальные middleware (см. kf_app.perf)
+    'kf_app.perf.perf_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +57,8 @@ ROOT_URLCONF = 'kf_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Стандартный бэкенд с замером времени рендеринга
+        'BACKEND': 'kf_app.perf.DjangoTemplates',
         'DIRS': [
             BASE_DIR / 'kf_app' / 'templates',  
         ],
@@ -73,6 +76,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'kf_project.wsgi.application'
 
+# Async-версии страниц каталога и раздачи видео (kf_app.async_views);
+# kf_project/asgi.py включает их по умолчанию
+KF_ASYNC_VIEWS = os.environ.get('KF_ASYNC_VIEWS', '0') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -84,6 +91,74 @@ DATABASES = {
     }
 }
 
+# Профиль окружения: development (по умолчанию) или production
+KF_PROFILE = os.environ.get('KF_PROFILE', 'development')
+
+# PRAGMA для каждого соединения SQLite (применяются в kf_app.db)
+SQLITE_PRODUCTION_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,
+}
+
+if KF_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # BEGIN IMMEDIATE: писатель берёт блокировку сразу и ждёт busy_timeout,
+        # а не получает SQLITE_BUSY при повышении блокировки посреди транзакции
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        'PRAGMAS': SQLITE_PRODUCTION_PRAGMAS,
+    })
+
+
+# Cache
+# По умолчанию кэш в памяти процесса. При нескольких воркерах нужен общий
+# кэш, иначе сброс по сигналам увидит только один процесс:
+# KF_CACHE_URL=redis://127.0.0.1:6379/1
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cinemax',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+if os.environ.get('KF_CACHE_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['KF_CACHE_URL'],
+    }
+
+
+# Sessions
+# Сессии хранятся в базе. С общим кэшем (KF_CACHE_URL) они ещё и читаются
+# из него: запрос вошедшего пользователя обычно не читает django_session.
+# С кэшем в памяти процесса так нельзя: после выхода другие воркеры
+# продолжали бы отдавать сессию из своей копии.
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+if os.environ.get('KF_CACHE_URL'):
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Просмотр видео только при активной подписке (см. kf_app.entitlements)
+PLAYBACK_REQUIRES_SUBSCRIPTION = os.environ.get('KF_PLAYBACK_REQUIRES_SUBSCRIPTION', '1') == '1'
+
+
+# Замеры запросов (kf_app.perf): заголовок Server-Timing и выборочный cProfile
+# запросов медленнее PERF_PROFILE_THRESHOLD_MS в каталог PERF_PROFILE_DIR.
+# Server-Timing видят все клиенты, поэтому по умолчанию он выключен
+PERF_SERVER_TIMING = os.environ.get('KF_SERVER_TIMING', '0') == '1'
+PERF_PROFILE_RATE = float(os.environ.get('KF_PERF_PROFILE_RATE', '0'))
+PERF_PROFILE_THRESHOLD_MS = 500
+PERF_PROFILE_DIR = BASE_DIR / 'profiles'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,6 +202,15 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+if KF_PROFILE == 'production':
+    # collectstatic: имена с хэшем содержимого и сжатые .gz/.br копии;
+    # static_middleware раздаёт их из памяти-индекса до остальных middleware
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'kf_app.staticfiles.CompressedManifestStaticFilesStorage'},
+    }
+    MIDDLEWARE.insert(0, 'kf_app.staticfiles.static_middleware')
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 